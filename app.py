@@ -25,7 +25,16 @@ import sys
 
 # Eigene Module importieren
 import shopify_api
-from data_models import ShopMetrics, DataAnalyzer, add_tracking_event, get_shop_tracking_data
+import data_models
+import rfm
+import recommender
+import hourly_metrics
+import order_sync
+import dashboard_snapshots
+import webhook_registration
+from data_models import ShopMetrics, DataAnalyzer, get_shop_tracking_data
+from event_buffer import get_event_buffer
+from webhook_queue import get_webhook_queue, get_webhook_worker
 from growth_advisor import GrowthAdvisor
 
 # Logger einrichten
@@ -42,9 +51,6 @@ logger.info("🚀 Starte Logger für Shopify App Authentifizierung")
 # Environment-Variablen laden
 load_dotenv()
 
-# Pfad zur Tracking-Datendatei
-TRACKING_DATA_FILE = 'tracking_data.json'
-
 # Flask App konfigurieren
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1)
@@ -320,34 +326,30 @@ def get_user_language():
     return 'en'
 
 def save_tracking_data(data=None):
-    """Speichert die Tracking-Daten in einer JSON-Datei."""
+    """Speichert die Tracking-Daten im segmentierten Event-Store."""
     global tracking_data
     try:
         if data is not None:
             tracking_data = data
-        with open(TRACKING_DATA_FILE, 'w') as f:
-            json.dump(tracking_data, f)
-        print(f"Tracking-Daten in {TRACKING_DATA_FILE} gespeichert.")
+        data_models.save_tracking_data(tracking_data)
+        print(f"Tracking-Daten im Event-Store gespeichert.")
     except Exception as e:
         print(f"Fehler beim Speichern der Tracking-Daten: {e}")
 
 def load_tracking_data():
-    """Lädt die Tracking-Daten aus einer JSON-Datei oder dem globalen Dictionary."""
+    """Lädt die Tracking-Daten streamend aus dem Event-Store."""
     global tracking_data
     
-    # Versuche, die Daten aus der Datei zu laden
     try:
-        if os.path.exists(TRACKING_DATA_FILE):
-            with open(TRACKING_DATA_FILE, 'r') as f:
-                tracking_data = json.load(f)
-                print(f"Tracking-Daten aus {TRACKING_DATA_FILE} geladen.")
-                
-                # Stelle sicher, dass alle Shop-Einträge die korrekten Unterstrukturen haben
-                for shop_domain in tracking_data:
-                    if 'pageviews' not in tracking_data[shop_domain]:
-                        tracking_data[shop_domain]['pageviews'] = []
-                    if 'clicks' not in tracking_data[shop_domain]:
-                        tracking_data[shop_domain]['clicks'] = []
+        tracking_data = data_models.load_tracking_data()
+        print(f"Tracking-Daten aus dem Event-Store geladen.")
+        
+        # Stelle sicher, dass alle Shop-Einträge die korrekten Unterstrukturen haben
+        for shop_domain in tracking_data:
+            if 'pageviews' not in tracking_data[shop_domain]:
+                tracking_data[shop_domain]['pageviews'] = []
+            if 'clicks' not in tracking_data[shop_domain]:
+                tracking_data[shop_domain]['clicks'] = []
     except Exception as e:
         print(f"Fehler beim Laden der Tracking-Daten: {e}")
         tracking_data = {}
@@ -355,9 +357,7 @@ def load_tracking_data():
     return tracking_data
 
 def get_shop_data(shop_domain):
-    """Holt oder erstellt die Tracking-Daten für einen bestimmten Shop."""
-    global tracking_data
-    
+    """Holt die Tracking-Daten für einen bestimmten Shop aus dem Event-Store."""
     # Validiere shop_domain
     if not shop_domain or not isinstance(shop_domain, str):
         print(f"⚠️ Ungültige Shop-Domain: {shop_domain}")
@@ -368,28 +368,18 @@ def get_shop_data(shop_domain):
         shop_domain = shop_domain[:-1]
         print(f"🔧 Shop-Domain bereinigt: {shop_domain}")
     
-    # Wenn der Shop noch nicht im Dictionary existiert, initialisiere ihn
-    if shop_domain not in tracking_data:
-        print(f"🆕 Initialisiere neuen Shop: {shop_domain}")
-        tracking_data[shop_domain] = {
-            'pageviews': [],
-            'clicks': [],
-            'created_at': datetime.datetime.now().isoformat(),
-            'last_updated': datetime.datetime.now().isoformat()
-        }
-        save_tracking_data()
+    # Der Ereignislog eines neuen Shops wird beim ersten Ereignis angelegt,
+    # daher ist hier kein Schreibvorgang mehr nötig
+    shop_data = get_shop_tracking_data(shop_domain)
     
     # Stelle sicher, dass die Schlüssel existieren
-    if 'pageviews' not in tracking_data[shop_domain]:
-        tracking_data[shop_domain]['pageviews'] = []
-    
-    if 'clicks' not in tracking_data[shop_domain]:
-        tracking_data[shop_domain]['clicks'] = []
+    shop_data.setdefault('pageviews', [])
+    shop_data.setdefault('clicks', [])
     
     # Datum für 'last_updated' aktualisieren
-    tracking_data[shop_domain]['last_updated'] = datetime.datetime.now().isoformat()
+    shop_data['last_updated'] = datetime.datetime.now().isoformat()
     
-    return tracking_data[shop_domain]
+    return shop_data
 
 def generate_implementation_tasks():
     """Generiert priorisierte Umsetzungsaufgaben"""
@@ -453,6 +443,20 @@ def hmac_validation(params):
     
     return hmac.compare_digest(calculated_hmac, hmac_value)
 
+def verify_webhook(data, hmac_header):
+    """Validiert die HMAC-Signatur eines Shopify-Webhooks (Base64-kodiert im Header)."""
+    if not hmac_header:
+        return False
+
+    digest = hmac.new(
+        SHOPIFY_API_SECRET.encode('utf-8'),
+        data,
+        hashlib.sha256
+    ).digest()
+    calculated_hmac = base64.b64encode(digest).decode('utf-8')
+
+    return hmac.compare_digest(calculated_hmac, hmac_header)
+
 # Hilfsfunktion zur Authentifizierungsprüfung
 def is_authenticated():
     """Prüft, ob der aktuelle Benutzer authentifiziert ist"""
@@ -485,6 +489,8 @@ def enforce_authentication():
             '/debug-dashboard',
             '/cookie-hilfe',
             '/api/auth-check',  # Pfad für Frontend-Authentifizierungsprüfung
+            '/collect',  # Tracking-Endpunkt für das Storefront-Skript
+            '/webhook/',  # Shopify-Webhooks werden per HMAC geprüft
             '/'  # Root-Pfad wird separat behandelt
         ]
         
@@ -825,6 +831,9 @@ def auth_callback():
         response.set_cookie('session', value=request.cookies.get('session', ''),
                           secure=True, httponly=True, samesite='Lax')
         
+        # Shop für Hintergrund-Jobs und den Webhook-Abgleich merken
+        data_models.register_shop(shop, access_token)
+        
         # Webhooks für wichtige Shop-Ereignisse registrieren
         try:
             register_webhooks(shop, access_token)
@@ -867,92 +876,18 @@ def get_base_url():
 
 def register_webhooks(shop, access_token):
     """
-    Registriert die erforderlichen Webhooks für den Shop über GraphQL.
+    Gleicht die Webhooks des Shops im Hintergrund ab (eine Abfrage, parallele Mutationen).
     """
     try:
         # Wenn kein Access Token verfügbar ist, können wir keine Webhooks registrieren
         if not access_token:
             print("⚠️ Kein Access Token für Webhook-Registrierung verfügbar")
             return False
-            
-        # GraphQL Endpoint
-        url = f"https://{shop}/admin/api/2024-01/graphql.json"
-        headers = {
-            'X-Shopify-Access-Token': access_token,
-            'Content-Type': 'application/json'
-        }
-        
-        # Liste der Webhooks, die registriert werden sollen
-        webhooks_to_register = [
-            # App-Webhooks
-            "APP_UNINSTALLED",
-            "SHOP_UPDATE",
-            
-            # GDPR Compliance Webhooks
-            "CUSTOMERS_DATA_REQUEST",
-            "CUSTOMERS_REDACT",
-            "SHOP_REDACT"
-        ]
-        
-        # Vollständige Basis-URL mit HTTPS abrufen
-        base_url = get_base_url()
         
-        # Registriere jeden Webhook
-        for topic in webhooks_to_register:
-            # GraphQL Mutation zum Erstellen des Webhooks
-            mutation = """
-            mutation webhookSubscriptionCreate($topic: WebhookSubscriptionTopic!, $callbackUrl: URL!) {
-              webhookSubscriptionCreate(
-                topic: $topic
-                webhookSubscription: {
-                  callbackUrl: $callbackUrl
-                  format: JSON
-                }
-              ) {
-                webhookSubscription {
-                  id
-                }
-                userErrors {
-                  field
-                  message
-                }
-              }
-            }
-            """
-            
-            # Webhook-URL basierend auf dem Topic
-            topic_path = topic.lower().replace("_", "/")
-            webhook_url = f"{base_url}/webhook/{topic_path}"
-            
-            print(f"🔄 Registriere Webhook für {topic} mit URL: {webhook_url}")
-            
-            # Variablen für die Mutation
-            variables = {
-                "topic": topic,
-                "callbackUrl": webhook_url
-            }
-            
-            # GraphQL-Aufruf durchführen
-            response = requests.post(
-                url,
-                json={'query': mutation, 'variables': variables},
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if 'errors' not in result and 'data' in result:
-                    print(f"✅ Webhook für {topic} erfolgreich registriert")
-                else:
-                    print(f"❌ Fehler beim Registrieren des Webhooks für {topic}: {result.get('errors')}")
-            else:
-                print(f"❌ Fehler beim Registrieren des Webhooks für {topic}: {response.status_code} - {response.text}")
-                
+        webhook_registration.reconcile_in_background(shop, access_token, get_base_url())
         return True
     except Exception as e:
         print(f"❌ Fehler beim Registrieren der Webhooks: {e}")
-        import traceback
-        traceback.print_exc()
         return False
 
 def verify_session_token(token):
@@ -1243,6 +1178,81 @@ def api_data():
         logger.error(f"API-Fehler: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Zuordnung der Ereignistypen aus tracking.js zu den gespeicherten Ereignislisten
+COLLECT_EVENT_TYPES = {
+    'page_view': 'pageviews',
+    'pageview': 'pageviews',
+    'click': 'clicks'
+}
+
+@app.route('/collect', methods=['POST', 'OPTIONS'])
+def collect():
+    """Nimmt Tracking-Ereignisse aus dem Storefront entgegen und puffert sie für Batch-Schreibvorgänge"""
+    # CORS für OPTIONS-Anfragen
+    if request.method == 'OPTIONS':
+        response = make_response()
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+        response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
+        return response
+    
+    try:
+        payload = request.get_json(force=True, silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({"error": "Ungültige Tracking-Daten"}), 400
+        
+        shop_domain = payload.get('shop_domain')
+        event_type = COLLECT_EVENT_TYPES.get(payload.get('event_type'))
+        if not shop_domain or not isinstance(shop_domain, str) or not event_type:
+            return jsonify({"error": "shop_domain oder event_type fehlt"}), 400
+        
+        event = {
+            'page': payload.get('page'),
+            'page_url': payload.get('page_url'),
+            'visitor_id': payload.get('session_id'),
+            'client_timestamp': payload.get('timestamp'),
+            'timestamp': datetime.datetime.now().isoformat(),
+            'device': request.user_agent.platform or 'unknown'
+        }
+        if event_type == 'clicks':
+            event['clicked_tag'] = payload.get('clicked_tag')
+        
+        # Ereignis nur puffern - das Schreiben erfolgt gesammelt im Hintergrund
+        event_buffer = get_event_buffer()
+        if not event_buffer.add(shop_domain.strip(), event_type, event):
+            response = jsonify({"status": "rejected", "message": "Tracking-Puffer für diesen Shop ist voll"})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(int(event_buffer.flush_interval) + 1)
+            return response
+        
+        return jsonify({"status": "accepted"}), 202
+        
+    except Exception as e:
+        logger.error(f"Fehler im Collect-Endpunkt: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/collect-stats', methods=['GET'])
+def collect_stats():
+    """Gibt die Backpressure-Zähler des Tracking-Puffers für den aktuellen Shop zurück"""
+    shop_domain = get_shop_from_session()
+    if not shop_domain:
+        return jsonify({"error": "Nicht authentifiziert"}), 401
+    
+    return jsonify({"shop": shop_domain, "stats": get_event_buffer().get_stats(shop_domain)})
+
+@app.route('/api/throttle-status', methods=['GET'])
+def throttle_status():
+    """Gibt den aktuellen Stand des GraphQL-Kosten-Buckets für den aktuellen Shop zurück"""
+    shop_domain = get_shop_from_session()
+    if not shop_domain:
+        return jsonify({"error": "Nicht authentifiziert"}), 401
+    
+    return jsonify({
+        "shop": shop_domain,
+        "bucket": shopify_api.get_throttle_metrics(shop_domain),
+        "coalescing": shopify_api.get_coalescing_metrics(shop_domain)
+    })
+
 @app.route('/dashboard')
 def dashboard():
     """Dashboard-Seite mit dynamischen Daten aus Shopify API."""
@@ -1267,226 +1277,56 @@ def dashboard():
     except ValueError:
         period = 7
     
-    # Metriken und Analyse abrufen
-    shop_metrics = ShopMetrics(shop_domain)
-    data_analyzer = DataAnalyzer(shop_metrics)
+    # Zeitraum als Text
+    period_text = {
+        7: translations.get("dashboard", {}).get("last_seven_days", "Letzte 7 Tage"),
+        30: translations.get("dashboard", {}).get("last_thirty_days", "Letzte 30 Tage"),
+        90: translations.get("dashboard", {}).get("last_ninety_days", "Letzte 90 Tage"),
+        365: translations.get("dashboard", {}).get("last_year", "Letzte 12 Monate")
+    }.get(period, f"Letzte {period} Tage")
     
-    # Tatsächliche Shop-Daten von der Shopify API abrufen
-    shopinfo = None
-    products = []
-    orders = []
-    customers = []
+    # Tracking-Ereignis für diesen Dashboard-Aufruf puffern
+    get_event_buffer().add(shop_domain, 'pageviews', {
+        'page': 'dashboard',
+        'visitor_id': str(uuid.uuid4()),  # Im Produktionseinsatz würde ein konsistenter Benutzer-Identifikator verwendet
+        'timestamp': datetime.datetime.now().isoformat(),
+        'device': request.user_agent.platform or 'unknown'
+    })
     
     try:
-        # Shop-Informationen abrufen
-        shopinfo = shopify_api.get_shop_info(shop_domain, access_token)
-        
-        # Produkte, Bestellungen und Kunden abrufen
-        products = shopify_api.get_products(shop_domain, access_token, limit=25)
-        orders = shopify_api.get_orders(shop_domain, access_token, limit=25)
-        
-        # Nur wenn die Daten einen 'edges'-Schlüssel haben
-        product_edges = products.get('edges', [])
-        order_edges = orders.get('edges', [])
-        
-        # Kundendaten nur laden, wenn genügend Zeit und API-Limits verfügbar sind
-        customers = shopify_api.get_customers(shop_domain, access_token, limit=25)
-        customer_edges = customers.get('edges', [])
-        
-        # Tracking-Daten für den Shop laden
-        shop_tracking = get_shop_tracking_data(shop_domain)
-        
-        # Metriken aktualisieren
-        if product_edges:
-            shop_metrics.update_product_metrics(product_edges)
-        
-        if order_edges:
-            shop_metrics.update_revenue_metrics(order_edges)
-        
-        if customer_edges:
-            shop_metrics.update_customer_metrics(customer_edges)
-        
-        if shop_tracking:
-            shop_metrics.update_traffic_metrics(shop_tracking)
-        
-        # Speichern Sie ein Tracking-Ereignis für diesen Dashboard-Aufruf
-        add_tracking_event(shop_domain, 'pageviews', {
-            'page': 'dashboard',
-            'visitor_id': str(uuid.uuid4()),  # Im Produktionseinsatz würde ein konsistenter Benutzer-Identifikator verwendet
-            'timestamp': datetime.datetime.now().isoformat(),
-            'device': request.user_agent.platform or 'unknown'
-        })
-        
-        # Überprüfen, ob wir echte Daten haben oder Simulationen verwenden müssen
-        has_real_products = bool(product_edges)
-        has_real_orders = bool(order_edges)
-        has_real_customers = bool(customer_edges)
-        
-        # Daten für Dashboard basierend auf echten oder simulierten Daten vorbereiten
-        if has_real_orders:
-            # Tatsächliche Verkaufsdaten verwenden
-            daily_revenue = shop_metrics.get_time_series_data('daily_revenue', period)
-            sales_data = [{"date": item["date"], "value": item["value"]} for item in daily_revenue]
-            total_sales = sum(item["value"] for item in daily_revenue)
-            
-            daily_orders = shop_metrics.get_time_series_data('daily_orders', period)
-            orders_data = [{"date": item["date"], "value": item["value"]} for item in daily_orders]
-            total_orders = sum(item["value"] for item in orders_data)
-            
-            # Durchschnittlichen Bestellwert berechnen
-            if total_orders > 0:
-                avg_order_value = total_sales / total_orders
-            else:
-                avg_order_value = 0
-        else:
-            # Simulierte Daten verwenden, wenn keine echten verfügbar sind
-            # (Vorhandener Code für simulierte Daten)
-            # - Hier kann der vorhandene Simulationscode bleiben -
-            sales_data = generate_sales_data(period)
-            total_sales = sum(item["value"] for item in sales_data)
-            orders_data = generate_order_data(period)
-            total_orders = sum(item["value"] for item in orders_data)
-            avg_order_value = total_sales / total_orders if total_orders > 0 else 0
-        
-        # Traffic-Daten aus tracking_data oder Simulation
-        pageviews = shop_metrics.get_time_series_data('daily_pageviews', period)
-        if pageviews:
-            total_pageviews = sum(item["value"] for item in pageviews)
-            pageviews_data = [{"date": item["date"], "value": item["value"]} for item in pageviews]
-        else:
-            # Simulierte Pageview-Daten
-            pageviews_data = generate_pageview_data(period)
-            total_pageviews = sum(item["value"] for item in pageviews_data)
-        
-        # Besucher-Daten aus tracking_data oder Simulation
-        visitors = shop_metrics.get_time_series_data('daily_visitors', period)
-        if visitors:
-            total_visitors = sum(item["value"] for item in visitors)
-            visitors_data = [{"date": item["date"], "value": item["value"]} for item in visitors]
-        else:
-            # Simulierte Besucherdaten
-            visitors_data = generate_visitor_data(period)
-            total_visitors = sum(item["value"] for item in visitors_data)
-        
-        # Trends berechnen
-        trends = {
-            "sales": calculate_trend(sales_data),
-            "orders": calculate_trend(orders_data),
-            "pageviews": calculate_trend(pageviews_data),
-            "visitors": calculate_trend(visitors_data),
-            "conversion_rate": {
-                "value": calculate_conversion_trend(visitors_data, orders_data),
-                "direction": "up" if calculate_conversion_trend(visitors_data, orders_data) > 0 else "down"
-            },
-            "session_duration": {"value": 5, "direction": "up"}  # Platzhalter
-        }
-        
-        # Konversionsrate berechnen
-        conversion_rate = (total_orders / total_pageviews * 100) if total_pageviews > 0 else 0
-        
-        # AI-generierte Empfehlungen
-        shop_data = {
-            "products": product_edges,
-            "orders": order_edges,
-            "customers": customer_edges
-        }
-        
-        # Wachstumsberater initialisieren und Empfehlungen generieren
-        growth_advisor = GrowthAdvisor(shop_metrics, shop_data)
-        
-        # AI-Quick-Tips generieren
-        ai_quick_tips = growth_advisor.generate_personalized_tips(shop_data, shop_tracking) or generate_ai_quick_tips()
-        
-        # Device-Statistik
-        device_stats = shop_metrics.metrics.get('device_stats', {})
-        if device_stats:
-            devices_data = [{"name": device, "value": count} for device, count in device_stats.items()]
-        else:
-            # Simulierte Gerätedaten
-            devices_data = [
-                {"name": "Desktop", "value": random.randint(40, 70)},
-                {"name": "Mobile", "value": random.randint(20, 50)},
-                {"name": "Tablet", "value": random.randint(5, 15)}
-            ]
-        
-        # Implementierungsaufgaben
-        implementation_items = generate_implementation_tasks()
-        
-        # Zeitperiode als Text
-        period_text = {
-            7: translations.get("dashboard", {}).get("last_seven_days", "Letzte 7 Tage"),
-            30: translations.get("dashboard", {}).get("last_thirty_days", "Letzte 30 Tage"),
-            90: translations.get("dashboard", {}).get("last_ninety_days", "Letzte 90 Tage")
-        }.get(period, f"Letzte {period} Tage")
-        
-        # Dashboard-Daten an das Template übergeben
-        return render_template('dashboard.html',
-            translations=translations,
-            shop_domain=shop_domain,
-            shop_info=shopinfo,
-            period=period,
-            period_text=period_text,
-            sales_data=json.dumps(sales_data),
-            orders_data=json.dumps(orders_data),
-            pageviews_data=json.dumps(pageviews_data),
-            visitors_data=json.dumps(visitors_data),
-            devices_data=json.dumps(devices_data),
-            total_sales=round(total_sales, 2),
-            total_orders=total_orders,
-            total_pageviews=total_pageviews,
-            total_clicks=total_orders,  # Vorläufig Klicks mit Bestellungen gleichsetzen
-            avg_order_value=round(avg_order_value, 2),
-            conversion_rate=round(conversion_rate, 2),
-            trends=trends,
-            ai_quick_tips=ai_quick_tips,
-            implementation_items=implementation_items,
-            has_real_data={
-                "products": has_real_products,
-                "orders": has_real_orders,
-                "customers": has_real_customers
-            }
-        )
+        # Vorberechneten Snapshot lesen; Shopify-Abrufe und Berechnungen laufen im Hintergrund
+        snapshot = dashboard_snapshots.get_snapshot(shop_domain, period, access_token)
+        error = None
     except Exception as e:
         logger.error(f"Fehler beim Laden des Dashboards: {e}")
-        # Fallback auf simulierte Daten bei API-Fehlern
-        return render_template('dashboard.html',
-            translations=translations,
-            shop_domain=shop_domain,
-            error=str(e),
-            period=period,
-            period_text=f"Letzte {period} Tage",
-            sales_data=json.dumps(generate_sales_data(period)),
-            orders_data=json.dumps(generate_order_data(period)),
-            pageviews_data=json.dumps(generate_pageview_data(period)),
-            visitors_data=json.dumps(generate_visitor_data(period)),
-            devices_data=json.dumps([
-                {"name": "Desktop", "value": 60},
-                {"name": "Mobile", "value": 30},
-                {"name": "Tablet", "value": 10}
-            ]),
-            total_sales=random.randint(5000, 10000),
-            total_orders=random.randint(100, 200),
-            total_pageviews=random.randint(2000, 5000),
-            total_clicks=random.randint(500, 1000),
-            avg_order_value=random.randint(50, 100),
-            conversion_rate=random.randint(2, 5),
-            trends={
-                "sales": {"value": random.randint(1, 10), "direction": "up"},
-                "orders": {"value": random.randint(1, 10), "direction": "up"},
-                "pageviews": {"value": random.randint(1, 10), "direction": "up"},
-                "visitors": {"value": random.randint(1, 10), "direction": "up"},
-                "conversion_rate": {"value": random.randint(1, 5), "direction": "up"},
-                "session_duration": {"value": random.randint(1, 5), "direction": "up"}
-            },
-            ai_quick_tips=generate_ai_quick_tips(),
-            implementation_items=generate_implementation_tasks(),
-            has_real_data={
-                "products": False,
-                "orders": False,
-                "customers": False
-            },
-            is_simulation=True
-        )
+        snapshot = dashboard_snapshots.build_snapshot(ShopMetrics(shop_domain), period)
+        error = str(e)
+    
+    # Dashboard-Daten an das Template übergeben
+    return render_template('dashboard.html',
+        translations=translations,
+        shop_domain=shop_domain,
+        error=error,
+        period=period,
+        period_text=period_text,
+        sales_data=json.dumps(snapshot["sales_data"]),
+        orders_data=json.dumps(snapshot["orders_data"]),
+        pageviews_data=json.dumps(snapshot["pageviews_data"]),
+        visitors_data=json.dumps(snapshot["visitors_data"]),
+        devices_data=json.dumps(snapshot["devices_data"]),
+        total_sales=snapshot["total_sales"],
+        total_orders=snapshot["total_orders"],
+        total_pageviews=snapshot["total_pageviews"],
+        total_clicks=snapshot["total_orders"],  # Vorläufig Klicks mit Bestellungen gleichsetzen
+        avg_order_value=snapshot["avg_order_value"],
+        conversion_rate=snapshot["conversion_rate"],
+        trends=snapshot["trends"],
+        ai_quick_tips=snapshot.get("ai_quick_tips") or generate_ai_quick_tips(),
+        implementation_items=generate_implementation_tasks(),
+        has_real_data=snapshot["has_real_data"],
+        snapshot_built_at=snapshot["built_at"],
+        snapshot_pending=snapshot.get("pending", False)
+    )
 
 @app.route('/growth-advisor')
 def growth_advisor():
@@ -1507,20 +1347,18 @@ def growth_advisor():
     translations = get_translations().get(user_language, {})
     
     try:
-        # Shop-Informationen und Daten abrufen
-        shopinfo = shopify_api.get_shop_info(shop_domain, access_token)
-        products = shopify_api.get_products(shop_domain, access_token, limit=25)
-        orders = shopify_api.get_orders(shop_domain, access_token, limit=25)
-        customers = shopify_api.get_customers(shop_domain, access_token, limit=25)
+        # Shop-Informationen und Daten parallel abrufen
+        bundle = shopify_api.fetch_shop_bundle(shop_domain, access_token, limit=25)
+        shopinfo = bundle.get('shop_info')
+        products = bundle.get('products') or {}
+        orders = bundle.get('orders') or {}
+        customers = bundle.get('customers') or {}
         
         # Nur wenn die Daten einen 'edges'-Schlüssel haben
         product_edges = products.get('edges', [])
         order_edges = orders.get('edges', [])
         customer_edges = customers.get('edges', [])
         
-        # Tracking-Daten für den Shop laden
-        shop_tracking = get_shop_tracking_data(shop_domain)
-        
         # Metriken laden
         shop_metrics = ShopMetrics(shop_domain)
         data_analyzer = DataAnalyzer(shop_metrics)
@@ -1593,8 +1431,8 @@ def growth_advisor():
                 }
             ]
         
-        # Speichern Sie ein Tracking-Ereignis für diesen Growth-Advisor-Aufruf
-        add_tracking_event(shop_domain, 'pageviews', {
+        # Tracking-Ereignis für diesen Growth-Advisor-Aufruf puffern
+        get_event_buffer().add(shop_domain, 'pageviews', {
             'page': 'growth_advisor',
             'visitor_id': str(uuid.uuid4()),
             'timestamp': datetime.datetime.now().isoformat(),
@@ -2562,170 +2400,142 @@ def generate_growth_advisor_recommendations(shop_data):
             }
         ]
 
-# Fixed customer_data_request function
-@app.route('/webhook/customers/data_request', methods=['POST'])
-def customer_data_request():
-    """Handler für GDPR Datenanfragen"""
+# Webhooks: Die Routen prüfen nur die Signatur und reihen den Webhook ein,
+# verarbeitet wird er vom Webhook-Worker außerhalb des Requests (Shopify wartet max. 5 s)
+webhook_worker = get_webhook_worker()
+# Liegengebliebene Webhooks nach einem Neustart sofort abarbeiten
+webhook_worker.ensure_running()
+
+def enqueue_webhook(topic):
+    """Prüft die HMAC-Signatur und legt den Webhook dauerhaft in die Warteschlange"""
+    data = request.get_data()
+    if not verify_webhook(data, request.headers.get('X-Shopify-Hmac-Sha256')):
+        return 'HMAC validation failed', 401
+
     try:
-        # Verifiziere den Webhook
-        hmac_header = request.headers.get('X-Shopify-Hmac-Sha256')
-        if not hmac_header:
-            return 'HMAC validation failed', 401
-
-        data = request.get_data()
-        calculated_hmac = hmac.new(
-            SHOPIFY_API_SECRET.encode('utf-8'),
-            data,
-            hashlib.sha256
-        ).hexdigest()
-
-        if not hmac.compare_digest(calculated_hmac, hmac_header):
-            return 'HMAC validation failed', 401
-
-        # Verarbeite die Datenanfrage
-        webhook_data = request.json
-        shop_domain = webhook_data.get('shop_domain')
-        customer_email = webhook_data.get('customer', {}).get('email')
-        
-        if shop_domain and customer_email:
-            # Hier würden Sie die Kundendaten sammeln und bereitstellen
-            print(f"GDPR Datenanfrage für Kunde {customer_email} von Shop {shop_domain}")
-            
+        webhook_data = json.loads(data) if data else {}
+        # Ohne Webhook-ID dedupliziert der Hash des Inhalts
+        webhook_id = request.headers.get('X-Shopify-Webhook-Id') or hashlib.sha256(data).hexdigest()
+        shop_domain = (request.headers.get('X-Shopify-Shop-Domain') or
+                       webhook_data.get('shop_domain') or webhook_data.get('domain'))
+
+        if get_webhook_queue().enqueue(webhook_id, topic, shop_domain, webhook_data):
+            webhook_worker.notify()
+        else:
+            logger.info(f"Doppelter Webhook {webhook_id} ({topic}) ignoriert")
         return '', 200
     except Exception as e:
-        print(f"Fehler im customers/data_request Webhook: {e}")
+        logger.error(f"Fehler beim Einreihen des {topic} Webhooks: {e}")
         return 'Internal Server Error', 500
 
+@app.route('/webhook/customers/data_request', methods=['POST'])
+def customer_data_request():
+    """Handler für GDPR Datenanfragen"""
+    return enqueue_webhook('customers/data_request')
+
 @app.route('/webhook/customers/redact', methods=['POST'])
 def customer_redact():
     """Handler für GDPR Kundendaten-Löschung"""
-    try:
-        # Verifiziere den Webhook
-        hmac_header = request.headers.get('X-Shopify-Hmac-Sha256')
-        if not hmac_header:
-            return 'HMAC validation failed', 401
-
-        data = request.get_data()
-        calculated_hmac = hmac.new(
-            SHOPIFY_API_SECRET.encode('utf-8'),
-            data,
-            hashlib.sha256
-        ).hexdigest()
-
-        if not hmac.compare_digest(calculated_hmac, hmac_header):
-            return 'HMAC validation failed', 401
-
-        # Verarbeite die Löschanfrage
-        webhook_data = request.json
-        shop_domain = webhook_data.get('shop_domain')
-        customer_email = webhook_data.get('customer', {}).get('email')
-        
-        if shop_domain and customer_email:
-            # Hier würden Sie die Kundendaten löschen
-            print(f"GDPR Löschanfrage für Kunde {customer_email} von Shop {shop_domain}")
-            
-        return '', 200
-    except Exception as e:
-        print(f"Fehler im customers/redact Webhook: {e}")
-        return 'Internal Server Error', 500
+    return enqueue_webhook('customers/redact')
 
 @app.route('/webhook/shop/redact', methods=['POST'])
 def shop_redact():
     """Handler für GDPR Shop-Daten-Löschung"""
-    try:
-        # Verifiziere den Webhook
-        hmac_header = request.headers.get('X-Shopify-Hmac-Sha256')
-        if not hmac_header:
-            return 'HMAC validation failed', 401
-
-        data = request.get_data()
-        calculated_hmac = hmac.new(
-            SHOPIFY_API_SECRET.encode('utf-8'),
-            data,
-            hashlib.sha256
-        ).hexdigest()
-
-        if not hmac.compare_digest(calculated_hmac, hmac_header):
-            return 'HMAC validation failed', 401
-
-        # Verarbeite die Shop-Löschanfrage
-        webhook_data = request.json
-        shop_domain = webhook_data.get('shop_domain')
-        
-        if shop_domain:
-            # Hier würden Sie alle Shop-bezogenen Daten löschen
-            print(f"GDPR Shop-Löschanfrage für Shop {shop_domain}")
-            
-        return '', 200
-    except Exception as e:
-        print(f"Fehler im shop/redact Webhook: {e}")
-        return 'Internal Server Error', 500
+    return enqueue_webhook('shop/redact')
 
 @app.route('/webhook/app/uninstalled', methods=['POST'])
 def app_uninstalled_webhook():
     """Handler für app/uninstalled Webhook"""
-    try:
-        # Verifiziere den Webhook
-        hmac_header = request.headers.get('X-Shopify-Hmac-Sha256')
-        if not hmac_header:
-            return 'HMAC validation failed', 401
-
-        data = request.get_data()
-        # Verifiziere die HMAC-Signatur
-        calculated_hmac = hmac.new(
-            SHOPIFY_API_SECRET.encode('utf-8'),
-            data,
-            hashlib.sha256
-        ).hexdigest()
-
-        if not hmac.compare_digest(calculated_hmac, hmac_header):
-            return 'HMAC validation failed', 401
-
-        # Verarbeite die App-Deinstallation
-        webhook_data = request.json
-        shop_domain = webhook_data.get('shop_domain')
-        
-        if shop_domain:
-            # Lösche diesen Shop aus der Session, falls er aktiv ist
-            if 'shop' in session and session['shop'] == shop_domain:
-                session.clear()
-                
-            # Optional: Lösche Tracking-Daten oder andere gespeicherte Informationen
-            print(f"✅ App wurde deinstalliert von Shop: {shop_domain}")
-            
-        return '', 200
-    except Exception as e:
-        print(f"❌ Fehler im app/uninstalled Webhook: {e}")
-        return 'Internal Server Error', 500
+    return enqueue_webhook('app/uninstalled')
 
 @app.route('/webhook/shop/update', methods=['POST'])
 def shop_update_webhook():
     """Handler für shop/update Webhook"""
-    try:
-        # Verifiziere den Webhook
-        hmac_header = request.headers.get('X-Shopify-Hmac-Sha256')
-        if not hmac_header:
-            return 'HMAC validation failed', 401
-
-        data = request.get_data()
-        calculated_hmac = hmac.new(
-            SHOPIFY_API_SECRET.encode('utf-8'),
-            data,
-            hashlib.sha256
-        ).hexdigest()
-
-        if not hmac.compare_digest(calculated_hmac, hmac_header):
-            return 'HMAC validation failed', 401
-
-        # Verarbeite das Shop-Update
-        webhook_data = request.json
-        shop_domain = webhook_data.get('shop_domain') or webhook_data.get('domain')
-        
-        if shop_domain:
-            # Aktualisiere Shop-Informationen in der Datenbank
-            print(f"✅ Shop wurde aktualisiert: {shop_domain}")
-            
-        return '', 200
-    except Exception as e:
-        print(f"❌ Fehler im shop/update Webhook: {e}")
-        return 'Internal Server Error', 500
+    return enqueue_webhook('shop/update')
+
+@app.route('/webhook/orders/create', methods=['POST'])
+def orders_create_webhook():
+    """Handler für orders/create Webhook"""
+    return enqueue_webhook('orders/create')
+
+@app.route('/webhook/orders/updated', methods=['POST'])
+def orders_updated_webhook():
+    """Handler für orders/updated Webhook"""
+    return enqueue_webhook('orders/updated')
+
+@app.route('/webhook/refunds/create', methods=['POST'])
+def refunds_create_webhook():
+    """Handler für refunds/create Webhook"""
+    return enqueue_webhook('refunds/create')
+
+@webhook_worker.handler('customers/data_request')
+def process_customer_data_request(shop_domain, webhook_data):
+    """Verarbeitet eine GDPR Datenanfrage"""
+    customer_email = webhook_data.get('customer', {}).get('email')
+    if shop_domain and customer_email:
+        # Hier würden Sie die Kundendaten sammeln und bereitstellen
+        logger.info(f"GDPR Datenanfrage für Kunde {customer_email} von Shop {shop_domain}")
+
+@webhook_worker.handler('customers/redact')
+def process_customer_redact(shop_domain, webhook_data):
+    """Verarbeitet eine GDPR Kundendaten-Löschung"""
+    customer_email = webhook_data.get('customer', {}).get('email')
+    if shop_domain and customer_email:
+        # Hier würden Sie die Kundendaten löschen
+        logger.info(f"GDPR Löschanfrage für Kunde {customer_email} von Shop {shop_domain}")
+
+@webhook_worker.handler('shop/redact')
+def process_shop_redact(shop_domain, webhook_data):
+    """Verarbeitet eine GDPR Shop-Daten-Löschung"""
+    if shop_domain:
+        # Zuerst Zuflüsse stoppen (Verbindungen, Puffer), dann alle Speicher des Shops leeren
+        shopify_api.client_pool.evict_shop(shop_domain)
+        get_event_buffer().discard_shop(shop_domain)
+        data_models.delete_shop_data(shop_domain)
+        order_sync.get_order_sync_store().delete_shop(shop_domain)
+        rfm.get_rfm_store().delete_shop(shop_domain)
+        recommender.get_copurchase_index().delete_shop(shop_domain)
+        hourly_metrics.get_hourly_store().delete_shop(shop_domain)
+        get_webhook_queue().delete_shop(shop_domain)
+        shopify_api.clear_cache_for_shop(shop_domain)
+        logger.info(f"GDPR Shop-Löschanfrage für Shop {shop_domain} ausgeführt, alle Shop-Daten gelöscht")
+
+@webhook_worker.handler('app/uninstalled')
+def process_app_uninstalled(shop_domain, webhook_data):
+    """Verarbeitet die Deinstallation der App"""
+    if shop_domain:
+        # Gepoolte Verbindungen des Shops schließen, das Token ist ab jetzt ungültig
+        shopify_api.client_pool.evict_shop(shop_domain)
+        shopify_api.clear_cache_for_shop(shop_domain)
+        data_models.unregister_shop(shop_domain)
+        logger.info(f"✅ App wurde deinstalliert von Shop: {shop_domain}")
+
+@webhook_worker.handler('shop/update')
+def process_shop_update(shop_domain, webhook_data):
+    """Verarbeitet ein Shop-Update"""
+    if shop_domain:
+        # Aktualisiere Shop-Informationen in der Datenbank
+        logger.info(f"✅ Shop wurde aktualisiert: {shop_domain}")
+
+@webhook_worker.handler('orders/create', 'orders/updated')
+def process_order_webhook(shop_domain, webhook_data):
+    """Wendet eine Bestellung inkrementell auf die Metriken an"""
+    if shop_domain and webhook_data:
+        order_node = order_sync.webhook_order_node(webhook_data)
+        order_sync.apply_order_nodes(shop_domain, [order_node])
+        recommender.apply_orders(shop_domain, [order_node])
+        shopify_api.clear_cache_for_shop(shop_domain)
+        dashboard_snapshots.schedule_refresh(shop_domain)
+        logger.info(f"Bestellung {webhook_data.get('id')} aus Webhook für {shop_domain} übernommen")
+
+@webhook_worker.handler('refunds/create')
+def process_refund_webhook(shop_domain, webhook_data):
+    """Zieht eine Erstattung vom Umsatz des Bestelltags ab"""
+    if shop_domain and webhook_data:
+        if order_sync.apply_refund(
+            shop_domain,
+            f"gid://shopify/Order/{webhook_data.get('order_id')}",
+            str(webhook_data.get('id')),
+            order_sync.refund_amount(webhook_data)
+        ):
+            dashboard_snapshots.schedule_refresh(shop_domain)
@@ -0,0 +1,105 @@
+"""
+Vergleicht die bisherige dict-basierte Zeitreihenabfrage mit DailySeries.
+
+Aufruf aus dem Projektverzeichnis:
+    python benchmarks/timeseries_benchmark.py [--days 730] [--repeat 200]
+"""
+import os
+import sys
+import random
+import argparse
+import datetime
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timeseries import DailySeries  # noqa: E402
+
+
+def make_points(days, gap_ratio=0.05):
+    """Erzeugt `days` Tageswerte bis heute, ein Teil der Tage fehlt"""
+    today = datetime.date.today()
+    points = {}
+    for i in range(days):
+        if random.random() < gap_ratio:
+            continue
+        date = today - datetime.timedelta(days=i)
+        points[date.strftime('%Y-%m-%d')] = round(random.uniform(0, 500), 2)
+    return points
+
+
+def legacy_time_series(points, days):
+    """Bisherige Implementierung aus ShopMetrics.get_time_series_data"""
+    end_date = datetime.datetime.now()
+    start_date = end_date - datetime.timedelta(days=days-1)
+    date_list = [(start_date + datetime.timedelta(days=i)).strftime('%Y-%m-%d')
+                 for i in range(days)]
+    return [{"date": date, "value": points.get(date, 0)} for date in date_list]
+
+
+def legacy_growth_rate(points, days):
+    """Bisherige Implementierung aus ShopMetrics.calculate_growth_rate"""
+    time_series = legacy_time_series(points, days)
+    half = len(time_series) // 2
+    first_half, second_half = time_series[:half], time_series[half:]
+    avg_first = sum(item['value'] for item in first_half) / len(first_half)
+    avg_second = sum(item['value'] for item in second_half) / len(second_half)
+    return round((avg_second - avg_first) / avg_first * 100, 2) if avg_first else 0
+
+
+def legacy_render(points, periods):
+    """Pro Dashboard-Aufruf: Zeitreihe, Summe und Wachstum je Zeitraum"""
+    for days in periods:
+        data = legacy_time_series(points, days)
+        sum(item['value'] for item in data)
+        legacy_growth_rate(points, days)
+
+
+def vectorized_render(series, periods):
+    for days in periods:
+        window = series.window(days)
+        window.sum()
+        window.growth_rate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark der Zeitreihenabfragen')
+    parser.add_argument('--days', type=int, default=730, help='Länge der Historie in Tagen')
+    parser.add_argument('--repeat', type=int, default=200, help='Wiederholungen je Messung')
+    args = parser.parse_args(argv)
+
+    random.seed(42)
+    points = make_points(args.days)
+    series = DailySeries.from_points(points)
+    periods = (7, 30, 90, 365, args.days)
+
+    # Ergebnisse müssen übereinstimmen
+    for days in periods:
+        expected = legacy_growth_rate(points, days)
+        actual = series.window(days).growth_rate()
+        assert abs(expected - actual) < 0.01, (days, expected, actual)
+
+    cases = [
+        ("Aufbau aus dict", None, lambda: DailySeries.from_points(points)),
+        ("Zeitraum + Summe + Wachstum (alle Zeiträume)",
+         lambda: legacy_render(points, periods), lambda: vectorized_render(series, periods)),
+        (f"Wachstumsrate {args.days} Tage",
+         lambda: legacy_growth_rate(points, args.days), lambda: series.window(args.days).growth_rate()),
+        (f"Diagrammdaten {args.days} Tage",
+         lambda: legacy_time_series(points, args.days), lambda: series.window(args.days).to_records()),
+    ]
+
+    print(f"{len(points)} Tageswerte über {args.days} Tage, {args.repeat} Wiederholungen\n")
+    print(f"{'Messung':<48}{'dict (ms)':>12}{'NumPy (ms)':>12}{'Faktor':>10}")
+    for name, legacy, vectorized in cases:
+        vectorized_ms = timeit.timeit(vectorized, number=args.repeat) / args.repeat * 1000
+        if legacy is None:
+            print(f"{name:<48}{'-':>12}{vectorized_ms:>12.3f}{'-':>10}")
+            continue
+        legacy_ms = timeit.timeit(legacy, number=args.repeat) / args.repeat * 1000
+        print(f"{name:<48}{legacy_ms:>12.3f}{vectorized_ms:>12.3f}{legacy_ms / vectorized_ms:>9.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,375 @@
+import os
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import shopify_api
+import order_sync
+import hourly_metrics
+from data_models import ShopMetrics, get_metrics_backend, iter_shop_tracking_events
+from metrics_store import days_to_dates
+from timeseries import DailySeries, today_index
+
+# Logger einrichten
+logger = logging.getLogger('dashboard_snapshots')
+
+# Konstanten
+SNAPSHOT_PERIODS = (7, 30, 90, 365)
+BUCKETED_CHART_MIN_DAYS = 90  # Ab dieser Länge lesen die Diagramme die Rollups des hourly_metrics-Stores
+SNAPSHOT_MAX_AGE = int(os.environ.get('DASHBOARD_SNAPSHOT_MAX_AGE', 300))  # Sekunden
+SNAPSHOT_MAX_WORKERS = int(os.environ.get('DASHBOARD_SNAPSHOT_WORKERS', 2))
+SNAPSHOT_METRIC_PREFIX = 'dashboard_snapshot_'
+
+
+def calculate_trend(series):
+    """
+    Vergleicht die zweite mit der ersten Hälfte einer Zeitreihe.
+
+    Returns:
+        dict: {"value": Prozentuale Veränderung (Betrag), "direction": "up" | "down"}
+    """
+    previous, current = series.half_sums()
+
+    if previous > 0:
+        change = (current - previous) / previous * 100
+    else:
+        change = 100.0 if current > 0 else 0.0
+    return {"value": round(abs(change), 1), "direction": "up" if change >= 0 else "down"}
+
+
+def calculate_conversion_trend(visitors, orders):
+    """
+    Veränderung der Konversionsrate (Bestellungen je Besucher) zwischen erster und zweiter Hälfte.
+
+    Returns:
+        float: Prozentuale Veränderung, negativ bei Rückgang
+    """
+    previous_visitors, current_visitors = visitors.half_sums()
+    previous_orders, current_orders = orders.half_sums()
+
+    previous = previous_orders / previous_visitors if previous_visitors > 0 else 0.0
+    current = current_orders / current_visitors if current_visitors > 0 else 0.0
+    if previous > 0:
+        return round((current - previous) / previous * 100, 1)
+    return 100.0 if current > 0 else 0.0
+
+
+def _window(shop_metrics, metric_name, period):
+    """Gibt den Zeitraum einer Metrik als DailySeries und als Diagrammdaten zurück"""
+    series = shop_metrics.get_series(metric_name)
+    if series is None:
+        return DailySeries.empty().window(period), []
+    window = series.window(period)
+    return window, window.to_records()
+
+
+def _hourly_range(period):
+    """Stundenbereich [erste Stunde, Ende) der letzten `period` Tage einschließlich heute"""
+    end_hour = (today_index() + 1) * 24
+    return end_hour - period * 24, end_hour
+
+
+def _covered_from(store, shop, metric_name, first_hour):
+    """
+    Beginn des Tages, ab dem der Zeitraum stündlich gespeichert ist, oder None ohne stündliche Daten.
+
+    Davor liegende Tage (z.B. aus der Zeit vor den stündlichen Reihen) gibt es nur in der Tagesreihe.
+    """
+    first_stored = store.first_hour(shop, metric_name)
+    if first_stored is None:
+        return None
+    return max(first_hour, first_stored // 24 * 24)
+
+
+def _bucketed_total(shop_metrics, metric_name, period, series):
+    """
+    Summe der letzten `period` Tage aus den gröbsten Buckets des hourly_metrics-Stores.
+
+    Ältere Tage des Zeitraums ohne stündliche Daten zählen aus der Tagesreihe
+    `series`; ohne stündliche Daten zählt nur sie.
+    """
+    first_hour, end_hour = _hourly_range(period)
+    store = hourly_metrics.get_hourly_store()
+    try:
+        covered_from = _covered_from(store, shop_metrics.shop_domain, metric_name, first_hour)
+        if covered_from is None:
+            return series.sum()
+        total = store.total(shop_metrics.shop_domain, metric_name, covered_from, end_hour) or 0.0
+    except Exception as e:
+        logger.error(f"Fehler beim Lesen der stündlichen Metrik {metric_name}: {e}")
+        return series.sum()
+    return total + series.slice(series.start, covered_from // 24 - 1).sum()
+
+
+def _bucketed_records(shop_metrics, metric_name, period, series):
+    """
+    Diagrammdaten langer Zeiträume aus den Rollups (Tage für 90 Tage, Wochen für ein Jahr).
+
+    Wie bei _bucketed_total werden ältere Tage ohne stündliche Daten aus der
+    Tagesreihe in ihre Buckets addiert.
+
+    Returns:
+        list oder None, wenn keine stündlichen Daten vorliegen
+    """
+    first_hour, end_hour = _hourly_range(period)
+    store = hourly_metrics.get_hourly_store()
+    try:
+        covered_from = _covered_from(store, shop_metrics.shop_domain, metric_name, first_hour)
+        if covered_from is None:
+            return None
+        resolution, buckets, values = store.series(shop_metrics.shop_domain, metric_name, first_hour, end_hour)
+    except Exception as e:
+        logger.error(f"Fehler beim Lesen der stündlichen Reihe {metric_name}: {e}")
+        return None
+
+    older = series.slice(series.start, covered_from // 24 - 1)
+    known = np.flatnonzero(~np.isnan(older.values))
+    if len(known):
+        hours = (known + older.start) * 24
+        np.add.at(values, hourly_metrics.to_buckets(hours, resolution) - buckets[0], older.values[known])
+
+    days = [hourly_metrics.bucket_start(bucket, resolution) // 24 for bucket in buckets.tolist()]
+    values = values.astype(np.int64).tolist() if series.integral else np.round(values, 2).tolist()
+    return [{"date": date, "value": value} for date, value in zip(days_to_dates(days).tolist(), values)]
+
+
+def build_quick_tips(shop_metrics, shop_data):
+    """
+    Personalisierte Quick-Tipps des Growth Advisors aus den Shop-Daten und der Traffic-Statistik.
+
+    Returns:
+        list oder None, wenn keine personalisierten Tipps vorliegen (das Dashboard zeigt dann die Standard-Tipps)
+    """
+    traffic = {
+        'device_stats': shop_metrics.metrics.get('device_stats') or {},
+        'daily_pageviews': _window(shop_metrics, 'daily_pageviews', 30)[1],
+        'daily_visitors': _window(shop_metrics, 'daily_visitors', 30)[1]
+    }
+    try:
+        from growth_advisor import GrowthAdvisor
+        return GrowthAdvisor(shop_metrics, shop_data).generate_personalized_tips(shop_data, traffic) or None
+    except (ImportError, AttributeError) as e:
+        logger.debug(f"Personalisierte Tipps nicht verfügbar: {e}")
+    except Exception as e:
+        logger.error(f"Fehler beim Erstellen der personalisierten Tipps für {shop_metrics.shop_domain}: {e}")
+    return None
+
+
+def build_snapshot(shop_metrics, period, quick_tips=None):
+    """Berechnet alle Kennzahlen des Dashboards für einen Zeitraum aus den gespeicherten Metriken"""
+    sales, sales_data = _window(shop_metrics, 'daily_revenue', period)
+    orders, orders_data = _window(shop_metrics, 'daily_orders', period)
+    pageviews, pageviews_data = _window(shop_metrics, 'daily_pageviews', period)
+    visitors, visitors_data = _window(shop_metrics, 'daily_visitors', period)
+
+    if period >= BUCKETED_CHART_MIN_DAYS:
+        sales_data = _bucketed_records(shop_metrics, 'revenue', period, sales) or sales_data
+        orders_data = _bucketed_records(shop_metrics, 'orders', period, orders) or orders_data
+        pageviews_data = _bucketed_records(shop_metrics, 'pageviews', period, pageviews) or pageviews_data
+
+    total_sales = _bucketed_total(shop_metrics, 'revenue', period, sales)
+    total_orders = int(_bucketed_total(shop_metrics, 'orders', period, orders))
+    total_pageviews = int(_bucketed_total(shop_metrics, 'pageviews', period, pageviews))
+    total_visitors = int(visitors.sum())
+
+    # Konversionstrend nur einmal berechnen
+    conversion_trend = calculate_conversion_trend(visitors, orders)
+    orders_trend = calculate_trend(orders)
+    trends = {
+        "sales": calculate_trend(sales),
+        "orders": orders_trend,
+        "clicks": orders_trend,  # Klicks werden vorläufig mit Bestellungen gleichgesetzt
+        "pageviews": calculate_trend(pageviews),
+        "visitors": calculate_trend(visitors),
+        "conversion_rate": {
+            "value": abs(conversion_trend),
+            "direction": "up" if conversion_trend > 0 else "down"
+        },
+        "session_duration": {"value": 5, "direction": "up"}  # Platzhalter
+    }
+
+    device_stats = shop_metrics.metrics.get('device_stats') or {}
+
+    return {
+        "period": period,
+        "built_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "sales_data": sales_data,
+        "orders_data": orders_data,
+        "pageviews_data": pageviews_data,
+        "visitors_data": visitors_data,
+        "devices_data": [{"name": device, "value": count} for device, count in device_stats.items()],
+        "total_sales": round(total_sales, 2),
+        "total_orders": total_orders,
+        "total_pageviews": total_pageviews,
+        "total_visitors": total_visitors,
+        "avg_order_value": round(total_sales / total_orders, 2) if total_orders > 0 else 0,
+        "conversion_rate": round(total_orders / total_pageviews * 100, 2) if total_pageviews > 0 else 0,
+        "trends": trends,
+        "ai_quick_tips": quick_tips,
+        "has_real_data": {
+            "products": bool(shop_metrics.metrics.get('product_types')),
+            "orders": total_orders > 0,
+            "customers": bool(shop_metrics.metrics.get('customer_countries'))
+        }
+    }
+
+
+def build_snapshots(shop, shop_metrics=None, periods=SNAPSHOT_PERIODS, quick_tips=None):
+    """
+    Baut die Snapshots aller Zeiträume eines Shops neu und speichert sie als abgeleitete
+    Ergebnisse (save_artifact), die ShopMetrics beim Laden nicht mitliest.
+
+    Ohne neue Quick-Tipps (z.B. nach Webhooks) werden die des bisherigen Snapshots übernommen.
+    """
+    shop_metrics = shop_metrics or ShopMetrics(shop)
+    backend = get_metrics_backend()
+    snapshots = {}
+    for period in periods:
+        key = f"{SNAPSHOT_METRIC_PREFIX}{period}"
+        tips = quick_tips
+        if tips is None:
+            tips = (backend.load_artifact(shop, key) or {}).get("ai_quick_tips")
+        snapshots[period] = build_snapshot(shop_metrics, period, tips)
+        backend.save_artifact(shop, key, snapshots[period])
+    logger.info(f"Dashboard-Snapshots für {shop} neu berechnet ({', '.join(map(str, periods))} Tage)")
+    return snapshots
+
+
+def refresh_shop(shop, access_token, locked=False):
+    """
+    Synchronisiert die Shop-Daten aus Shopify in die Metriken und baut danach die Snapshots neu.
+
+    Die Synchronisation läuft unter derselben Shop-Sperre wie im Scheduler (locked=True,
+    wenn der Aufrufer sie bereits hält). Synchronisiert gerade ein anderer Worker den
+    Shop, werden nur die Snapshots aus den vorhandenen Metriken neu berechnet.
+
+    Die update_*-Methoden speichern nicht einzeln; alle Änderungen werden
+    gesammelt und beim Verlassen von batch() einmal an den Write-Behind-Puffer übergeben.
+    """
+    if locked:
+        return _sync_and_build(shop, access_token)
+
+    import scheduler  # scheduler importiert dashboard_snapshots
+
+    lock = scheduler.get_shop_lock()
+    if not lock.acquire(shop):
+        logger.info(f"Shop {shop} wird bereits synchronisiert, Snapshots nur aus vorhandenen Metriken")
+        return build_snapshots(shop)
+    try:
+        return _sync_and_build(shop, access_token)
+    finally:
+        lock.release(shop)
+
+
+def _sync_and_build(shop, access_token):
+    shop_metrics = ShopMetrics(shop, write_behind=True)
+    bundle = shopify_api.fetch_shop_bundle(shop, access_token, limit=25,
+                                           include=("products", "customers"))
+
+    product_edges = (bundle.get('products') or {}).get('edges', [])
+    customer_edges = (bundle.get('customers') or {}).get('edges', [])
+    with shop_metrics.batch():
+        if product_edges:
+            shop_metrics.update_product_metrics(product_edges)
+        if customer_edges:
+            shop_metrics.update_customer_metrics(customer_edges)
+
+        try:
+            order_sync.sync_orders(shop, access_token, shop_metrics)
+        except Exception as e:
+            logger.error(f"Fehler bei der Bestellsynchronisation für {shop}: {e}")
+
+        # Seitenaufrufe streamend aus dem Event-Store zählen, ohne die Historie zu laden
+        pageviews = (data for _, data in iter_shop_tracking_events(shop, 'pageviews'))
+        shop_metrics.update_traffic_metrics({'pageviews': pageviews})
+
+    shop_data = {"products": product_edges, "customers": customer_edges}
+    return build_snapshots(shop, shop_metrics, quick_tips=build_quick_tips(shop_metrics, shop_data))
+
+
+_executor = ThreadPoolExecutor(max_workers=SNAPSHOT_MAX_WORKERS, thread_name_prefix='dashboard-snapshot')
+_in_progress = set()
+_in_progress_lock = threading.Lock()
+
+
+def schedule_refresh(shop, access_token=None):
+    """
+    Aktualisiert die Snapshots eines Shops im Hintergrund (höchstens ein Lauf pro Shop).
+
+    Mit Access Token werden vorher die Shopify-Daten synchronisiert, ohne Token
+    werden nur die Snapshots aus den vorhandenen Metriken neu berechnet (z.B. nach Webhooks).
+    """
+    with _in_progress_lock:
+        if shop in _in_progress:
+            return False
+        _in_progress.add(shop)
+
+    def run():
+        try:
+            if access_token:
+                refresh_shop(shop, access_token)
+            else:
+                build_snapshots(shop)
+        except Exception as e:
+            logger.error(f"Fehler beim Aktualisieren der Dashboard-Snapshots für {shop}: {e}")
+        finally:
+            with _in_progress_lock:
+                _in_progress.discard(shop)
+
+    _executor.submit(run)
+    return True
+
+
+def snapshot_age(snapshot):
+    """Alter eines Snapshots in Sekunden"""
+    built_at = datetime.datetime.fromisoformat(snapshot["built_at"])
+    return (datetime.datetime.now() - built_at).total_seconds()
+
+
+def placeholder_snapshot(period):
+    """Leerer Snapshot (pending=True), der angezeigt wird, bis der erste Lauf im Hintergrund fertig ist"""
+    flat = {"value": 0, "direction": "up"}
+    return {
+        "period": period,
+        "built_at": None,
+        "pending": True,
+        "sales_data": [],
+        "orders_data": [],
+        "pageviews_data": [],
+        "visitors_data": [],
+        "devices_data": [],
+        "total_sales": 0,
+        "total_orders": 0,
+        "total_pageviews": 0,
+        "total_visitors": 0,
+        "avg_order_value": 0,
+        "conversion_rate": 0,
+        "trends": {key: dict(flat) for key in ("sales", "orders", "clicks", "pageviews", "visitors",
+                                                "conversion_rate", "session_duration")},
+        "ai_quick_tips": None,
+        "has_real_data": {"products": False, "orders": False, "customers": False}
+    }
+
+
+def get_snapshot(shop, period, access_token=None):
+    """
+    Gibt den Snapshot eines Zeitraums zurück.
+
+    Fehlt er (z.B. vor der ersten Synchronisation), wird der Aufbau im
+    Hintergrund angestoßen und bis dahin ein leerer Platzhalter geliefert;
+    ist er älter als SNAPSHOT_MAX_AGE, wird er ausgeliefert und im Hintergrund erneuert.
+    """
+    if period not in SNAPSHOT_PERIODS:
+        # Freie Zeiträume werden nicht materialisiert, sondern direkt berechnet
+        return build_snapshot(ShopMetrics(shop), period)
+
+    snapshot = get_metrics_backend().load_artifact(shop, f"{SNAPSHOT_METRIC_PREFIX}{period}")
+    if not snapshot:
+        schedule_refresh(shop, access_token)
+        return placeholder_snapshot(period)
+
+    if snapshot_age(snapshot) > SNAPSHOT_MAX_AGE:
+        schedule_refresh(shop, access_token)
+    return snapshot
@@ -2,10 +2,21 @@ import json
 import os
 import logging
 import datetime
+import fcntl
+import time
+import atexit
+import threading
+import itertools
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
 from collections import defaultdict
 
+import hourly_metrics
+from event_store import get_event_store
+from metrics_store import create_metrics_backend, dates_to_days, days_to_dates
+from timeseries import DailySeries
+
 # Logger einrichten
 logger = logging.getLogger('data_models')
 
@@ -14,80 +25,404 @@ DATA_DIR = os.environ.get('DATA_DIR', 'data')
 SHOP_DATA_FILE = os.path.join(DATA_DIR, 'shop_data.json')
 METRICS_FILE = os.path.join(DATA_DIR, 'metrics.json')
 TRACKING_FILE = os.path.join(DATA_DIR, 'tracking_data.json')
+METRICS_WRITE_BEHIND_INTERVAL = float(os.environ.get('METRICS_WRITE_BEHIND_INTERVAL', 1.0))  # Sekunden
+TRAFFIC_CHUNK_SIZE = 100000  # Seitenaufrufe pro Zählschritt
+TRACKING_EVENT_TYPES = ('pageviews', 'clicks')
 
 # Stellen Sie sicher, dass das Datenverzeichnis existiert
 os.makedirs(DATA_DIR, exist_ok=True)
 
+_metrics_backend = None
+
+def get_metrics_backend():
+    """Gibt das prozessweit konfigurierte Metrik-Backend zurück"""
+    global _metrics_backend
+    if _metrics_backend is None:
+        _metrics_backend = create_metrics_backend()
+    return _metrics_backend
+
+def _write_metric_changes(backend, shop, points, deltas, values):
+    """
+    Schreibt gesetzte Werte, danach Deltas und zuletzt Momentaufnahmen in das Backend.
+    
+    Erfolgreich geschriebene Metriken werden aus den übergebenen Dictionaries
+    entfernt; nach einem Fehler bleibt genau der noch nicht geschriebene Rest
+    übrig, sodass ein erneuter Versuch keine Deltas doppelt bucht.
+    """
+    for metric_name in list(points):
+        backend.save_series(shop, metric_name, dict(points[metric_name]))
+        del points[metric_name]
+    
+    for metric_name in list(deltas):
+        backend.increment_series(shop, metric_name, dict(deltas[metric_name]))
+        del deltas[metric_name]
+    
+    for metric_name in list(values):
+        backend.save_snapshot(shop, metric_name, values[metric_name])
+        del values[metric_name]
+
+def _merge_changes(points, deltas, values, newer_points, newer_deltas, newer_values):
+    """
+    Führt neuere Änderungen in ältere zusammen (ändert points, deltas und values).
+    
+    Gesetzte Tageswerte und Momentaufnahmen überschreiben ältere, Deltas werden
+    addiert, und ein gesetzter Tageswert verwirft ältere Deltas desselben Tages.
+    """
+    for metric_name, metric_points in newer_points.items():
+        for date, value in metric_points.items():
+            points[metric_name][date] = value
+            if metric_name in deltas:
+                deltas[metric_name].pop(date, None)
+    for metric_name, metric_deltas in newer_deltas.items():
+        for date, delta in metric_deltas.items():
+            deltas[metric_name][date] += delta
+    values.update(newer_values)
+
+def _empty_changes():
+    return defaultdict(dict), defaultdict(lambda: defaultdict(float)), {}
+
+class MetricsWriteBehind:
+    """
+    Sammelt Metrik-Änderungen mehrerer ShopMetrics-Instanzen und schreibt sie gebündelt.
+    
+    Änderungen desselben Shops werden zusammengeführt: gesetzte Tageswerte und
+    Momentaufnahmen überschreiben ältere, Deltas werden addiert, und ein später
+    gesetzter Tageswert verwirft die zuvor gesammelten Deltas desselben Tages.
+    """
+    
+    def __init__(self, interval=METRICS_WRITE_BEHIND_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._worker = None
+        self._worker_pid = None
+    
+    def submit(self, shop, backend, points, deltas, values):
+        """Übernimmt die Änderungen eines Shops in den Puffer"""
+        self._ensure_worker()
+        with self._lock:
+            entry = self._pending.get(shop)
+            if entry is None:
+                entry = self._new_entry(backend)
+                self._pending[shop] = entry
+            _merge_changes(entry["points"], entry["deltas"], entry["values"], points, deltas, values)
+    
+    @staticmethod
+    def _new_entry(backend):
+        points, deltas, values = _empty_changes()
+        return {"backend": backend, "points": points, "deltas": deltas, "values": values}
+    
+    def _requeue(self, shop, entry):
+        """Legt einen fehlgeschlagenen Rest zurück; zwischenzeitlich eingegangene Änderungen sind neuer"""
+        with self._lock:
+            newer = self._pending.get(shop)
+            if newer is not None:
+                _merge_changes(entry["points"], entry["deltas"], entry["values"],
+                               newer["points"], newer["deltas"], newer["values"])
+            self._pending[shop] = entry
+    
+    def flush(self, shop=None):
+        """
+        Schreibt die gesammelten Änderungen (eines oder aller Shops) in einem Durchgang.
+        
+        Schlägt das Schreiben fehl (z.B. "database is locked"), bleibt der noch nicht
+        geschriebene Rest im Puffer und wird beim nächsten Durchlauf erneut versucht.
+        
+        Returns:
+            int: Anzahl vollständig geschriebener Shops
+        """
+        with self._flush_lock:
+            with self._lock:
+                if shop is None:
+                    batch, self._pending = self._pending, {}
+                else:
+                    batch = {shop: self._pending.pop(shop)} if shop in self._pending else {}
+            
+            written = 0
+            for shop_domain, entry in batch.items():
+                try:
+                    _write_metric_changes(entry["backend"], shop_domain, entry["points"],
+                                          entry["deltas"], entry["values"])
+                    written += 1
+                except Exception as e:
+                    logger.error(f"Fehler beim verzögerten Speichern der Metriken für {shop_domain}, "
+                                 f"neuer Versuch im nächsten Durchlauf: {e}")
+                    self._requeue(shop_domain, entry)
+            return written
+    
+    def discard(self, shop):
+        """Verwirft die noch nicht geschriebenen Änderungen eines Shops (z.B. für shop/redact)"""
+        with self._lock:
+            return self._pending.pop(shop, None) is not None
+    
+    def pending_shops(self):
+        """Shops mit noch nicht geschriebenen Änderungen"""
+        with self._lock:
+            return list(self._pending)
+    
+    def _flush_at_exit(self):
+        """Letzter Schreibversuch beim Beenden (der Schreib-Thread ist ein Daemon)"""
+        self.flush()
+        remaining = self.pending_shops()
+        if remaining:
+            logger.error(f"Metrik-Änderungen beim Beenden nicht gespeichert für: {', '.join(remaining)}")
+    
+    def _ensure_worker(self):
+        """Startet den Schreib-Thread (nach einem Fork von Gunicorn erneut)"""
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+        
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            self._worker_pid = pid
+            self._worker = threading.Thread(target=self._run, name='metrics-write-behind', daemon=True)
+            self._worker.start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Fehler im Write-Behind-Thread der Metriken: {e}")
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+def get_metrics_write_behind():
+    """Gibt den prozessweiten Write-Behind-Puffer für Metriken zurück"""
+    global _write_behind
+    if _write_behind is None:
+        with _write_behind_lock:
+            if _write_behind is None:
+                _write_behind = MetricsWriteBehind()
+                atexit.register(_write_behind._flush_at_exit)
+    return _write_behind
+
+def _is_time_series(value):
+    """Erkennt Zeitreihen im alten Format ({'YYYY-MM-DD': Wert})"""
+    if not isinstance(value, dict) or not value:
+        return False
+    try:
+        for key in value:
+            datetime.datetime.strptime(key, '%Y-%m-%d')
+        return True
+    except (TypeError, ValueError):
+        return False
+
 class ShopMetrics:
     """Klasse zur Verwaltung von Shop-Metriken"""
     
-    def __init__(self, shop_domain):
+    def __init__(self, shop_domain, backend=None, write_behind=False):
         self.shop_domain = shop_domain
+        self.backend = backend or get_metrics_backend()
+        # Mit write_behind übernimmt ein Hintergrund-Thread das Schreiben
+        self.write_behind = write_behind
+        # Momentaufnahmen; Zeitreihen werden erst bei Bedarf als Arrays gelesen
         self.metrics = defaultdict(dict)
+        # In dieser Instanz gesetzte Tageswerte, überlagern die gespeicherte Reihe
+        self._points = defaultdict(dict)
+        self._stored_series = {}
+        self._dirty_points = defaultdict(dict)
+        self._dirty_values = set()
+        self._pending_deltas = defaultdict(lambda: defaultdict(float))
+        self._batch_depth = 0
+        self._save_requested = False
+        # Vektorisierte Zeitreihen, bei jeder Änderung der Metrik verworfen
+        self._series = {}
         self.load_metrics()
         
     def load_metrics(self):
-        """Lädt vorhandene Metriken aus der Datei oder initialisiert neue"""
+        """Lädt die Momentaufnahmen des Shops; Zeitreihen werden erst in get_series als Arrays gelesen"""
         try:
-            if os.path.exists(METRICS_FILE):
-                with open(METRICS_FILE, 'r') as f:
-                    all_metrics = json.load(f)
-                    self.metrics = defaultdict(dict, all_metrics.get(self.shop_domain, {}))
-                    logger.info(f"Metriken für Shop {self.shop_domain} geladen")
+            if not self.backend.has_shop(self.shop_domain):
+                self._migrate_legacy_metrics()
+                self.backend.ensure_shop(self.shop_domain)
+            
+            stored = self.backend.load_snapshots(self.shop_domain)
+            self._series = {}
+            self._stored_series = {}
+            if stored:
+                self.metrics = defaultdict(dict, stored)
+                logger.info(f"Metriken für Shop {self.shop_domain} geladen")
             else:
                 logger.info(f"Keine vorhandenen Metriken gefunden für {self.shop_domain}, initialisiere neu")
         except Exception as e:
             logger.error(f"Fehler beim Laden der Metriken: {e}")
-            
-    def save_metrics(self):
-        """Speichert die Metriken in der Datei"""
+    
+    def _migrate_legacy_metrics(self):
+        """Übernimmt die Metriken des Shops einmalig aus der alten metrics.json"""
+        if not os.path.exists(METRICS_FILE):
+            return
+        
+        with open(METRICS_FILE, 'r') as f:
+            legacy_metrics = json.load(f).get(self.shop_domain, {})
+        
+        for metric_name, value in legacy_metrics.items():
+            if _is_time_series(value):
+                self.backend.save_series(self.shop_domain, metric_name, value)
+            else:
+                self.backend.save_snapshot(self.shop_domain, metric_name, value)
+        
+        if legacy_metrics:
+            logger.info(f"Metriken für Shop {self.shop_domain} aus {METRICS_FILE} übernommen")
+    
+    def _stored_series_for(self, metric_name):
+        """Gespeicherte Reihe als DailySeries (einmal pro Instanz aus dem Backend gelesen)"""
+        series = self._stored_series.get(metric_name)
+        if series is None:
+            days, values = self.backend.load_series_arrays(self.shop_domain, metric_name)
+            series = DailySeries.from_arrays(days, values)
+            self._stored_series[metric_name] = series
+        return series
+    
+    def get_point(self, metric_name, date):
+        """Gibt einen Tageswert zurück (0, wenn der Tag fehlt)"""
+        if date in self._points.get(metric_name, ()):
+            return self._points[metric_name][date]
+        stored = self._stored_series_for(metric_name)
+        day = int(dates_to_days([date])[0])
+        if not stored.start <= day <= stored.end:
+            return 0
+        value = stored.values[day - stored.start]
+        if np.isnan(value):
+            return 0
+        return int(value) if stored.integral else float(value)
+    
+    def set_point(self, metric_name, date, value):
+        """Setzt einen Tageswert einer Zeitreihe und merkt ihn zum Speichern vor"""
+        self._points[metric_name][date] = value
+        self._dirty_points[metric_name][date] = value
+        self._series.pop(metric_name, None)
+        # Ein gesetzter Wert ersetzt vorher gesammelte Deltas desselben Tages
+        if metric_name in self._pending_deltas:
+            self._pending_deltas[metric_name].pop(date, None)
+    
+    def increment_point(self, metric_name, date, delta):
+        """Addiert ein Delta auf einen Tageswert; gespeichert wird es atomar im Backend"""
+        if not delta:
+            return
+        self._points[metric_name][date] = self.get_point(metric_name, date) + delta
+        self._series.pop(metric_name, None)
+        self._pending_deltas[metric_name][date] += delta
+    
+    def set_value(self, metric_name, value):
+        """Setzt eine Momentaufnahme-Metrik und merkt sie zum Speichern vor"""
+        self.metrics[metric_name] = value
+        self._dirty_values.add(metric_name)
+        self._series.pop(metric_name, None)
+            
+    @contextmanager
+    def batch(self):
+        """
+        Bündelt alle Änderungen innerhalb des Blocks zu einem einzigen Speichervorgang.
+        
+        save_metrics-Aufrufe im Block (auch aus den update_*-Methoden) werden
+        aufgeschoben und beim Verlassen des äußersten Blocks einmal ausgeführt.
+        """
+        self._batch_depth += 1
         try:
-            # Zuerst vorhandene Metriken laden
-            all_metrics = {}
-            if os.path.exists(METRICS_FILE):
-                with open(METRICS_FILE, 'r') as f:
-                    all_metrics = json.load(f)
-            
-            # Aktualisieren und speichern
-            all_metrics[self.shop_domain] = dict(self.metrics)
-            with open(METRICS_FILE, 'w') as f:
-                json.dump(all_metrics, f, indent=2)
-                
-            logger.info(f"Metriken für Shop {self.shop_domain} gespeichert")
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._save_requested:
+                self._save_requested = False
+                self.save_metrics()
+    
+    def _take_changes(self):
+        """Entnimmt alle noch nicht gespeicherten Änderungen"""
+        dirty_points, self._dirty_points = self._dirty_points, defaultdict(dict)
+        dirty_values, self._dirty_values = self._dirty_values, set()
+        pending_deltas, self._pending_deltas = self._pending_deltas, defaultdict(lambda: defaultdict(float))
+        values = {metric_name: self.metrics.get(metric_name) for metric_name in dirty_values}
+        return dirty_points, pending_deltas, values
+    
+    def _restore_changes(self, dirty_points, pending_deltas, values):
+        """Legt nicht gespeicherte Änderungen zurück; seitdem vorgemerkte Änderungen sind neuer"""
+        _merge_changes(dirty_points, pending_deltas, values, self._dirty_points, self._pending_deltas,
+                       {metric_name: self.metrics.get(metric_name) for metric_name in self._dirty_values})
+        self._dirty_points, self._pending_deltas = dirty_points, pending_deltas
+        self._dirty_values = set(values)
+    
+    def save_metrics(self, immediate=False, raise_errors=False):
+        """
+        Speichert nur die geänderten Metriken dieses Shops.
+        
+        Nicht geschriebene Änderungen bleiben nach einem Fehler vorgemerkt und
+        werden beim nächsten Aufruf erneut geschrieben.
+        
+        Args:
+            immediate (bool): Sofort synchron schreiben, auch innerhalb von batch()
+                              und im Write-Behind-Modus
+            raise_errors (bool): Fehler des Backends weitergeben statt nur zu protokollieren
+                                 (für Aufrufer, die danach einen Fortschritt festhalten)
+        """
+        if self._batch_depth and not immediate:
+            self._save_requested = True
+            return
+        
+        dirty_points, pending_deltas, values = self._take_changes()
+        try:
+            if not (dirty_points or pending_deltas or values):
+                return
+            
+            if self.write_behind and not immediate:
+                get_metrics_write_behind().submit(self.shop_domain, self.backend,
+                                                  dirty_points, pending_deltas, values)
+                return
+            
+            series_count = len(dirty_points) + len(pending_deltas)
+            value_count = len(values)
+            _write_metric_changes(self.backend, self.shop_domain, dirty_points, pending_deltas, values)
+            logger.info(f"Metriken für Shop {self.shop_domain} gespeichert "
+                        f"({series_count} Zeitreihen, {value_count} Momentaufnahmen)")
         except Exception as e:
             logger.error(f"Fehler beim Speichern der Metriken: {e}")
+            self._restore_changes(dirty_points, pending_deltas, values)
+            if raise_errors:
+                raise
     
     def update_revenue_metrics(self, orders):
-        """Aktualisiert Umsatzmetriken basierend auf Bestellungen"""
+        """
+        Aktualisiert Umsatzmetriken basierend auf Bestellungen.
+        
+        Akzeptiert beliebige Iterables (auch die Streams aus shopify_api.iter_orders)
+        und aggregiert pro Erstellungstag, ohne die Bestellungen zu materialisieren.
+        Umsatz und Anzahl werden wie bei order_sync gebildet (netto, ohne Stornierungen)
+        und nur für Tage gesetzt, die im Stream vorkommen; der Stream muss diese Tage
+        daher vollständig enthalten.
+        """
+        import order_sync  # order_sync importiert data_models
+        
         try:
-            today = datetime.datetime.now().strftime('%Y-%m-%d')
-            daily_revenue = 0
-            order_count = 0
+            daily_revenue = defaultdict(float)
+            daily_orders = defaultdict(int)
             
             for order in orders:
-                # Berechnen Sie nur für Bestellungen von heute
-                if order.get('node', {}).get('createdAt', '').startswith(today):
-                    total_price = float(order.get('node', {}).get('totalPrice', 0))
-                    daily_revenue += total_price
-                    order_count += 1
+                day, gross, refunded, counted = order_sync.order_contribution(order.get('node', {}))
+                if not day:
+                    continue
+                daily_revenue[day] += gross - refunded
+                daily_orders[day] += counted
             
-            # Metriken aktualisieren
-            if not self.metrics.get('daily_revenue'):
-                self.metrics['daily_revenue'] = {}
-                
-            self.metrics['daily_revenue'][today] = daily_revenue
+            if not daily_revenue:
+                logger.warning(f"Keine Bestellungen für {self.shop_domain} gefunden")
+                return
             
-            if not self.metrics.get('daily_orders'):
-                self.metrics['daily_orders'] = {}
-                
-            self.metrics['daily_orders'][today] = order_count
+            # Metriken aktualisieren
+            for day, revenue in daily_revenue.items():
+                self.set_point('daily_revenue', day, revenue)
+                self.set_point('daily_orders', day, daily_orders[day])
             
-            # Durchschnittswert berechnen
-            if order_count > 0:
-                self.metrics['average_order_value'] = daily_revenue / order_count
+            # Durchschnittswert aus der gespeicherten Reihe, nicht nur aus den übergebenen Tagen
+            order_sync.update_average_order_value(self)
             
             self.save_metrics()
-            logger.info(f"Umsatzmetriken aktualisiert für {self.shop_domain}: {daily_revenue}€, {order_count} Bestellungen")
+            logger.info(f"Umsatzmetriken aktualisiert für {self.shop_domain}: {sum(daily_revenue.values())}€, "
+                        f"{sum(daily_orders.values())} Bestellungen an {len(daily_revenue)} Tagen")
             
         except Exception as e:
             logger.error(f"Fehler bei der Aktualisierung der Umsatzmetriken: {e}")
@@ -100,7 +435,7 @@ class ShopMetrics:
             
             if total_customers > 0:
                 # Durchschnittliche Bestellungen pro Kunde
-                self.metrics['avg_orders_per_customer'] = total_orders / total_customers
+                self.set_value('avg_orders_per_customer', total_orders / total_customers)
                 
                 # Kundenherkunft analysieren
                 countries = {}
@@ -111,7 +446,7 @@ class ShopMetrics:
                         if country:
                             countries[country] = countries.get(country, 0) + 1
                 
-                self.metrics['customer_countries'] = countries
+                self.set_value('customer_countries', countries)
                 
                 # Speichern
                 self.save_metrics()
@@ -138,8 +473,8 @@ class ShopMetrics:
                 if inventory is not None:
                     inventory_levels[prod_data.get('title')] = inventory
             
-            self.metrics['product_types'] = product_types
-            self.metrics['inventory_levels'] = inventory_levels
+            self.set_value('product_types', product_types)
+            self.set_value('inventory_levels', inventory_levels)
             
             # Speichern
             self.save_metrics()
@@ -149,64 +484,103 @@ class ShopMetrics:
             logger.error(f"Fehler bei der Aktualisierung der Produktmetriken: {e}")
     
     def update_traffic_metrics(self, tracking_data):
-        """Aktualisiert Traffic-Metriken basierend auf Tracking-Daten"""
+        """
+        Aktualisiert Traffic-Metriken basierend auf Tracking-Daten.
+        
+        Seitenaufrufe werden nach ihrem Zeitstempel in UTC-Stunden gezählt (wie
+        die Bestellungen) und im hourly_metrics-Store gesetzt (Rollups auf Tag,
+        Woche und Monat). Die
+        Tageswerte werden für jeden Tag der Tracking-Daten gesetzt, statt die
+        Gesamtzahl aller Aufrufe auf den heutigen Tag zu schreiben.
+        
+        Args:
+            tracking_data (dict): {'pageviews': Iterable von Ereignissen}; die Ereignisse
+                                  werden blockweise gezählt, z.B. direkt aus
+                                  iter_shop_tracking_events(shop, 'pageviews')
+        """
         try:
             if not tracking_data:
                 logger.warning("Keine Tracking-Daten gefunden")
                 return
-                
-            today = datetime.datetime.now().strftime('%Y-%m-%d')
-            
-            # Initialisierung
-            if 'daily_pageviews' not in self.metrics:
-                self.metrics['daily_pageviews'] = {}
-            if 'daily_visitors' not in self.metrics:
-                self.metrics['daily_visitors'] = {}
-            if 'device_stats' not in self.metrics:
-                self.metrics['device_stats'] = {}
             
-            # Zählen der Seitenaufrufe
-            pageviews = len(tracking_data.get('pageviews', []))
-            unique_visitors = len(set(pv.get('visitor_id') for pv in tracking_data.get('pageviews', [])))
-            
-            # Gerätestatistik
+            hour_counts = defaultdict(int)
+            visitors = defaultdict(set)
             devices = {}
-            for pageview in tracking_data.get('pageviews', []):
-                device = pageview.get('device', 'unknown')
-                devices[device] = devices.get(device, 0) + 1
+            skipped = 0
+            
+            pageview_events = iter(tracking_data.get('pageviews', []))
+            while True:
+                chunk = list(itertools.islice(pageview_events, TRAFFIC_CHUNK_SIZE))
+                if not chunk:
+                    break
+                hours, valid = hourly_metrics.timestamps_to_hours([pv.get('timestamp') for pv in chunk])
+                skipped += int((~valid).sum())
+                
+                # Seitenaufrufe pro Stunde zählen
+                chunk_hours, chunk_counts = np.unique(hours[valid], return_counts=True)
+                for hour, count in zip(chunk_hours.tolist(), chunk_counts.tolist()):
+                    hour_counts[hour] += count
+                
+                # Eindeutige Besucher pro Tag und Gerätestatistik
+                for pageview, hour, is_valid in zip(chunk, hours.tolist(), valid.tolist()):
+                    if is_valid:
+                        visitors[hour // 24].add(pageview.get('visitor_id'))
+                    device = pageview.get('device', 'unknown')
+                    devices[device] = devices.get(device, 0) + 1
+            
+            if not devices:
+                logger.warning("Keine Tracking-Daten gefunden")
+                return
+            if skipped:
+                logger.warning(f"{skipped} Seitenaufrufe ohne gültigen Zeitstempel übersprungen")
+            
+            day_counts = defaultdict(int)
+            for hour, count in hour_counts.items():
+                day_counts[hour // 24] += count
             
             # Metriken aktualisieren
-            self.metrics['daily_pageviews'][today] = pageviews
-            self.metrics['daily_visitors'][today] = unique_visitors
-            self.metrics['device_stats'] = devices
+            hourly_metrics.get_hourly_store().set_hours(self.shop_domain, 'pageviews', dict(hour_counts))
+            days = sorted(day_counts)
+            for date, day in zip(days_to_dates(days).tolist(), days):
+                self.set_point('daily_pageviews', date, day_counts[day])
+                self.set_point('daily_visitors', date, len(visitors[day]))
+            self.set_value('device_stats', devices)
             
             # Speichern
             self.save_metrics()
-            logger.info(f"Traffic-Metriken aktualisiert für {self.shop_domain}: {pageviews} Aufrufe, {unique_visitors} Besucher")
+            logger.info(f"Traffic-Metriken aktualisiert für {self.shop_domain}: "
+                        f"{sum(day_counts.values())} Aufrufe an {len(days)} Tagen")
             
         except Exception as e:
             logger.error(f"Fehler bei der Aktualisierung der Traffic-Metriken: {e}")
     
+    def get_series(self, metric_name):
+        """
+        Gibt eine Zeitreihe als DailySeries zurück (pro Instanz zwischengespeichert).
+        
+        Returns:
+            DailySeries oder None, wenn die Metrik keine Zeitreihe ist
+        """
+        series = self._series.get(metric_name)
+        if series is None:
+            if metric_name in self.metrics:
+                # Momentaufnahme, keine Zeitreihe
+                return None
+            series = self._stored_series_for(metric_name).with_points(self._points.get(metric_name))
+            if len(series) == 0:
+                return None
+            self._series[metric_name] = series
+        return series
+    
     def get_time_series_data(self, metric_name, days=30):
         """Gibt Zeitreihendaten für eine bestimmte Metrik zurück"""
         try:
-            if metric_name not in self.metrics or not isinstance(self.metrics[metric_name], dict):
+            series = self.get_series(metric_name)
+            if series is None:
                 logger.warning(f"Metrik {metric_name} nicht gefunden oder kein Zeitreihenformat")
                 return []
-                
-            # Datumsliste erstellen
-            end_date = datetime.datetime.now()
-            start_date = end_date - datetime.timedelta(days=days-1)
-            date_list = [(start_date + datetime.timedelta(days=i)).strftime('%Y-%m-%d') 
-                        for i in range(days)]
-            
-            # Daten für jedes Datum abrufen
-            result = []
-            for date in date_list:
-                value = self.metrics[metric_name].get(date, 0)
-                result.append({"date": date, "value": value})
-                
-            return result
+            
+            return series.window(days).to_records()
             
         except Exception as e:
             logger.error(f"Fehler beim Abrufen der Zeitreihendaten: {e}")
@@ -215,23 +589,12 @@ class ShopMetrics:
     def calculate_growth_rate(self, metric_name, days=30):
         """Berechnet die Wachstumsrate für eine bestimmte Metrik"""
         try:
-            time_series = self.get_time_series_data(metric_name, days)
-            if not time_series or len(time_series) < 2:
+            series = self.get_series(metric_name)
+            if series is None or days < 2:
                 return 0
-                
-            # Teilen in zwei Hälften für Vergleich
-            half = len(time_series) // 2
-            first_half = time_series[:half]
-            second_half = time_series[half:]
-            
-            avg_first = sum(item['value'] for item in first_half) / len(first_half) if first_half else 0
-            avg_second = sum(item['value'] for item in second_half) / len(second_half) if second_half else 0
             
-            if avg_first == 0:
-                return 0
-                
-            growth_rate = ((avg_second - avg_first) / avg_first) * 100
-            return round(growth_rate, 2)
+            # Mittelwerte der beiden Hälften des Zeitraums vergleichen
+            return series.window(days).growth_rate()
             
         except Exception as e:
             logger.error(f"Fehler bei der Berechnung der Wachstumsrate: {e}")
@@ -288,146 +651,112 @@ class DataAnalyzer:
             logger.error(f"Fehler bei der Konvertierung in DataFrame: {e}")
             return None
     
-    def detect_seasonality(self, metric_name, days=90):
-        """Erkennt saisonale Muster in den Daten"""
+    def detect_seasonality(self, metric_name, days=None):
+        """
+        Erkennt wöchentliche, monatliche und jährliche Muster über die gesamte Historie.
+        
+        Das Ergebnis wird pro Shop und Metrik gespeichert und erst bei neuen Daten
+        neu berechnet (siehe seasonality.get_seasonality).
+        """
+        import seasonality  # seasonality importiert data_models
+        
         try:
-            df = self.convert_to_dataframe(metric_name, days)
-            if df is None or len(df) < 14:  # Mindestens 2 Wochen Daten
-                return {"seasonality": "unknown", "confidence": 0}
-                
-            # Wochentagsanalyse
-            df['weekday'] = df.index.weekday
-            weekly_pattern = df.groupby('weekday')['value'].mean()
-            
-            # Standardabweichung berechnen
-            std_dev = weekly_pattern.std()
-            mean_val = weekly_pattern.mean()
-            
-            # Bestimmen Sie, ob eine Saisonalität vorliegt
-            if mean_val == 0:
-                return {"seasonality": "unknown", "confidence": 0}
-                
-            variation_coeff = std_dev / mean_val
-            
-            if variation_coeff > 0.2:
-                # Wochentag mit höchstem Wert finden
-                best_day = weekly_pattern.idxmax()
-                day_names = ['Montag', 'Dienstag', 'Mittwoch', 'Donnerstag', 'Freitag', 'Samstag', 'Sonntag']
-                
-                return {
-                    "seasonality": "weekly",
-                    "best_day": day_names[best_day],
-                    "confidence": min(variation_coeff * 100, 100)
-                }
-            else:
-                return {"seasonality": "none", "confidence": 0}
+            return seasonality.get_seasonality(self.shop_metrics, metric_name,
+                                               days or seasonality.SEASONALITY_MAX_DAYS)
                 
         except Exception as e:
             logger.error(f"Fehler bei der Erkennung der Saisonalität: {e}")
             return {"seasonality": "error", "confidence": 0}
     
+    def detect_hourly_seasonality(self, metric_name='pageviews', days=None):
+        """Erkennt tägliche und wöchentliche Muster in den stündlichen Werten einer Metrik"""
+        import seasonality  # seasonality importiert data_models
+        
+        try:
+            return seasonality.get_hourly_seasonality(self.shop_metrics.shop_domain, metric_name,
+                                                      days or seasonality.HOURLY_SEASONALITY_DAYS)
+                
+        except Exception as e:
+            logger.error(f"Fehler bei der Erkennung der stündlichen Saisonalität: {e}")
+            return {"seasonality": "error", "confidence": 0}
+    
     def predict_future_values(self, metric_name, days_to_predict=7):
-        """Einfache Prognose zukünftiger Werte basierend auf historischen Daten"""
+        """
+        Gibt die gespeicherte Prognose (Holt-Winters mit Wochensaison) einer Metrik zurück.
+        
+        Die Prognosen aller Shops werden gebündelt im Scheduler berechnet
+        (forecasting.run_batch), hier werden sie nur nachgeschlagen.
+        """
+        import forecasting  # forecasting importiert data_models
+        
         try:
-            df = self.convert_to_dataframe(metric_name, 30)  # 30 Tage historische Daten
-            if df is None or len(df) < 7:  # Mindestens 7 Tage Daten
+            forecast = forecasting.get_forecast(self.shop_metrics.shop_domain, metric_name)
+            if not forecast:
                 return []
             
-            # Einfache Fortschreibung des gleitenden Durchschnitts
-            window = min(7, len(df))
-            rolling_avg = df['value'].rolling(window=window).mean().iloc[-1]
-            
-            # Letzten Wert und Trend ermitteln
-            last_value = df['value'].iloc[-1]
-            last_week = df['value'].iloc[-window:].mean()
-            prev_week = df['value'].iloc[-window*2:-window].mean() if len(df) >= window*2 else last_week
-            
-            # Trendbestimmung
-            trend = (last_week - prev_week) / window if prev_week > 0 else 0
-            
-            # Zukünftige Werte vorhersagen
-            last_date = df.index[-1]
-            predictions = []
-            
-            for i in range(1, days_to_predict + 1):
-                future_date = (last_date + datetime.timedelta(days=i)).strftime('%Y-%m-%d')
-                predicted_value = max(0, last_value + trend * i)  # Keine negativen Werte
-                predictions.append({"date": future_date, "value": round(predicted_value, 2)})
-            
-            return predictions
+            # Vergangene Tage einer älteren Prognose überspringen (die Prognose beginnt mit heute)
+            today = datetime.date.today().isoformat()
+            return [point for point in forecast["points"] if point["date"] >= today][:days_to_predict]
             
         except Exception as e:
             logger.error(f"Fehler bei der Vorhersage zukünftiger Werte: {e}")
             return []
     
     def segment_customers(self, customers, orders):
-        """Segmentiert Kunden basierend auf RFM-Analyse (Recency, Frequency, Monetary)"""
+        """
+        Segmentiert Kunden basierend auf RFM-Analyse (Recency, Frequency, Monetary).
+        
+        Liegt ein gespeicherter RFM-Lauf über alle Kunden des Shops vor, wird dieser
+        verwendet; sonst werden die übergebenen Kunden und Bestellungen direkt bewertet.
+        """
+        import rfm  # rfm importiert data_models
+        
         try:
-            # In einer realen Implementierung würde dies auf tatsächlichen Kundendaten basieren
-            # Hier implementieren wir ein Grundgerüst
-            
-            segments = {
-                "high_value": [],
-                "loyal": [],
-                "potential": [],
-                "at_risk": [],
-                "inactive": []
-            }
-            
-            # Simulierte Implementierung (in Realität mit tatsächlichen Daten)
-            customer_data = {}
-            
-            for customer in customers:
-                customer_id = customer.get('node', {}).get('id')
-                if not customer_id:
-                    continue
-                    
-                customer_data[customer_id] = {
-                    "id": customer_id,
-                    "name": f"{customer.get('node', {}).get('firstName', '')} {customer.get('node', {}).get('lastName', '')}",
-                    "orders_count": customer.get('node', {}).get('ordersCount', 0),
-                    "total_spent": float(customer.get('node', {}).get('totalSpent', {}).get('amount', 0))
-                }
-            
-            # Einfache Segmentierung basierend auf Bestellhäufigkeit und Ausgaben
-            for customer_id, data in customer_data.items():
-                if data["orders_count"] >= 3 and data["total_spent"] >= 500:
-                    segments["high_value"].append(data)
-                elif data["orders_count"] >= 2:
-                    segments["loyal"].append(data)
-                elif data["total_spent"] > 0:
-                    segments["potential"].append(data)
-                else:
-                    segments["inactive"].append(data)
-            
-            return segments
+            segments = rfm.get_segments(self.shop_metrics.shop_domain)
+            if segments is not None:
+                return segments
+            return rfm.segment_customers(customers, orders)
             
         except Exception as e:
             logger.error(f"Fehler bei der Kundensegmentierung: {e}")
             return {}
     
     def get_product_recommendations(self, customer_id, products, orders):
-        """Generiert Produktempfehlungen für einen bestimmten Kunden"""
-        # In einer realen Implementierung würde dies auf kollaborativem Filtern oder 
-        # einem Machine-Learning-Modell basieren
+        """
+        Generiert Produktempfehlungen für einen bestimmten Kunden.
+        
+        Grundlage ist der Co-Purchase-Index (Produkte, die häufig zusammen gekauft
+        werden); ohne Kaufhistorie des Kunden werden die meistgekauften Produkte empfohlen.
+        """
+        import recommender  # recommender importiert data_models
         
         try:
-            # Einfache zufällige Empfehlungen für Demozwecke
-            # In einer realen Anwendung würden hier tatsächliche Empfehlungsalgorithmen verwendet
-            if not products or len(products) < 3:
+            if not products:
                 return []
-                
-            sample_size = min(3, len(products))
-            recommended_indices = np.random.choice(len(products), sample_size, replace=False)
+            
+            titles = {}
+            for edge in products:
+                product = edge.get('node', {})
+                titles[product.get('id')] = product.get('title', 'Unbekanntes Produkt')
+            
+            shop = self.shop_metrics.shop_domain
+            candidates = recommender.recommend_for_customer(shop, customer_id, k=10)
+            reason = "Wird häufig zusammen mit bisherigen Käufen gekauft"
+            if not candidates:
+                candidates = recommender.popular_products(shop, k=10)
+                reason = "Beliebt bei anderen Kunden"
             
             recommendations = []
-            for idx in recommended_indices:
-                product = products[idx].get('node', {})
-                recommendations.append({
-                    "id": product.get('id', ''),
-                    "title": product.get('title', 'Unbekanntes Produkt'),
-                    "reason": "Basierend auf vorherigen Käufen"  # Platzhalter
-                })
+            for candidate in candidates:
+                # Nur Produkte empfehlen, die im übergebenen Sortiment enthalten sind
+                if candidate["product_id"] in titles:
+                    recommendations.append({
+                        "id": candidate["product_id"],
+                        "title": titles[candidate["product_id"]],
+                        "reason": reason
+                    })
+                if len(recommendations) == 3:
+                    break
             
             return recommendations
             
@@ -438,22 +767,73 @@ class DataAnalyzer:
 
 # Hilfsfunktionen
 
+_legacy_tracking_migrated = False
+
+def _get_tracking_store():
+    """Gibt den Event-Store zurück und übernimmt einmalig eine vorhandene tracking_data.json"""
+    global _legacy_tracking_migrated
+    store = get_event_store()
+    
+    if not _legacy_tracking_migrated:
+        _legacy_tracking_migrated = True
+        try:
+            if os.path.exists(TRACKING_FILE):
+                with open(TRACKING_FILE, 'r') as f:
+                    legacy_data = json.load(f)
+                for shop, shop_events in legacy_data.items():
+                    records = [(event_type, event) for event_type, events in shop_events.items()
+                               if isinstance(events, list) for event in events]
+                    if records and not store.get_log(shop).segments():
+                        store.append(shop, records)
+                os.replace(TRACKING_FILE, TRACKING_FILE + '.migrated')
+                logger.info(f"Tracking-Daten aus {TRACKING_FILE} in den Event-Store übernommen")
+        except Exception as e:
+            logger.error(f"Fehler bei der Migration der Tracking-Daten: {e}")
+    
+    return store
+
+def iter_shop_tracking_events(shop, event_type=None):
+    """Liest die Tracking-Ereignisse eines Shops streamend als (event_type, data)-Tupel"""
+    return _get_tracking_store().iter_shop_events(shop, event_type)
+
+class TrackingEvents:
+    """
+    Ereignisse eines Shops und Typs als wiederholt iterierbare Sicht.
+
+    Jede Iteration liest streamend aus dem Event-Store; es wird nie die
+    gesamte Historie im Speicher gehalten.
+    """
+
+    def __init__(self, shop, event_type):
+        self.shop = shop
+        self.event_type = event_type
+
+    def __iter__(self):
+        return (data for _, data in iter_shop_tracking_events(self.shop, self.event_type))
+
+    def __repr__(self):
+        return f"TrackingEvents({self.shop!r}, {self.event_type!r})"
+
 def load_tracking_data():
-    """Lädt die Tracking-Daten aus der Datei"""
+    """Gibt die Tracking-Daten aller Shops als streamende Sichten auf den Event-Store zurück"""
     try:
-        if os.path.exists(TRACKING_FILE):
-            with open(TRACKING_FILE, 'r') as f:
-                return json.load(f)
-        return {}
+        store = _get_tracking_store()
+        return {shop: get_shop_tracking_data(shop) for shop in store.shops()}
     except Exception as e:
         logger.error(f"Fehler beim Laden der Tracking-Daten: {e}")
         return {}
 
 def save_tracking_data(data):
-    """Speichert die Tracking-Daten in der Datei"""
+    """Ersetzt die Tracking-Daten der enthaltenen Shops im Event-Store"""
     try:
-        with open(TRACKING_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
+        store = _get_tracking_store()
+        for shop, shop_events in data.items():
+            # Unveränderte Sichten aus load_tracking_data nicht erneut schreiben
+            if any(isinstance(events, TrackingEvents) for events in shop_events.values()):
+                continue
+            records = [(event_type, event) for event_type, events in shop_events.items()
+                       if isinstance(events, list) for event in events]
+            store.replace_shop_events(shop, records)
         logger.info(f"Tracking-Daten gespeichert")
     except Exception as e:
         logger.error(f"Fehler beim Speichern der Tracking-Daten: {e}")
@@ -461,34 +841,118 @@ def save_tracking_data(data):
 def add_tracking_event(shop, event_type, data):
     """Fügt ein Tracking-Ereignis hinzu"""
     try:
-        tracking_data = load_tracking_data()
-        
-        # Shop-Eintrag initialisieren, wenn nicht vorhanden
-        if shop not in tracking_data:
-            tracking_data[shop] = {}
-        
-        # Ereignistyp initialisieren, wenn nicht vorhanden
-        if event_type not in tracking_data[shop]:
-            tracking_data[shop][event_type] = []
-        
-        # Zeitstempel hinzufügen
-        data['timestamp'] = datetime.datetime.now().isoformat()
+        add_tracking_events([(shop, event_type, data)])
+        logger.info(f"Tracking-Ereignis '{event_type}' für Shop {shop} hinzugefügt")
+    except Exception:
+        # Fehler wurde bereits in add_tracking_events protokolliert
+        pass
+
+def add_tracking_events(events):
+    """Hängt mehrere Tracking-Ereignisse gebündelt an die Ereignislogs der Shops an"""
+    try:
+        if not events:
+            return
+            
+        now = datetime.datetime.now().isoformat()
+        by_shop = defaultdict(list)
         
-        # Ereignis hinzufügen
-        tracking_data[shop][event_type].append(data)
+        for shop, event_type, data in events:
+            # Zeitstempel hinzufügen, sofern nicht bereits beim Empfang gesetzt
+            data.setdefault('timestamp', now)
+            by_shop[shop].append((event_type, data))
         
-        # Speichern
-        save_tracking_data(tracking_data)
-        logger.info(f"Tracking-Ereignis '{event_type}' für Shop {shop} hinzugefügt")
+        # Ein Append pro Shop statt eines vollständigen Neuschreibens
+        store = _get_tracking_store()
+        for shop, records in by_shop.items():
+            store.append(shop, records)
+            
+        logger.info(f"{len(events)} Tracking-Ereignisse hinzugefügt")
         
     except Exception as e:
-        logger.error(f"Fehler beim Hinzufügen des Tracking-Ereignisses: {e}")
+        logger.error(f"Fehler beim Hinzufügen der Tracking-Ereignisse: {e}")
+        raise
 
 def get_shop_tracking_data(shop):
-    """Gibt alle Tracking-Daten für einen bestimmten Shop zurück"""
+    """
+    Gibt die Tracking-Daten eines Shops zurück.
+
+    Die Werte sind streamende Sichten (TrackingEvents) statt Listen; wer alle
+    Ereignisse nacheinander braucht, nutzt direkt iter_shop_tracking_events.
+    """
+    return {event_type: TrackingEvents(shop, event_type) for event_type in TRACKING_EVENT_TYPES}
+
+# Shop-Registry (installierte Shops und deren Offline-Access-Tokens)
+
+def _shop_registry_lock():
+    """Sperrt die Shop-Registry prozessübergreifend"""
+    handle = open(SHOP_DATA_FILE + '.lock', 'a')
+    fcntl.flock(handle, fcntl.LOCK_EX)
+    return handle
+
+def _read_shop_registry():
+    if not os.path.exists(SHOP_DATA_FILE):
+        return {}
+    with open(SHOP_DATA_FILE, 'r') as f:
+        return json.load(f)
+
+def _write_shop_registry(registry):
+    tmp_path = SHOP_DATA_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(registry, f)
+    os.replace(tmp_path, SHOP_DATA_FILE)
+
+def get_installed_shops():
+    """Gibt alle installierten Shops als {shop: {'access_token': ..., 'installed_at': ...}} zurück"""
     try:
-        tracking_data = load_tracking_data()
-        return tracking_data.get(shop, {})
+        return _read_shop_registry()
     except Exception as e:
-        logger.error(f"Fehler beim Abrufen der Shop-Tracking-Daten: {e}")
-        return {} 
\ No newline at end of file
+        logger.error(f"Fehler beim Laden der Shop-Registry: {e}")
+        return {}
+
+def register_shop(shop, access_token):
+    """Speichert einen Shop nach erfolgreicher OAuth-Installation"""
+    try:
+        lock = _shop_registry_lock()
+        try:
+            registry = _read_shop_registry()
+            entry = registry.get(shop, {})
+            entry['access_token'] = access_token
+            entry.setdefault('installed_at', datetime.datetime.now().isoformat())
+            entry['updated_at'] = datetime.datetime.now().isoformat()
+            registry[shop] = entry
+            _write_shop_registry(registry)
+        finally:
+            lock.close()
+        logger.info(f"Shop {shop} in der Registry gespeichert")
+    except Exception as e:
+        logger.error(f"Fehler beim Speichern des Shops {shop} in der Registry: {e}")
+
+def _remove_from_shop_registry(shop):
+    lock = _shop_registry_lock()
+    try:
+        registry = _read_shop_registry()
+        if registry.pop(shop, None) is not None:
+            _write_shop_registry(registry)
+            logger.info(f"Shop {shop} aus der Registry entfernt")
+    finally:
+        lock.close()
+
+def unregister_shop(shop):
+    """Entfernt einen Shop nach der Deinstallation aus der Registry"""
+    try:
+        _remove_from_shop_registry(shop)
+    except Exception as e:
+        logger.error(f"Fehler beim Entfernen des Shops {shop} aus der Registry: {e}")
+
+def delete_shop_data(shop):
+    """
+    Löscht alle hier verwalteten Daten eines Shops (shop/redact): gepufferte und
+    gespeicherte Metriken samt Snapshots und Prognosen, die Tracking-Ereignisse
+    und den Registry-Eintrag mit dem Access Token.
+    
+    Fehler werden weitergegeben, damit der Webhook erneut zugestellt wird.
+    """
+    get_metrics_write_behind().discard(shop)
+    get_metrics_backend().delete_shop(shop)
+    get_event_store().delete_shop(shop)
+    _remove_from_shop_registry(shop)
@@ -0,0 +1,210 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+# Logger einrichten
+logger = logging.getLogger('event_buffer')
+
+# Konstanten für Puffergrößen und Flush-Trigger
+BUFFER_MAX_EVENTS = int(os.environ.get('TRACKING_BUFFER_MAX_EVENTS', 20000))
+SHOP_MAX_PENDING = int(os.environ.get('TRACKING_SHOP_MAX_PENDING', 5000))
+FLUSH_BATCH_SIZE = int(os.environ.get('TRACKING_FLUSH_BATCH_SIZE', 500))
+FLUSH_INTERVAL = float(os.environ.get('TRACKING_FLUSH_INTERVAL', 2.0))  # Sekunden
+
+
+class EventBuffer:
+    """Begrenzter In-Process-Puffer für Tracking-Ereignisse mit Batch-Flush"""
+
+    def __init__(self, writer, max_events=BUFFER_MAX_EVENTS, shop_max_pending=SHOP_MAX_PENDING,
+                 batch_size=FLUSH_BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        # writer erhält eine Liste von (shop, event_type, data)-Tupeln
+        self.writer = writer
+        self.max_events = max_events
+        self.shop_max_pending = shop_max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._events = []
+        self._pending = defaultdict(int)
+        self._stats = defaultdict(lambda: {
+            "accepted": 0,
+            "dropped": 0,
+            "flushed": 0,
+            "failed": 0,
+            "last_flush": None
+        })
+        self._worker = None
+        self._worker_pid = None
+
+    def add(self, shop, event_type, data):
+        """
+        Nimmt ein Ereignis in den Puffer auf.
+
+        Returns:
+            bool: False, wenn das Ereignis wegen Backpressure verworfen wurde
+        """
+        self._ensure_worker()
+
+        with self._lock:
+            if len(self._events) >= self.max_events or self._pending[shop] >= self.shop_max_pending:
+                self._stats[shop]["dropped"] += 1
+                return False
+
+            self._events.append((shop, event_type, data))
+            self._pending[shop] += 1
+            self._stats[shop]["accepted"] += 1
+            batch_full = len(self._events) >= self.batch_size
+
+        if batch_full:
+            self._wakeup.set()
+        return True
+
+    def discard_shop(self, shop):
+        """
+        Verwirft die gepufferten Ereignisse eines Shops (z.B. für shop/redact).
+
+        Returns:
+            int: Anzahl verworfener Ereignisse
+        """
+        with self._lock:
+            buffered = len(self._events)
+            self._events = [event for event in self._events if event[0] != shop]
+            self._pending.pop(shop, None)
+            self._stats.pop(shop, None)
+            return buffered - len(self._events)
+
+    def is_saturated(self, shop):
+        """Prüft, ob für den Shop aktuell keine Ereignisse mehr angenommen werden"""
+        with self._lock:
+            return len(self._events) >= self.max_events or self._pending[shop] >= self.shop_max_pending
+
+    def flush(self):
+        """
+        Schreibt alle gepufferten Ereignisse gebündelt pro Shop weg.
+
+        Schlägt das Schreiben für einen Shop fehl, kommen seine Ereignisse vor die
+        inzwischen angenommenen zurück in den Puffer und werden beim nächsten
+        Durchlauf erneut geschrieben. Verworfen werden erst Ereignisse, die danach
+        die Kapazität des Puffers übersteigen (die ältesten zuerst).
+
+        Returns:
+            int: Anzahl geschriebener Ereignisse
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._events
+                self._events = []
+
+            if not batch:
+                return 0
+
+            by_shop = defaultdict(list)
+            for event in batch:
+                by_shop[event[0]].append(event)
+
+            written = {}
+            failed_shops = set()
+            for shop, events in by_shop.items():
+                try:
+                    self.writer(events)
+                    written[shop] = len(events)
+                except Exception as e:
+                    logger.error(f"Fehler beim Schreiben von {len(events)} Tracking-Ereignissen für {shop}, "
+                                 f"neuer Versuch im nächsten Durchlauf: {e}")
+                    failed_shops.add(shop)
+
+            now = time.time()
+            with self._lock:
+                for shop, count in written.items():
+                    self._release(shop, count)
+                    self._stats[shop]["flushed"] += count
+                    self._stats[shop]["last_flush"] = now
+
+                if failed_shops:
+                    # Zwischenzeitlich per discard_shop verworfene Shops nicht zurücklegen
+                    retry = [event for event in batch if event[0] in failed_shops and event[0] in self._pending]
+                    for shop in failed_shops:
+                        self._stats[shop]["failed"] += len(by_shop[shop])
+                    self._events = retry + self._events
+                    overflow = len(self._events) - self.max_events
+                    if overflow > 0:
+                        dropped, self._events = self._events[:overflow], self._events[overflow:]
+                        for shop, _, _ in dropped:
+                            self._release(shop, 1)
+                            self._stats[shop]["dropped"] += 1
+                        logger.error(f"{overflow} Tracking-Ereignisse verworfen, Puffer nach Schreibfehlern voll")
+
+            total = sum(written.values())
+            if total:
+                logger.info(f"{total} Tracking-Ereignisse für {len(written)} Shops geschrieben")
+            return total
+
+    def _release(self, shop, count):
+        """Verringert die ausstehenden Ereignisse eines Shops (Aufruf unter self._lock)"""
+        self._pending[shop] -= count
+        if self._pending[shop] <= 0:
+            del self._pending[shop]
+
+    def get_stats(self, shop=None):
+        """Gibt die Backpressure-Zähler für einen oder alle Shops zurück"""
+        with self._lock:
+            if shop is not None:
+                stats = dict(self._stats[shop]) if shop in self._stats else {
+                    "accepted": 0, "dropped": 0, "flushed": 0, "failed": 0, "last_flush": None
+                }
+                stats["pending"] = self._pending.get(shop, 0)
+                return stats
+
+            return {
+                "buffered": len(self._events),
+                "capacity": self.max_events,
+                "shops": {
+                    name: dict(values, pending=self._pending.get(name, 0))
+                    for name, values in self._stats.items()
+                }
+            }
+
+    def _ensure_worker(self):
+        """Startet den Flush-Thread (nach einem Fork von Gunicorn erneut)"""
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            self._worker_pid = pid
+            self._worker = threading.Thread(target=self._run, name='event-buffer-flush', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        """Flush-Schleife: Größen-Trigger über Event, Zeit-Trigger über Timeout"""
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Fehler im Flush-Thread: {e}")
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_event_buffer():
+    """Gibt den prozessweiten Ereignispuffer zurück"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                from data_models import add_tracking_events
+                _buffer = EventBuffer(add_tracking_events)
+                atexit.register(_buffer.flush)
+    return _buffer
@@ -0,0 +1,476 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import logging
+import datetime
+import threading
+from urllib.parse import quote, unquote
+
+# Logger einrichten
+logger = logging.getLogger('event_store')
+
+# Konstanten
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+EVENTS_DIR = os.path.join(DATA_DIR, 'events')
+SEGMENT_MAX_BYTES = int(os.environ.get('EVENT_SEGMENT_MAX_BYTES', 4 * 1024 * 1024))
+FSYNC_INTERVAL = float(os.environ.get('EVENT_FSYNC_INTERVAL', 1.0))  # Sekunden
+FSYNC_MAX_BYTES = int(os.environ.get('EVENT_FSYNC_MAX_BYTES', 256 * 1024))
+COMPACTION_INTERVAL = float(os.environ.get('EVENT_COMPACTION_INTERVAL', 60.0))  # Sekunden
+COMPACTION_MIN_SEGMENTS = int(os.environ.get('EVENT_COMPACTION_MIN_SEGMENTS', 4))
+RETENTION_DAYS = int(os.environ.get('EVENT_RETENTION_DAYS', 0))  # 0: Ereignisse nie verwerfen (Standard)
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.jsonl'
+LOCK_FILE = '.lock'
+JOURNAL_FILE = '.pending'
+
+
+def _segment_name(number):
+    return f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}"
+
+
+def _encode(event_type, data):
+    return (json.dumps({"t": event_type, "d": data}, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _event_timestamp(line):
+    """Zeitstempel eines gespeicherten Ereignisses oder None"""
+    try:
+        data = json.loads(line).get("d")
+    except ValueError:
+        return None
+    return data.get('timestamp') if isinstance(data, dict) else None
+
+
+def _segment_number(filename):
+    """Gibt die Segmentnummer zurück oder None für fremde Dateien"""
+    if not filename.startswith(SEGMENT_PREFIX) or not filename.endswith(SEGMENT_SUFFIX):
+        return None
+    try:
+        return int(filename[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+    except ValueError:
+        return None
+
+
+class ShopEventLog:
+    """Append-only Ereignislog eines Shops, aufgeteilt in rollende Segmentdateien"""
+
+    def __init__(self, directory, segment_max_bytes=SEGMENT_MAX_BYTES, retention_days=RETENTION_DAYS):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.retention_days = retention_days
+        os.makedirs(self.directory, exist_ok=True)
+
+        lock = self._lock(fcntl.LOCK_EX)
+        try:
+            self._recover()
+        finally:
+            lock.close()
+
+    def _lock(self, mode):
+        """Öffnet die Sperrdatei und sperrt sie prozessübergreifend"""
+        handle = open(os.path.join(self.directory, LOCK_FILE), 'a')
+        fcntl.flock(handle, mode)
+        return handle
+
+    def segments(self):
+        """Gibt die Segmentnummern in Schreibreihenfolge zurück"""
+        numbers = [_segment_number(name) for name in os.listdir(self.directory)]
+        return sorted(n for n in numbers if n is not None)
+
+    def _path(self, number):
+        return os.path.join(self.directory, _segment_name(number))
+
+    def _swap(self, tmp_path, target, obsolete):
+        """
+        Ersetzt target durch tmp_path und entfernt danach die Segmente in obsolete.
+
+        Das Journal hält die zu entfernenden Segmente vor dem Austausch fest. Nach
+        einem Absturz stellt _recover anhand der noch vorhandenen Temporärdatei
+        fest, ob der Austausch stattgefunden hat, und schließt ihn ab oder verwirft ihn.
+        """
+        journal = os.path.join(self.directory, JOURNAL_FILE)
+        if obsolete:
+            with open(journal, 'w') as f:
+                json.dump({"tmp": os.path.basename(tmp_path), "remove": list(obsolete)}, f)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, target)
+        for number in obsolete:
+            if os.path.exists(self._path(number)):
+                os.remove(self._path(number))
+        if obsolete:
+            os.remove(journal)
+
+    def _recover(self):
+        """Schließt einen unterbrochenen Austausch ab (unter exklusiver Sperre aufrufen)"""
+        journal = os.path.join(self.directory, JOURNAL_FILE)
+        if not os.path.exists(journal):
+            return
+        try:
+            with open(journal, 'r') as f:
+                pending = json.load(f)
+        except ValueError:
+            # Journal unvollständig geschrieben: der Austausch hat noch nicht begonnen
+            pending = None
+
+        tmp_path = os.path.join(self.directory, pending["tmp"]) if pending else None
+        if pending and not os.path.exists(tmp_path):
+            for number in pending["remove"]:
+                if os.path.exists(self._path(number)):
+                    os.remove(self._path(number))
+            logger.warning(f"Unterbrochene Kompaktierung in {self.directory} abgeschlossen")
+        elif tmp_path:
+            os.remove(tmp_path)
+        os.remove(journal)
+
+    def append(self, records):
+        """
+        Hängt Ereignisse an das aktive Segment an.
+
+        Args:
+            records (list): Liste von (event_type, data)-Tupeln
+
+        Returns:
+            tuple: (Pfad des beschriebenen Segments, Anzahl geschriebener Bytes)
+        """
+        payload = b''.join(_encode(event_type, data) for event_type, data in records)
+
+        lock = self._lock(fcntl.LOCK_EX)
+        try:
+            numbers = self.segments()
+            number = numbers[-1] if numbers else 1
+            path = os.path.join(self.directory, _segment_name(number))
+
+            # Segment rollen, sobald es die Maximalgröße erreicht hat
+            if os.path.exists(path) and os.path.getsize(path) >= self.segment_max_bytes:
+                number += 1
+                path = os.path.join(self.directory, _segment_name(number))
+
+            with open(path, 'ab') as f:
+                f.write(payload)
+            return path, len(payload)
+        finally:
+            lock.close()
+
+    def iter_events(self, event_type=None):
+        """
+        Liest alle Ereignisse streamend über die Segmente.
+
+        Die Segmentdateien werden unter einer geteilten Sperre geöffnet, damit
+        eine parallele Kompaktierung laufende Leser nicht beeinträchtigt.
+        """
+        lock = self._lock(fcntl.LOCK_SH)
+        try:
+            handles = [open(os.path.join(self.directory, _segment_name(n)), 'rb') for n in self.segments()]
+        finally:
+            lock.close()
+
+        try:
+            for handle in handles:
+                for line in handle:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Unvollständige letzte Zeile nach einem Absturz überspringen
+                        continue
+                    if event_type is None or record.get("t") == event_type:
+                        yield record.get("t"), record.get("d")
+        finally:
+            for handle in handles:
+                handle.close()
+
+    def expire(self, now=None):
+        """
+        Verwirft Ereignisse, die älter als retention_days sind (nur wenn eine
+        Aufbewahrungsfrist konfiguriert ist, standardmäßig bleibt alles erhalten).
+
+        Geprüft wird nur das erste (älteste) Ereignis eines Segments; betroffene
+        Segmente werden gefiltert neu geschrieben oder ganz entfernt. Die Metriken
+        bleiben davon unberührt, sie werden nur für Zeiträume mit Ereignissen gesetzt.
+
+        Returns:
+            tuple: (Anzahl entfernter Segmente, Anzahl verworfener Ereignisse)
+        """
+        if not self.retention_days:
+            return 0, 0
+        now = now or datetime.datetime.now()
+        cutoff = (now - datetime.timedelta(days=self.retention_days)).isoformat()
+
+        lock = self._lock(fcntl.LOCK_EX)
+        try:
+            removed = dropped = 0
+            for number in self.segments():
+                path = self._path(number)
+                with open(path, 'rb') as src:
+                    first = _event_timestamp(src.readline())
+                if first is None or first >= cutoff:
+                    # Segmente sind in Schreibreihenfolge, spätere enthalten neuere Ereignisse
+                    break
+
+                kept = 0
+                tmp_path = path + '.expire'
+                with open(path, 'rb') as src, open(tmp_path, 'wb') as out:
+                    for line in src:
+                        timestamp = _event_timestamp(line)
+                        if timestamp is not None and timestamp < cutoff:
+                            dropped += 1
+                        elif line.endswith(b'\n'):
+                            out.write(line)
+                            kept += 1
+                    out.flush()
+                    os.fsync(out.fileno())
+
+                if kept:
+                    os.replace(tmp_path, path)
+                else:
+                    os.remove(tmp_path)
+                    os.remove(path)
+                    removed += 1
+            return removed, dropped
+        finally:
+            lock.close()
+
+    def compact(self, min_segments=COMPACTION_MIN_SEGMENTS, now=None):
+        """
+        Verwirft abgelaufene Ereignisse (falls eine Aufbewahrungsfrist gesetzt ist)
+        und fasst danach kleine abgeschlossene Segmente zu möglichst wenigen
+        vollen Segmenten zusammen.
+
+        Segmente werden erst bei Erreichen der Maximalgröße abgeschlossen; kleine
+        Segmente entstehen durch replace und das optionale Verwerfen abgelaufener Ereignisse.
+
+        Returns:
+            int: Anzahl der entfernten Segmente
+        """
+        removed, dropped = self.expire(now)
+
+        lock = self._lock(fcntl.LOCK_EX)
+        try:
+            numbers = self.segments()
+            sealed = numbers[:-1]  # Das aktive Segment wird nie zusammengeführt
+            if len(sealed) >= min_segments:
+                removed += self._merge(sealed)
+        finally:
+            lock.close()
+
+        if removed or dropped:
+            logger.info(f"Kompaktierung in {self.directory}: {dropped} abgelaufene Ereignisse verworfen, "
+                        f"{removed} Segmente entfernt")
+        return removed
+
+    def _merge(self, sealed):
+        """Führt zusammenhängende Läufe kleiner Segmente jeweils bis zur Maximalgröße zusammen"""
+        groups = []
+        current, current_size = [], 0
+        for number in sealed:
+            size = os.path.getsize(self._path(number))
+            if current and current_size + size > self.segment_max_bytes:
+                groups.append(current)
+                current, current_size = [], 0
+            current.append(number)
+            current_size += size
+        if current:
+            groups.append(current)
+
+        removed = 0
+        for group in groups:
+            if len(group) < 2:
+                continue
+
+            # In das erste Segment der Gruppe zusammenführen, Reihenfolge bleibt erhalten
+            target = self._path(group[0])
+            tmp_path = target + '.compact'
+            with open(tmp_path, 'wb') as out:
+                for number in group:
+                    with open(self._path(number), 'rb') as src:
+                        for line in src:
+                            if line.endswith(b'\n'):
+                                out.write(line)
+                out.flush()
+                os.fsync(out.fileno())
+            self._swap(tmp_path, target, group[1:])
+            removed += len(group) - 1
+        return removed
+
+    def replace(self, records):
+        """Ersetzt den gesamten Log durch ein neues Segment (für Importe und Migrationen)"""
+        lock = self._lock(fcntl.LOCK_EX)
+        try:
+            numbers = self.segments()
+            target = self._path(1)
+            tmp_path = target + '.replace'
+            with open(tmp_path, 'wb') as out:
+                for event_type, data in records:
+                    out.write(_encode(event_type, data))
+                out.flush()
+                os.fsync(out.fileno())
+            # Erst austauschen, dann die übrigen Segmente entfernen (über das Journal absturzsicher)
+            self._swap(tmp_path, target, [number for number in numbers if number != 1])
+        finally:
+            lock.close()
+
+
+class EventStore:
+    """Verwaltet die Ereignislogs aller Shops mit gebündeltem fsync und Hintergrund-Kompaktierung"""
+
+    def __init__(self, base_dir=EVENTS_DIR, segment_max_bytes=SEGMENT_MAX_BYTES,
+                 fsync_interval=FSYNC_INTERVAL, fsync_max_bytes=FSYNC_MAX_BYTES,
+                 compaction_interval=COMPACTION_INTERVAL, retention_days=RETENTION_DAYS):
+        self.base_dir = base_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.retention_days = retention_days
+        self.fsync_interval = fsync_interval
+        self.fsync_max_bytes = fsync_max_bytes
+        self.compaction_interval = compaction_interval
+        os.makedirs(self.base_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._logs = {}
+        self._unsynced = {}  # Segmentpfad -> noch nicht gesicherte Bytes
+        self._unsynced_bytes = 0
+        self._last_sync = time.time()
+        self._touched_shops = set()
+        self._worker = None
+        self._worker_pid = None
+
+    def _shop_dir(self, shop):
+        return os.path.join(self.base_dir, quote(shop, safe=''))
+
+    def get_log(self, shop):
+        """Gibt den Ereignislog eines Shops zurück"""
+        with self._lock:
+            log = self._logs.get(shop)
+            if log is None:
+                log = ShopEventLog(self._shop_dir(shop), self.segment_max_bytes, self.retention_days)
+                self._logs[shop] = log
+            return log
+
+    def shops(self):
+        """Gibt alle Shops zurück, für die ein Ereignislog existiert"""
+        return [unquote(name) for name in sorted(os.listdir(self.base_dir))
+                if os.path.isdir(os.path.join(self.base_dir, name))]
+
+    def append(self, shop, records):
+        """Hängt Ereignisse an den Log eines Shops an"""
+        if not records:
+            return
+        self._ensure_worker()
+
+        path, written = self.get_log(shop).append(records)
+
+        with self._lock:
+            self._unsynced[path] = self._unsynced.get(path, 0) + written
+            self._unsynced_bytes += written
+            self._touched_shops.add(shop)
+            sync_due = (self._unsynced_bytes >= self.fsync_max_bytes or
+                        time.time() - self._last_sync >= self.fsync_interval)
+
+        if sync_due:
+            self.sync()
+
+    def sync(self):
+        """Sichert alle seit dem letzten Aufruf geschriebenen Segmente per fsync"""
+        with self._lock:
+            paths = list(self._unsynced)
+            self._unsynced = {}
+            self._unsynced_bytes = 0
+            self._last_sync = time.time()
+
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except FileNotFoundError:
+                # Segment wurde zwischenzeitlich kompaktiert (dabei bereits gesichert)
+                continue
+            except OSError as e:
+                logger.error(f"Fehler beim fsync von {path}: {e}")
+
+    def iter_shop_events(self, shop, event_type=None):
+        """Liest die Ereignisse eines Shops streamend"""
+        if not os.path.isdir(self._shop_dir(shop)):
+            return iter(())
+        return self.get_log(shop).iter_events(event_type)
+
+    def replace_shop_events(self, shop, records):
+        """Ersetzt alle Ereignisse eines Shops"""
+        self.get_log(shop).replace(records)
+
+    def delete_shop(self, shop):
+        """Löscht den Ereignislog eines Shops vollständig (z.B. für shop/redact)"""
+        shop_dir = self._shop_dir(shop)
+        with self._lock:
+            self._logs.pop(shop, None)
+            self._touched_shops.discard(shop)
+            for path in [path for path in self._unsynced if os.path.dirname(path) == shop_dir]:
+                self._unsynced_bytes -= self._unsynced.pop(path)
+
+        if not os.path.isdir(shop_dir):
+            return
+        # Unter der Sperre des Logs löschen, damit kein anderer Prozess gerade schreibt oder kompaktiert
+        lock = open(os.path.join(shop_dir, LOCK_FILE), 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            shutil.rmtree(shop_dir)
+        finally:
+            lock.close()
+
+    def compact(self, shops=None):
+        """Kompaktiert die Logs der angegebenen (oder zuletzt beschriebenen) Shops"""
+        if shops is None:
+            with self._lock:
+                shops = self._touched_shops
+                self._touched_shops = set()
+
+        removed = 0
+        for shop in shops:
+            try:
+                removed += self.get_log(shop).compact()
+            except Exception as e:
+                logger.error(f"Fehler bei der Kompaktierung für Shop {shop}: {e}")
+        return removed
+
+    def _ensure_worker(self):
+        """Startet den Hintergrund-Thread für fsync und Kompaktierung (auch nach Fork)"""
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            self._worker_pid = pid
+            self._worker = threading.Thread(target=self._run, name='event-store-maintenance', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        last_compaction = time.time()
+        while True:
+            time.sleep(self.fsync_interval)
+            try:
+                self.sync()
+                if time.time() - last_compaction >= self.compaction_interval:
+                    self.compact()
+                    last_compaction = time.time()
+            except Exception as e:
+                logger.error(f"Fehler im Wartungs-Thread des Event-Stores: {e}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_event_store():
+    """Gibt den prozessweiten Event-Store zurück"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = EventStore()
+    return _store
@@ -0,0 +1,201 @@
+import os
+import sys
+import logging
+import argparse
+import datetime
+import itertools
+import numpy as np
+
+import data_models
+from timeseries import today_index
+
+# Logger einrichten
+logger = logging.getLogger('forecasting')
+
+# Konstanten
+FORECAST_METRICS = ('daily_revenue', 'daily_orders', 'daily_visitors', 'daily_pageviews')
+FORECAST_HISTORY_DAYS = int(os.environ.get('FORECAST_HISTORY_DAYS', 364))
+FORECAST_HORIZON = int(os.environ.get('FORECAST_HORIZON', 30))  # Tage
+FORECAST_INTERVAL = int(os.environ.get('FORECAST_INTERVAL', 86400))  # Sekunden zwischen zwei Batch-Läufen
+FORECAST_SEASON = 7  # Wochensaison
+FORECAST_MIN_HISTORY = 2 * FORECAST_SEASON
+FORECAST_METRIC_PREFIX = 'forecast_'
+
+# Parameterraster (alpha: Niveau, beta: Trend, gamma: Saison); alle Kombinationen laufen gleichzeitig
+ALPHAS = (0.1, 0.3, 0.5, 0.8)
+BETAS = (0.0, 0.02, 0.1)
+GAMMAS = (0.05, 0.2, 0.4)
+INTERVAL_Z = {"80": 1.2816, "95": 1.96}
+
+
+def holt_winters_batch(values, starts, season=FORECAST_SEASON, horizon=FORECAST_HORIZON,
+                       alphas=ALPHAS, betas=BETAS, gammas=GAMMAS):
+    """
+    Passt additive Holt-Winters-Modelle für viele Reihen in einem vektorisierten Durchlauf an.
+
+    Alle Reihen und alle Parameterkombinationen werden gemeinsam Zeitschritt für
+    Zeitschritt fortgeschrieben (Arrays der Form Kombinationen × Reihen). Pro Reihe
+    gewinnt die Kombination mit dem kleinsten Einschrittfehler.
+
+    Args:
+        values (np.ndarray): Reihen × Tage, gemeinsames Enddatum, Lücken als 0
+        starts (np.ndarray): Index des ersten Tages jeder Reihe
+        season (int): Saisonlänge in Tagen
+
+    Returns:
+        dict: "forecast" (Reihen × Horizont), "sigma" (Reihen × Horizont, Standardfehler je Schritt),
+              "alpha", "beta", "gamma", "rmse" (je Reihe)
+    """
+    values = np.asarray(values, dtype='<f8')
+    starts = np.asarray(starts)
+    n_series, n_days = values.shape
+    params = np.array(list(itertools.product(alphas, betas, gammas)))
+    alpha, beta, gamma = (params[:, i][:, None] for i in range(3))
+    n_params = len(params)
+    rows = np.arange(n_series)
+
+    # Initialisierung aus den ersten beiden Saisons jeder Reihe (phasengleich zum Kalender)
+    first = values[rows[:, None], starts[:, None] + np.arange(season)]
+    second = values[rows[:, None], starts[:, None] + season + np.arange(season)]
+    level0 = first.mean(axis=1)
+    trend0 = (second.mean(axis=1) - level0) / season
+    seasonal0 = np.zeros((n_series, season))
+    seasonal0[rows[:, None], (starts[:, None] + np.arange(season)) % season] = first - level0[:, None]
+
+    level = np.broadcast_to(level0 + trend0 * (season - 1), (n_params, n_series)).copy()
+    trend = np.broadcast_to(trend0, (n_params, n_series)).copy()
+    seasonal = np.broadcast_to(seasonal0, (n_params, n_series, season)).copy()
+    sse = np.zeros((n_params, n_series))
+    steps = np.zeros(n_series)
+
+    fit_start = starts + season
+    for t in range(int(fit_start.min()), n_days):
+        active = t >= fit_start
+        if not active.any():
+            continue
+        phase = t % season
+        y = values[:, t]
+        season_t = seasonal[:, :, phase]
+        error = y - (level + trend + season_t)
+        sse += np.where(active, error ** 2, 0.0)
+        steps += active
+
+        new_level = alpha * (y - season_t) + (1 - alpha) * (level + trend)
+        new_trend = beta * (new_level - level) + (1 - beta) * trend
+        new_season = gamma * (y - new_level) + (1 - gamma) * season_t
+        level = np.where(active, new_level, level)
+        trend = np.where(active, new_trend, trend)
+        seasonal[:, :, phase] = np.where(active, new_season, season_t)
+
+    best = np.argmin(sse, axis=0)
+    rmse = np.sqrt(sse[best, rows] / np.maximum(steps, 1))
+    level, trend, seasonal = level[best, rows], trend[best, rows], seasonal[best, rows]
+    a, b, g = params[best, 0], params[best, 1], params[best, 2]
+
+    h = np.arange(1, horizon + 1)
+    phases = (n_days - 1 + h) % season
+    forecast = level[:, None] + trend[:, None] * h + seasonal[:, phases]
+
+    # Varianz des h-Schritt-Fehlers: sigma² * (1 + Σ_{j<h} c_j²) mit c_j = alpha(1 + j·beta) + gamma·[j mod m = 0]
+    j = np.arange(1, horizon)
+    c = a[:, None] * (1 + j * b[:, None]) + g[:, None] * (j % season == 0)
+    variance_factor = np.concatenate([np.ones((n_series, 1)), 1 + np.cumsum(c ** 2, axis=1)], axis=1)
+    sigma = rmse[:, None] * np.sqrt(variance_factor)
+
+    return {"forecast": forecast, "sigma": sigma, "alpha": a, "beta": b, "gamma": g, "rmse": rmse}
+
+
+def _history(series, end, days=FORECAST_HISTORY_DAYS):
+    """Letzte `days` Tage bis `end` (Lücken als 0) und Index des ersten Tages mit Daten"""
+    window = series.window(days, end)
+    known = np.flatnonzero(~np.isnan(window.values))
+    start = int(known[0]) if len(known) else days
+    return window.fill_gaps('zero').values, start
+
+
+def build_forecast(result, i, first_day):
+    """Bringt die Prognose einer Reihe in das gespeicherte Format"""
+    dates = np.arange(first_day, first_day + result["forecast"].shape[1]).astype('datetime64[D]').astype(str)
+    forecast = np.clip(result["forecast"][i], 0, None)
+    points = []
+    for k, date in enumerate(dates.tolist()):
+        point = {"date": date, "value": round(float(forecast[k]), 2)}
+        for level, z in INTERVAL_Z.items():
+            spread = z * result["sigma"][i, k]
+            point[f"lower_{level}"] = round(max(0.0, float(result["forecast"][i, k] - spread)), 2)
+            point[f"upper_{level}"] = round(float(result["forecast"][i, k] + spread), 2)
+        points.append(point)
+
+    return {
+        "generated_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "model": "holt_winters_additive",
+        "params": {"alpha": float(result["alpha"][i]), "beta": float(result["beta"][i]),
+                   "gamma": float(result["gamma"][i])},
+        "rmse": round(float(result["rmse"][i]), 4),
+        "points": points
+    }
+
+
+def run_batch(shops=None, metrics=FORECAST_METRICS, horizon=FORECAST_HORIZON, backend=None):
+    """
+    Berechnet die Prognosen aller (oder der angegebenen) Shops und Metriken in einem Durchlauf.
+
+    Returns:
+        dict: {"series": Anzahl Reihen mit Prognose, "skipped": zu kurze Reihen}
+    """
+    backend = backend or data_models.get_metrics_backend()
+    shops = shops if shops is not None else list(data_models.get_installed_shops())
+    # Der heutige Tag ist noch unvollständig: Historie endet gestern, die Prognose beginnt heute
+    end = today_index() - 1
+
+    keys, histories, starts = [], [], []
+    skipped = 0
+    for shop in shops:
+        shop_metrics = data_models.ShopMetrics(shop, backend=backend)
+        for metric_name in metrics:
+            series = shop_metrics.get_series(metric_name)
+            if series is None or len(series) == 0:
+                continue
+            values, start = _history(series, end)
+            if len(values) - start < FORECAST_MIN_HISTORY:
+                skipped += 1
+                continue
+            keys.append((shop, metric_name))
+            histories.append(values)
+            starts.append(start)
+
+    if not keys:
+        return {"series": 0, "skipped": skipped}
+
+    result = holt_winters_batch(np.vstack(histories), np.array(starts), horizon=horizon)
+    for i, (shop, metric_name) in enumerate(keys):
+        backend.save_artifact(shop, f"{FORECAST_METRIC_PREFIX}{metric_name}", build_forecast(result, i, end + 1))
+
+    logger.info(f"Prognosen für {len(keys)} Reihen aus {len(shops)} Shops berechnet, {skipped} zu kurz")
+    return {"series": len(keys), "skipped": skipped}
+
+
+def get_forecast(shop, metric_name, backend=None):
+    """
+    Gibt die gespeicherte Prognose einer Metrik zurück.
+
+    Berechnet wird nur im Batch-Lauf des Schedulers, nie in einer Anfrage. Fehlt
+    die Prognose (neu installierter Shop, zu kurze Historie), wird None zurückgegeben.
+    """
+    backend = backend or data_models.get_metrics_backend()
+    return backend.load_artifact(shop, f"{FORECAST_METRIC_PREFIX}{metric_name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prognosen für alle installierten Shops berechnen')
+    parser.add_argument('--shop', action='append', help='Nur diesen Shop berechnen (mehrfach möglich)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    summary = run_batch(args.shop)
+    print(f"{summary['series']} Prognosen gespeichert, {summary['skipped']} Reihen zu kurz")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import os
+import re
+import sqlite3
+import datetime
+import logging
+import threading
+import numpy as np
+
+# Logger einrichten
+logger = logging.getLogger('hourly_metrics')
+
+# Konstanten
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+HOURLY_METRICS_DB_FILE = os.path.join(DATA_DIR, 'hourly_metrics.db')
+HOURLY_SERIES_MAX_POINTS = int(os.environ.get('HOURLY_SERIES_MAX_POINTS', 100))  # Punkte je Diagramm
+
+# Auflösungen der Buckets (gespeicherter Code = Position); jede Stunde wird in alle vier gebucht
+RESOLUTIONS = ('hour', 'day', 'week', 'month')
+HOUR, DAY, WEEK, MONTH = range(len(RESOLUTIONS))
+
+# Offset am Ende eines ISO-Zeitstempels, z.B. +02:00 oder -0530
+UTC_OFFSET_PATTERN = re.compile(r'([+-])(\d{2}):?(\d{2})$')
+
+SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_buckets (
+    shop TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (shop, metric, resolution, bucket)
+) WITHOUT ROWID;
+"""
+SQL_INCREMENT_BUCKET = """
+INSERT INTO metric_buckets (shop, metric, resolution, bucket, value) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (shop, metric, resolution, bucket) DO UPDATE SET value = value + excluded.value
+"""
+SQL_SELECT_BUCKETS = """
+SELECT bucket, value FROM metric_buckets
+WHERE shop = ? AND metric = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+"""
+SQL_SUM_BUCKETS = """
+SELECT SUM(value), COUNT(*) FROM metric_buckets
+WHERE shop = ? AND metric = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+"""
+SQL_FIRST_HOUR = "SELECT MIN(bucket) FROM metric_buckets WHERE shop = ? AND metric = ? AND resolution = 0"
+SQL_DELETE_SHOP = "DELETE FROM metric_buckets WHERE shop = ?"
+
+
+def timestamps_to_hours(timestamps):
+    """
+    Wandelt ISO-Zeitstempel in UTC-Stundenindizes (Stunden seit 1970-01-01T00 UTC) um.
+
+    Zeitstempel mit Offset oder 'Z' werden über ihren Offset umgerechnet, naive
+    Zeitstempel (datetime.now().isoformat() beim Tracking) gelten als lokale
+    Serverzeit. So liegen Seitenaufrufe in denselben UTC-Stunden wie die
+    Bestellungen (order_sync.order_hour).
+
+    Returns:
+        tuple: (Stundenindizes als int64-Array, Maske der gültigen Zeitstempel)
+    """
+    timestamps = [ts or '' for ts in timestamps]
+    prefixes = [ts[:16].replace(' ', 'T') for ts in timestamps]
+    try:
+        minutes = np.array(prefixes, dtype='datetime64[m]')
+    except ValueError:
+        # Einzelne ungültige Zeitstempel: elementweise umwandeln und als NaT markieren
+        minutes = np.array([_parse_minute(prefix) for prefix in prefixes], dtype='datetime64[m]')
+    valid = ~np.isnat(minutes)
+    minutes = np.where(valid, minutes.astype(np.int64), 0)
+
+    offsets = np.array([_utc_offset_minutes(ts) for ts in timestamps], dtype=np.float64)
+    naive = np.isnan(offsets) & valid
+    if naive.any():
+        local_hours, inverse = np.unique(minutes[naive] // 60, return_inverse=True)
+        local_offsets = np.array([_local_offset_minutes(hour) for hour in local_hours.tolist()])
+        offsets[naive] = local_offsets[inverse]
+    offsets = np.nan_to_num(offsets).astype(np.int64)
+    return np.where(valid, (minutes - offsets) // 60, 0), valid
+
+
+def _parse_minute(prefix):
+    try:
+        return np.datetime64(prefix, 'm')
+    except ValueError:
+        return np.datetime64('NaT', 'm')
+
+
+def _utc_offset_minutes(timestamp):
+    """Offset eines Zeitstempels in Minuten, NaN für naive Zeitstempel"""
+    if timestamp.endswith('Z'):
+        return 0
+    match = UTC_OFFSET_PATTERN.search(timestamp, 19)
+    if not match:
+        return np.nan
+    sign, hours, minutes = match.groups()
+    offset = int(hours) * 60 + int(minutes)
+    return -offset if sign == '-' else offset
+
+
+def _local_offset_minutes(hour):
+    """Offset der lokalen Serverzeit zur angegebenen lokalen Stunde in Minuten"""
+    local = datetime.datetime(1970, 1, 1) + datetime.timedelta(hours=hour)
+    return int(local.astimezone().utcoffset().total_seconds()) // 60
+
+
+def to_buckets(hours, resolution):
+    """Bucket-Indizes der angegebenen Stunden in einer Auflösung"""
+    hours = np.asarray(hours, dtype=np.int64)
+    if resolution == HOUR:
+        return hours
+    days = hours // 24
+    if resolution == DAY:
+        return days
+    if resolution == WEEK:
+        return (days + 3) // 7  # Wochen beginnen montags, 1970-01-01 war ein Donnerstag
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+def bucket_start(bucket, resolution):
+    """Erste Stunde eines Buckets"""
+    if resolution == HOUR:
+        return int(bucket)
+    if resolution == DAY:
+        return int(bucket) * 24
+    if resolution == WEEK:
+        return (int(bucket) * 7 - 3) * 24
+    return int(np.datetime64(int(bucket), 'M').astype('datetime64[D]').astype(np.int64)) * 24
+
+
+def cover(first_hour, end_hour, resolution=MONTH):
+    """
+    Zerlegt den Stundenbereich [first_hour, end_hour) in möglichst grobe Buckets.
+
+    In der Mitte liegen ganze Monate, zu den Rändern hin Wochen, Tage und Stunden;
+    ein Jahr besteht so aus wenigen Dutzend Buckets statt aus 8760 Stunden.
+
+    Returns:
+        list: [(Auflösung, erster Bucket, Bucket nach dem letzten)]
+    """
+    if first_hour >= end_hour:
+        return []
+    if resolution == HOUR:
+        return [(HOUR, first_hour, end_hour)]
+
+    lo = int(to_buckets(first_hour, resolution))
+    if bucket_start(lo, resolution) < first_hour:
+        lo += 1
+    hi = int(to_buckets(end_hour, resolution))
+    if lo >= hi:
+        return cover(first_hour, end_hour, resolution - 1)
+    return (cover(first_hour, bucket_start(lo, resolution), resolution - 1)
+            + [(resolution, lo, hi)]
+            + cover(bucket_start(hi, resolution), end_hour, resolution - 1))
+
+
+def series_resolution(first_hour, end_hour, max_points=HOURLY_SERIES_MAX_POINTS):
+    """Feinste Auflösung, bei der der Bereich höchstens max_points Buckets umfasst"""
+    for resolution in (HOUR, DAY, WEEK):
+        points = int(to_buckets(end_hour - 1, resolution)) - int(to_buckets(first_hour, resolution)) + 1
+        if points <= max_points:
+            return resolution
+    return MONTH
+
+
+class HourlyMetricsStore:
+    """
+    Stündliche Metriken mit automatischen Rollups auf Tag, Woche und Monat (SQLite im WAL-Modus).
+
+    Jede Änderung einer Stunde wird in derselben Transaktion als Delta auf die
+    zugehörigen Tages-, Wochen- und Monats-Buckets gebucht. Abfragen über einen
+    Zeitraum lesen dadurch nur die gröbsten Buckets, die ihn abdecken.
+    Geeignet für additive Metriken: Seitenaufrufe (update_traffic_metrics) sowie
+    Umsatz und Bestellungen (order_sync.publish_days).
+    """
+
+    def __init__(self, db_path=HOURLY_METRICS_DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self.connection().executescript(SQL_SCHEMA)
+
+    def connection(self):
+        """Gibt die Verbindung des aktuellen Threads zurück"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _apply_deltas(self, conn, shop, metric, hours, deltas):
+        """Bucht Stunden-Deltas in alle Auflösungen (innerhalb einer offenen Transaktion)"""
+        rows = []
+        for resolution in range(len(RESOLUTIONS)):
+            buckets, inverse = np.unique(to_buckets(hours, resolution), return_inverse=True)
+            sums = np.bincount(inverse, weights=deltas, minlength=len(buckets))
+            rows.extend((shop, metric, resolution, bucket, value)
+                        for bucket, value in zip(buckets.tolist(), sums.tolist()) if value)
+        conn.executemany(SQL_INCREMENT_BUCKET, rows)
+
+    def set_hours(self, shop, metric, values):
+        """
+        Setzt die Werte einzelner Stunden (idempotent, z.B. beim erneuten Zählen der Tracking-Daten).
+
+        Nur die Differenz zum gespeicherten Wert wird in die Rollups gebucht.
+
+        Args:
+            values (dict): {Stundenindex: Wert}
+        """
+        if not values:
+            return
+        hours = np.fromiter(values.keys(), dtype=np.int64, count=len(values))
+        new = np.fromiter(values.values(), dtype='<f8', count=len(values))
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            stored = dict(conn.execute(SQL_SELECT_BUCKETS, (shop, metric, HOUR, int(hours.min()),
+                                                            int(hours.max()) + 1)).fetchall())
+            old = np.fromiter((stored.get(hour, 0.0) for hour in hours.tolist()), dtype='<f8', count=len(hours))
+            changed = new != old
+            if changed.any():
+                self._apply_deltas(conn, shop, metric, hours[changed], (new - old)[changed])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def total(self, shop, metric, first_hour, end_hour):
+        """
+        Summe über [first_hour, end_hour) aus den gröbsten abdeckenden Buckets.
+
+        Returns:
+            float oder None, wenn für den Zeitraum keine Daten vorliegen
+        """
+        conn = self.connection()
+        total, found = 0.0, 0
+        for resolution, lo, hi in cover(first_hour, end_hour):
+            value, count = conn.execute(SQL_SUM_BUCKETS, (shop, metric, resolution, lo, hi)).fetchone()
+            total += value or 0.0
+            found += count
+        return total if found else None
+
+    def series(self, shop, metric, first_hour, end_hour, resolution=None):
+        """
+        Werte aller Buckets, die [first_hour, end_hour) berühren.
+
+        Ohne Auflösung wird die feinste gewählt, die höchstens HOURLY_SERIES_MAX_POINTS
+        Punkte ergibt (z.B. Tage für 90 Tage, Wochen für ein Jahr).
+
+        Returns:
+            tuple: (Auflösung, Bucket-Indizes, Werte; fehlende Buckets als 0)
+        """
+        if resolution is None:
+            resolution = series_resolution(first_hour, end_hour)
+        lo = int(to_buckets(first_hour, resolution))
+        hi = int(to_buckets(end_hour - 1, resolution)) + 1
+        buckets = np.arange(lo, max(lo, hi), dtype=np.int64)
+        values = np.zeros(len(buckets))
+        rows = self.connection().execute(SQL_SELECT_BUCKETS, (shop, metric, resolution, lo, hi)).fetchall()
+        if rows:
+            stored = np.array(rows, dtype='<f8')
+            values[stored[:, 0].astype(np.int64) - lo] = stored[:, 1]
+        return resolution, buckets, values
+
+    def first_hour(self, shop, metric):
+        """Erste gespeicherte Stunde einer Metrik oder None; davor liegen höchstens Tageswerte"""
+        return self.connection().execute(SQL_FIRST_HOUR, (shop, metric)).fetchone()[0]
+
+    def hourly_values(self, shop, metric, first_hour, end_hour):
+        """Stundenwerte für [first_hour, end_hour) als dichtes Array (fehlende Stunden als 0)"""
+        return self.series(shop, metric, first_hour, end_hour, HOUR)[2]
+
+    def delete_shop(self, shop):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(SQL_DELETE_SHOP, (shop,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_hourly_store():
+    """Gibt den prozessweiten Store der stündlichen Metriken zurück"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = HourlyMetricsStore()
+    return _store
@@ -0,0 +1,519 @@
+import os
+import json
+import fcntl
+import shutil
+import sqlite3
+import logging
+import datetime
+import threading
+import numpy as np
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+
+# Logger einrichten
+logger = logging.getLogger('metrics_store')
+
+# Konstanten
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+METRICS_DIR = os.path.join(DATA_DIR, 'metrics')
+METRICS_DB_FILE = os.path.join(DATA_DIR, 'metrics.db')
+METRICS_BACKEND = os.environ.get('METRICS_BACKEND', 'columnar')  # 'columnar' oder 'sqlite'
+
+# Spaltenlayout einer Zeitreihe: Tagesindex (Tage seit 1970-01-01) und Wert
+SERIES_DTYPE = np.dtype([('day', '<i4'), ('value', '<f8')])
+# Zählmetriken behalten ganzzahlige Werte
+SERIES_INT_DTYPE = np.dtype([('day', '<i4'), ('value', '<i8')])
+INTEGER_METRICS = frozenset(('daily_orders', 'daily_pageviews', 'daily_visitors'))
+SERIES_SUFFIX = '.npy'
+SNAPSHOT_SUFFIX = '.json'
+ARTIFACTS_DIR = 'artifacts'
+# Früher als Momentaufnahmen gespeicherte abgeleitete Ergebnisse (Dashboard, Prognosen, Saisonalität)
+LEGACY_ARTIFACT_PREFIXES = ('dashboard_snapshot_', 'forecast_', 'seasonality_')
+
+
+def dates_to_days(dates):
+    """Wandelt 'YYYY-MM-DD'-Strings in Tagesindizes um"""
+    return np.asarray(dates, dtype='datetime64[D]').astype('<i4')
+
+
+def days_to_dates(days):
+    """Wandelt Tagesindizes in 'YYYY-MM-DD'-Strings um"""
+    return np.asarray(days, dtype='<i4').astype('datetime64[D]').astype(str)
+
+
+def series_dtype(metric):
+    """Spaltenlayout einer Zeitreihe (ganzzahlig für Zählmetriken)"""
+    return SERIES_INT_DTYPE if metric in INTEGER_METRICS else SERIES_DTYPE
+
+
+def _as_values(metric, values):
+    """Wandelt Werte in den Werttyp der Metrik um (Zählmetriken gerundet als int64)"""
+    values = np.asarray(values, dtype='<f8')
+    if metric in INTEGER_METRICS:
+        return np.rint(values).astype('<i8')
+    return values
+
+
+class MetricsBackend:
+    """
+    Schnittstelle für die Persistenz von Shop-Metriken.
+
+    Zeitreihen werden punktweise ({'YYYY-MM-DD': Wert}) geschrieben, damit
+    gleichzeitige Aktualisierungen verschiedener Tage oder Metriken sich nicht
+    gegenseitig überschreiben. Momentaufnahmen werden als Ganzes ersetzt.
+    """
+
+    def has_shop(self, shop):
+        """Prüft, ob für den Shop bereits Metriken gespeichert sind"""
+        raise NotImplementedError
+
+    def ensure_shop(self, shop):
+        """Registriert einen Shop, auch wenn noch keine Metriken vorliegen"""
+        raise NotImplementedError
+
+    def load_series(self, shop, metric):
+        """Lädt eine Zeitreihe als {'YYYY-MM-DD': Wert}-Dictionary"""
+        raise NotImplementedError
+
+    def load_series_arrays(self, shop, metric):
+        """
+        Lädt eine Zeitreihe als Arrays, ohne Python-Objekte pro Tag zu erzeugen.
+
+        Returns:
+            tuple: (Tagesindizes, Werte); Zählmetriken (INTEGER_METRICS) als int64
+        """
+        raise NotImplementedError
+
+    def load_snapshot(self, shop, metric, default=None):
+        """Lädt eine Momentaufnahme-Metrik"""
+        raise NotImplementedError
+
+    def load_snapshots(self, shop):
+        """Lädt alle Momentaufnahme-Metriken eines Shops (ohne Zeitreihen)"""
+        raise NotImplementedError
+
+    def load_shop(self, shop):
+        """Lädt alle Metriken eines Shops (Zeitreihen als Dictionaries, z.B. für Exporte)"""
+        raise NotImplementedError
+
+    def save_series(self, shop, metric, points):
+        """Schreibt geänderte Punkte in eine Zeitreihe"""
+        raise NotImplementedError
+
+    def save_snapshot(self, shop, metric, value):
+        """Schreibt eine Momentaufnahme-Metrik"""
+        raise NotImplementedError
+
+    def increment_series(self, shop, metric, deltas):
+        """Addiert Deltas ({'YYYY-MM-DD': Delta}) atomar auf die gespeicherten Tageswerte"""
+        raise NotImplementedError
+
+    def load_artifact(self, shop, name, default=None):
+        """
+        Lädt ein abgeleitetes Ergebnis (Dashboard-Snapshot, Prognose, Saisonalität).
+
+        Abgeleitete Ergebnisse liegen getrennt von den Metriken und werden von
+        load_shop nicht geladen.
+        """
+        raise NotImplementedError
+
+    def save_artifact(self, shop, name, value):
+        """Schreibt ein abgeleitetes Ergebnis"""
+        raise NotImplementedError
+
+    def delete_shop(self, shop):
+        """Löscht alle Zeitreihen, Momentaufnahmen und abgeleiteten Ergebnisse eines Shops (z.B. für shop/redact)"""
+        raise NotImplementedError
+
+
+class ColumnarMetricsBackend(MetricsBackend):
+    """
+    Spaltenorientierter Metrik-Speicher mit einer Datei pro Shop und Metrik.
+
+    Zeitreihen liegen als sortierte NumPy-Arrays (Tagesindex + Wert) in
+    .npy-Dateien, Momentaufnahmen (Zähler, Verteilungen) als kleine JSON-Dateien.
+    Abgeleitete Ergebnisse liegen als JSON im Unterverzeichnis artifacts/.
+    Lese- und Schreibzugriffe berühren nur die Datei der betroffenen Metrik;
+    Schreiber halten zusätzlich die Shop-Sperre geteilt, delete_shop exklusiv.
+    """
+
+    def __init__(self, base_dir=METRICS_DIR):
+        self.base_dir = base_dir
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def _shop_dir(self, shop):
+        return os.path.join(self.base_dir, quote(shop, safe=''))
+
+    def _path(self, shop, metric, suffix):
+        return os.path.join(self._shop_dir(shop), quote(metric, safe='') + suffix)
+
+    def _shop_lock(self, shop, mode):
+        """Sperrt einen Shop prozessübergreifend (die Sperrdatei liegt außerhalb des Shop-Verzeichnisses)"""
+        handle = open(self._shop_dir(shop) + '.lock', 'a')
+        fcntl.flock(handle, mode)
+        return handle
+
+    @contextmanager
+    def _lock(self, shop, path):
+        """Sperrt eine Metrikdatei prozessübergreifend für Read-Modify-Write"""
+        shop_handle = self._shop_lock(shop, fcntl.LOCK_SH)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.lock', 'a') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                yield
+        finally:
+            shop_handle.close()
+
+    def has_shop(self, shop):
+        """Prüft, ob für den Shop bereits Metriken gespeichert sind"""
+        return os.path.isdir(self._shop_dir(shop))
+
+    def ensure_shop(self, shop):
+        """Legt das Verzeichnis eines Shops an"""
+        os.makedirs(self._shop_dir(shop), exist_ok=True)
+
+    def delete_shop(self, shop):
+        """Entfernt das Verzeichnis eines Shops samt aller Metrikdateien (unter exklusiver Shop-Sperre)"""
+        lock = self._shop_lock(shop, fcntl.LOCK_EX)
+        try:
+            shutil.rmtree(self._shop_dir(shop), ignore_errors=True)
+        finally:
+            lock.close()
+
+    def list_metrics(self, shop):
+        """Gibt die gespeicherten Metriken eines Shops als (Name, Typ)-Tupel zurück"""
+        shop_dir = self._shop_dir(shop)
+        if not os.path.isdir(shop_dir):
+            return []
+
+        metrics = []
+        for filename in sorted(os.listdir(shop_dir)):
+            if filename.endswith(SERIES_SUFFIX):
+                metrics.append((unquote(filename[:-len(SERIES_SUFFIX)]), 'series'))
+            elif filename.endswith(SNAPSHOT_SUFFIX):
+                if filename.startswith(LEGACY_ARTIFACT_PREFIXES):
+                    # Veraltete Kopie eines abgeleiteten Ergebnisses, liegt jetzt unter artifacts/
+                    continue
+                metrics.append((unquote(filename[:-len(SNAPSHOT_SUFFIX)]), 'snapshot'))
+        return metrics
+
+    def load_series_array(self, shop, metric, mmap=True):
+        """Lädt eine Zeitreihe als strukturiertes Array (standardmäßig memory-mapped)"""
+        path = self._path(shop, metric, SERIES_SUFFIX)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=series_dtype(metric))
+        return np.load(path, mmap_mode='r' if mmap else None)
+
+    def load_series_arrays(self, shop, metric):
+        """Gibt Tage und Werte als Sichten auf die memory-mapped Datei zurück"""
+        arr = self.load_series_array(shop, metric)
+        values = arr['value']
+        if metric in INTEGER_METRICS and values.dtype.kind == 'f':
+            # Vor der Umstellung als float64 gespeicherte Zählmetrik
+            values = _as_values(metric, values)
+        return arr['day'], values
+
+    def load_series(self, shop, metric):
+        """Lädt eine Zeitreihe als {'YYYY-MM-DD': Wert}-Dictionary"""
+        days, values = self.load_series_arrays(shop, metric)
+        if len(days) == 0:
+            return {}
+        return dict(zip(days_to_dates(days).tolist(), values.tolist()))
+
+    def load_snapshot(self, shop, metric, default=None):
+        """Lädt eine Momentaufnahme-Metrik"""
+        path = self._path(shop, metric, SNAPSHOT_SUFFIX)
+        if not os.path.exists(path):
+            return default
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def load_snapshots(self, shop):
+        """Lädt alle Momentaufnahme-Metriken eines Shops; die .npy-Dateien werden nicht geöffnet"""
+        return {metric: self.load_snapshot(shop, metric)
+                for metric, kind in self.list_metrics(shop) if kind == 'snapshot'}
+
+    def load_shop(self, shop):
+        """Lädt alle Metriken eines Shops (Zeitreihen als Dictionaries, z.B. für Exporte)"""
+        metrics = {}
+        for metric, kind in self.list_metrics(shop):
+            if kind == 'series':
+                metrics[metric] = self.load_series(shop, metric)
+            else:
+                metrics[metric] = self.load_snapshot(shop, metric)
+        return metrics
+
+    def save_series(self, shop, metric, points):
+        """
+        Schreibt geänderte Punkte in eine Zeitreihe.
+
+        Args:
+            points (dict): {'YYYY-MM-DD': Wert}; vorhandene Tage werden überschrieben
+        """
+        if not points:
+            return
+
+        self._merge_series(shop, metric, points, accumulate=False)
+
+    def increment_series(self, shop, metric, deltas):
+        """
+        Addiert Deltas auf die gespeicherten Tageswerte.
+
+        Args:
+            deltas (dict): {'YYYY-MM-DD': Delta}; fehlende Tage beginnen bei 0
+        """
+        if not deltas:
+            return
+
+        self._merge_series(shop, metric, deltas, accumulate=True)
+
+    def _merge_series(self, shop, metric, points, accumulate):
+        """Führt Punkte unter Dateisperre in die Zeitreihe ein (ersetzen oder aufaddieren)"""
+        path = self._path(shop, metric, SERIES_SUFFIX)
+        new_days = dates_to_days(list(points.keys()))
+        new_values = _as_values(metric, list(points.values()))
+
+        with self._lock(shop, path):
+            existing = self.load_series_array(shop, metric, mmap=False)
+            days = np.concatenate([existing['day'], new_days])
+            values = np.concatenate([_as_values(metric, existing['value']), new_values])
+
+            # Stabil sortieren, damit bei gleichen Tagen der neue Wert zuletzt steht
+            order = np.argsort(days, kind='stable')
+            days = days[order]
+            values = values[order]
+            keep = np.append(days[1:] != days[:-1], True)
+
+            merged = np.empty(int(keep.sum()), dtype=series_dtype(metric))
+            merged['day'] = days[keep]
+            if accumulate:
+                # Werte je Tag aufsummieren
+                starts = np.flatnonzero(np.insert(days[1:] != days[:-1], 0, True))
+                merged['value'] = np.add.reduceat(values, starts) if len(values) else values
+            else:
+                merged['value'] = values[keep]
+            self._write_array(path, merged)
+
+    def save_snapshot(self, shop, metric, value):
+        """Schreibt eine Momentaufnahme-Metrik"""
+        path = self._path(shop, metric, SNAPSHOT_SUFFIX)
+        with self._lock(shop, path):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+
+    def _artifact_path(self, shop, name):
+        return os.path.join(self._shop_dir(shop), ARTIFACTS_DIR, quote(name, safe='') + SNAPSHOT_SUFFIX)
+
+    def load_artifact(self, shop, name, default=None):
+        """Lädt ein abgeleitetes Ergebnis"""
+        path = self._artifact_path(shop, name)
+        if not os.path.exists(path):
+            return default
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save_artifact(self, shop, name, value):
+        """Schreibt ein abgeleitetes Ergebnis"""
+        path = self._artifact_path(shop, name)
+        with self._lock(shop, path):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+
+    def _write_array(self, path, arr):
+        """Schreibt ein Array atomar über eine temporäre Datei"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, arr)
+        os.replace(tmp_path, path)
+
+
+# Vorbereitete SQL-Anweisungen (werden vom sqlite3-Statement-Cache je Verbindung wiederverwendet)
+SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_shops (
+    shop TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metric_points (
+    shop TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    date TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_metric_points_shop_metric_date
+    ON metric_points (shop, metric, date);
+CREATE TABLE IF NOT EXISTS metric_snapshots (
+    shop TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (shop, metric)
+);
+CREATE TABLE IF NOT EXISTS metric_artifacts (
+    shop TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (shop, name)
+);
+"""
+SQL_REGISTER_SHOP = "INSERT OR IGNORE INTO metric_shops (shop, created_at) VALUES (?, ?)"
+SQL_HAS_SHOP = "SELECT 1 FROM metric_shops WHERE shop = ?"
+SQL_UPSERT_POINT = """
+INSERT INTO metric_points (shop, metric, date, value) VALUES (?, ?, ?, ?)
+ON CONFLICT (shop, metric, date) DO UPDATE SET value = excluded.value
+"""
+SQL_INCREMENT_POINT = """
+INSERT INTO metric_points (shop, metric, date, value) VALUES (?, ?, ?, ?)
+ON CONFLICT (shop, metric, date) DO UPDATE SET value = value + excluded.value
+"""
+SQL_SELECT_SERIES = "SELECT date, value FROM metric_points WHERE shop = ? AND metric = ? ORDER BY date"
+SQL_SELECT_SHOP_POINTS = "SELECT metric, date, value FROM metric_points WHERE shop = ? ORDER BY metric, date"
+SQL_UPSERT_SNAPSHOT = """
+INSERT INTO metric_snapshots (shop, metric, value, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT (shop, metric) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+"""
+SQL_SELECT_SNAPSHOT = "SELECT value FROM metric_snapshots WHERE shop = ? AND metric = ?"
+SQL_SELECT_SHOP_SNAPSHOTS = "SELECT metric, value FROM metric_snapshots WHERE shop = ?"
+SQL_DROP_LEGACY_ARTIFACTS = "DELETE FROM metric_snapshots WHERE " + " OR ".join(
+    f"metric LIKE '{prefix}%'" for prefix in LEGACY_ARTIFACT_PREFIXES
+)
+SQL_UPSERT_ARTIFACT = """
+INSERT INTO metric_artifacts (shop, name, value, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT (shop, name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+"""
+SQL_SELECT_ARTIFACT = "SELECT value FROM metric_artifacts WHERE shop = ? AND name = ?"
+SQL_DELETE_SHOP = (
+    "DELETE FROM metric_points WHERE shop = ?",
+    "DELETE FROM metric_snapshots WHERE shop = ?",
+    "DELETE FROM metric_artifacts WHERE shop = ?",
+    "DELETE FROM metric_shops WHERE shop = ?"
+)
+
+
+class SQLiteMetricsBackend(MetricsBackend):
+    """
+    SQLite-Backend im WAL-Modus.
+
+    Mehrere Gunicorn-Worker können parallel lesen und schreiben; Tageswerte
+    werden per UPSERT auf (shop, metric, date) geschrieben, sodass jede
+    Aktualisierung nur die betroffenen Zeilen berührt.
+    """
+
+    def __init__(self, db_path=METRICS_DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SQL_SCHEMA)
+        # Abgeleitete Ergebnisse älterer Versionen werden beim nächsten Lauf in metric_artifacts neu erzeugt
+        with conn:
+            conn.execute(SQL_DROP_LEGACY_ARTIFACTS)
+
+    def _connection(self):
+        """Gibt die Verbindung des aktuellen Threads zurück (sqlite3-Verbindungen sind threadgebunden)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def has_shop(self, shop):
+        return self._connection().execute(SQL_HAS_SHOP, (shop,)).fetchone() is not None
+
+    def ensure_shop(self, shop):
+        conn = self._connection()
+        with conn:
+            conn.execute(SQL_REGISTER_SHOP, (shop, datetime.datetime.now().isoformat()))
+
+    def load_series(self, shop, metric):
+        rows = self._connection().execute(SQL_SELECT_SERIES, (shop, metric)).fetchall()
+        if metric in INTEGER_METRICS:
+            return {date: int(round(value)) for date, value in rows}
+        return {date: value for date, value in rows}
+
+    def load_series_arrays(self, shop, metric):
+        rows = self._connection().execute(SQL_SELECT_SERIES, (shop, metric)).fetchall()
+        if not rows:
+            return np.empty(0, dtype='<i4'), _as_values(metric, [])
+        dates, values = zip(*rows)
+        return dates_to_days(dates), _as_values(metric, values)
+
+    def load_snapshot(self, shop, metric, default=None):
+        row = self._connection().execute(SQL_SELECT_SNAPSHOT, (shop, metric)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def load_snapshots(self, shop):
+        rows = self._connection().execute(SQL_SELECT_SHOP_SNAPSHOTS, (shop,)).fetchall()
+        return {metric: json.loads(value) for metric, value in rows}
+
+    def load_shop(self, shop):
+        conn = self._connection()
+        metrics = {}
+        for metric, date, value in conn.execute(SQL_SELECT_SHOP_POINTS, (shop,)):
+            metrics.setdefault(metric, {})[date] = int(round(value)) if metric in INTEGER_METRICS else value
+        for metric, value in conn.execute(SQL_SELECT_SHOP_SNAPSHOTS, (shop,)):
+            metrics[metric] = json.loads(value)
+        return metrics
+
+    def save_series(self, shop, metric, points):
+        if not points:
+            return
+        conn = self._connection()
+        with conn:
+            conn.execute(SQL_REGISTER_SHOP, (shop, datetime.datetime.now().isoformat()))
+            conn.executemany(SQL_UPSERT_POINT, [
+                (shop, metric, date, float(value)) for date, value in points.items()
+            ])
+
+    def increment_series(self, shop, metric, deltas):
+        if not deltas:
+            return
+        conn = self._connection()
+        with conn:
+            conn.execute(SQL_REGISTER_SHOP, (shop, datetime.datetime.now().isoformat()))
+            conn.executemany(SQL_INCREMENT_POINT, [
+                (shop, metric, date, float(delta)) for date, delta in deltas.items()
+            ])
+
+    def save_snapshot(self, shop, metric, value):
+        now = datetime.datetime.now().isoformat()
+        conn = self._connection()
+        with conn:
+            conn.execute(SQL_REGISTER_SHOP, (shop, now))
+            conn.execute(SQL_UPSERT_SNAPSHOT, (shop, metric, json.dumps(value), now))
+
+    def load_artifact(self, shop, name, default=None):
+        row = self._connection().execute(SQL_SELECT_ARTIFACT, (shop, name)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def save_artifact(self, shop, name, value):
+        now = datetime.datetime.now().isoformat()
+        conn = self._connection()
+        with conn:
+            conn.execute(SQL_REGISTER_SHOP, (shop, now))
+            conn.execute(SQL_UPSERT_ARTIFACT, (shop, name, json.dumps(value), now))
+
+    def delete_shop(self, shop):
+        conn = self._connection()
+        with conn:
+            for statement in SQL_DELETE_SHOP:
+                conn.execute(statement, (shop,))
+
+
+def create_metrics_backend(name=None):
+    """Erzeugt das konfigurierte Metrik-Backend ('columnar' oder 'sqlite')"""
+    name = (name or METRICS_BACKEND).lower()
+    if name == 'sqlite':
+        return SQLiteMetricsBackend()
+    if name == 'columnar':
+        return ColumnarMetricsBackend()
+    raise ValueError(f"Unbekanntes Metrik-Backend: {name}")
@@ -0,0 +1,577 @@
+import os
+import fcntl
+import sqlite3
+import logging
+import datetime
+import threading
+from datetime import timezone
+from contextlib import contextmanager
+
+import shopify_api
+import data_models
+import hourly_metrics
+import recommender
+
+# Logger einrichten
+logger = logging.getLogger('order_sync')
+
+# Konstanten
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+ORDER_SYNC_DB_FILE = os.path.join(DATA_DIR, 'order_sync.db')
+INITIAL_SYNC_DAYS = int(os.environ.get('ORDER_SYNC_INITIAL_DAYS', 90))
+SYNC_BATCH_SIZE = 250  # Bestellungen pro Schreibvorgang
+EPOCH = datetime.date(1970, 1, 1)
+
+SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    shop TEXT PRIMARY KEY,
+    high_water_mark TEXT,
+    start_day TEXT NOT NULL,
+    last_sync TEXT
+);
+CREATE TABLE IF NOT EXISTS order_contributions (
+    shop TEXT NOT NULL,
+    order_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    gross REAL NOT NULL,
+    refunded REAL NOT NULL,
+    counted INTEGER NOT NULL,
+    updated_at TEXT,
+    hour INTEGER,
+    PRIMARY KEY (shop, order_id)
+);
+CREATE TABLE IF NOT EXISTS dirty_days (
+    shop TEXT NOT NULL,
+    day TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (shop, day)
+);
+CREATE TABLE IF NOT EXISTS applied_refunds (
+    shop TEXT NOT NULL,
+    refund_id TEXT NOT NULL,
+    order_id TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (shop, refund_id)
+);
+"""
+SQL_SELECT_STATE = "SELECT high_water_mark, start_day FROM sync_state WHERE shop = ?"
+SQL_UPSERT_STATE = """
+INSERT INTO sync_state (shop, high_water_mark, start_day, last_sync) VALUES (?, ?, ?, ?)
+ON CONFLICT (shop) DO UPDATE SET high_water_mark = excluded.high_water_mark, last_sync = excluded.last_sync
+"""
+SQL_ADD_HOUR_COLUMN = "ALTER TABLE order_contributions ADD COLUMN hour INTEGER"
+SQL_SELECT_CONTRIBUTION = """
+SELECT day, gross, refunded, counted, hour FROM order_contributions WHERE shop = ? AND order_id = ?
+"""
+SQL_UPSERT_CONTRIBUTION = """
+INSERT INTO order_contributions (shop, order_id, day, gross, refunded, counted, hour, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (shop, order_id) DO UPDATE SET
+    gross = excluded.gross, refunded = excluded.refunded, counted = excluded.counted,
+    hour = excluded.hour, updated_at = excluded.updated_at
+"""
+SQL_INSERT_REFUND = """
+INSERT OR IGNORE INTO applied_refunds (shop, refund_id, order_id, amount) VALUES (?, ?, ?, ?)
+"""
+SQL_ADD_REFUND = """
+UPDATE order_contributions SET refunded = refunded + ? WHERE shop = ? AND order_id = ?
+"""
+SQL_MARK_DIRTY = """
+INSERT INTO dirty_days (shop, day) VALUES (?, ?)
+ON CONFLICT (shop, day) DO UPDATE SET version = version + 1
+"""
+SQL_SELECT_DIRTY = "SELECT day, version FROM dirty_days WHERE shop = ?"
+SQL_CLEAR_DIRTY = "DELETE FROM dirty_days WHERE shop = ? AND day = ? AND version = ?"
+SQL_DIRTY_TOTALS = """
+SELECT day, SUM(gross - refunded), SUM(counted) FROM order_contributions
+WHERE shop = ? AND day IN (SELECT day FROM dirty_days WHERE shop = ?) GROUP BY day
+"""
+SQL_DELETE_SHOP = (
+    "DELETE FROM order_contributions WHERE shop = ?",
+    "DELETE FROM applied_refunds WHERE shop = ?",
+    "DELETE FROM dirty_days WHERE shop = ?",
+    "DELETE FROM sync_state WHERE shop = ?"
+)
+SQL_HOURLY_TOTALS = """
+SELECT day, hour, SUM(gross - refunded), SUM(counted) FROM order_contributions
+WHERE shop = ? AND day >= ? AND day <= ? AND hour IS NOT NULL GROUP BY day, hour
+"""
+SQL_DAILY_TOTALS = """
+SELECT day, SUM(gross - refunded), SUM(counted) FROM order_contributions
+WHERE shop = ? AND day >= ? GROUP BY day
+"""
+
+
+def order_contribution(node):
+    """
+    Berechnet den Beitrag einer Bestellung zu den Tagesmetriken.
+
+    Returns:
+        tuple: (Tag, Bruttoumsatz, erstatteter Betrag, zählt als Bestellung 0/1)
+    """
+    day = (node.get('createdAt') or '')[:10]
+    gross = float(node.get('totalPrice') or 0)
+    refunded_set = node.get('totalRefundedSet') or {}
+    refunded = float((refunded_set.get('shopMoney') or {}).get('amount') or 0)
+
+    # Stornierte Bestellungen tragen weder Umsatz noch Bestellanzahl bei
+    if node.get('cancelledAt'):
+        return day, 0.0, 0.0, 0
+    return day, gross, refunded, 1
+
+
+def order_hour(node):
+    """Stundenindex (Stunden seit 1970-01-01T00 UTC) der Bestellung oder None"""
+    created_at = node.get('createdAt') or ''
+    try:
+        day = datetime.date.fromisoformat(created_at[:10])
+        hour = int(created_at[11:13])
+    except ValueError:
+        return None
+    return (day - EPOCH).days * 24 + hour
+
+
+def _to_utc(timestamp):
+    """Wandelt einen REST-Zeitstempel mit Offset in das UTC-Format der GraphQL-API um"""
+    if not timestamp:
+        return timestamp
+    try:
+        parsed = datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except ValueError:
+        return timestamp
+    if parsed.tzinfo is None:
+        return timestamp
+    return parsed.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def webhook_order_node(payload):
+    """
+    Bringt eine Bestellung aus einem REST-Webhook in das Format der GraphQL-Knoten.
+
+    Tage werden dadurch wie bei der Synchronisation in UTC gebildet.
+    """
+    refunds = [
+        {'id': f"gid://shopify/Refund/{refund['id']}" if refund.get('id') else None,
+         'totalRefundedSet': {'shopMoney': {'amount': refund_amount(refund)}}}
+        for refund in payload.get('refunds') or []
+    ]
+    refunded = sum(refund['totalRefundedSet']['shopMoney']['amount'] for refund in refunds)
+    customer = payload.get('customer') or {}
+
+    return {
+        'id': payload.get('admin_graphql_api_id') or f"gid://shopify/Order/{payload.get('id')}",
+        'createdAt': _to_utc(payload.get('created_at')),
+        'updatedAt': _to_utc(payload.get('updated_at')),
+        'cancelledAt': payload.get('cancelled_at'),
+        'totalPrice': payload.get('total_price'),
+        'totalRefundedSet': {'shopMoney': {'amount': refunded}},
+        'refunds': refunds,
+        'customer': {'id': f"gid://shopify/Customer/{customer['id']}"} if customer.get('id') else None,
+        'lineItems': {'edges': [
+            {'node': {'product': {'id': f"gid://shopify/Product/{item['product_id']}"}}}
+            for item in payload.get('line_items') or [] if item.get('product_id')
+        ]}
+    }
+
+
+def order_refunds(node):
+    """
+    Liefert die in totalRefundedSet enthaltenen Erstattungen einer Bestellung.
+
+    Die IDs haben das Format der refunds/create-Webhooks (numerisch), damit eine
+    danach zugestellte Erstattung als bereits verbucht erkannt wird.
+
+    Returns:
+        list: [(Erstattungs-ID, Betrag)]
+    """
+    refunds = []
+    for refund in node.get('refunds') or []:
+        refund_id = str(refund.get('id') or '').rsplit('/', 1)[-1]
+        if refund_id:
+            amount = float(((refund.get('totalRefundedSet') or {}).get('shopMoney') or {}).get('amount') or 0)
+            refunds.append((refund_id, amount))
+    return refunds
+
+
+def refund_amount(refund):
+    """Summiert die erfolgreichen Erstattungstransaktionen einer Erstattung"""
+    return sum(
+        float(transaction.get('amount') or 0)
+        for transaction in refund.get('transactions') or []
+        if transaction.get('kind') == 'refund' and transaction.get('status') == 'success'
+    )
+
+
+class OrderSyncStore:
+    """
+    Speichert Hochwassermarke und Beitrag jeder Bestellung pro Shop (SQLite, WAL).
+
+    Geänderte Beiträge merken ihren Tag in dirty_days vor; publish_days schreibt
+    die Tagessummen dieser Tage in die Metriken und entfernt erst danach die Marker.
+    """
+
+    def __init__(self, db_path=ORDER_SYNC_DB_FILE):
+        self.db_path = db_path
+        self.lock_dir = os.path.join(os.path.dirname(self.db_path) or '.', 'order_sync_locks')
+        self._local = threading.local()
+        os.makedirs(self.lock_dir, exist_ok=True)
+        conn = self.connection()
+        conn.executescript(SQL_SCHEMA)
+        # Bestehende Datenbanken um die Stunde der Bestellung erweitern
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(order_contributions)")]
+        if 'hour' not in columns:
+            conn.execute(SQL_ADD_HOUR_COLUMN)
+
+    def connection(self):
+        """Gibt die Verbindung des aktuellen Threads zurück"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self, mode="IMMEDIATE"):
+        """Transaktion auf der Verbindung des Threads (IMMEDIATE serialisiert Schreiber prozessübergreifend)"""
+        conn = self.connection()
+        conn.execute(f"BEGIN {mode}")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @contextmanager
+    def shop_lock(self, shop):
+        """Prozessübergreifende Sperre pro Shop für das Schreiben der Tageswerte"""
+        handle = open(os.path.join(self.lock_dir, f"{shop}.lock"), 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+        finally:
+            handle.close()
+
+    def get_state(self, shop):
+        """Gibt (Hochwassermarke, erster synchronisierter Tag) oder (None, None) zurück"""
+        row = self.connection().execute(SQL_SELECT_STATE, (shop,)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def save_state(self, shop, high_water_mark, start_day):
+        with self.transaction() as conn:
+            conn.execute(SQL_UPSERT_STATE, (shop, high_water_mark, start_day, datetime.datetime.now().isoformat()))
+
+    def claim(self, shop, nodes, start_day=None):
+        """
+        Übernimmt Bestellungen in die gespeicherten Beiträge.
+
+        Alten Beitrag lesen, neuen speichern und den Tag vormerken geschieht in
+        einer Transaktion. Parallele Synchronisationen und Webhooks (auch aus
+        anderen Gunicorn-Workern) sehen so immer den Stand des anderen.
+
+        Returns:
+            tuple: (Tage mit geändertem Beitrag, höchstes updatedAt)
+        """
+        changed_days = set()
+        seen = {}
+        max_updated = None
+
+        with self.transaction() as conn:
+            for node in nodes:
+                order_id = node.get('id')
+                day, gross, refunded, counted = order_contribution(node)
+                updated_at = node.get('updatedAt')
+                if updated_at and (max_updated is None or updated_at > max_updated):
+                    max_updated = updated_at
+
+                # Bestellungen vor dem Synchronisationsbeginn sind in den Tageswerten nicht enthalten
+                if not order_id or not day or (start_day and day < start_day):
+                    continue
+
+                # Mehrfach gelieferte Bestellungen gegen den Stand innerhalb des Batches vergleichen
+                previous = seen.get(order_id) or conn.execute(SQL_SELECT_CONTRIBUTION, (shop, order_id)).fetchone()
+                contribution = (day, gross, refunded, counted, order_hour(node))
+                if previous is None or tuple(previous) != contribution:
+                    changed_days.add(day)
+                    conn.execute(SQL_UPSERT_CONTRIBUTION, (shop, order_id) + contribution + (updated_at,))
+                seen[order_id] = contribution
+                # Der Beitrag enthält diese Erstattungen bereits: spätere refunds/create-Webhooks nicht erneut abziehen
+                conn.executemany(SQL_INSERT_REFUND, [(shop, refund_id, order_id, amount)
+                                                     for refund_id, amount in order_refunds(node)])
+
+            conn.executemany(SQL_MARK_DIRTY, [(shop, day) for day in changed_days])
+
+        return changed_days, max_updated
+
+    def dirty_totals(self, shop, since=None):
+        """
+        Liest die vorgemerkten Tage und ihre Summen aus demselben Datenstand.
+
+        Returns:
+            tuple: ({Tag: Markerversion}, {Tag: (Nettoumsatz, Bestellungen)}); mit since
+                   enthalten die Summen zusätzlich alle Tage ab since
+        """
+        with self.transaction("DEFERRED") as conn:
+            versions = dict(conn.execute(SQL_SELECT_DIRTY, (shop,)).fetchall())
+            totals = {day: (revenue, orders)
+                      for day, revenue, orders in conn.execute(SQL_DIRTY_TOTALS, (shop, shop))}
+            if since:
+                totals.update((day, (revenue, orders))
+                              for day, revenue, orders in conn.execute(SQL_DAILY_TOTALS, (shop, since)))
+        return versions, totals
+
+    def hourly_totals(self, shop, days):
+        """
+        Summiert die gespeicherten Beiträge der angegebenen Tage pro Stunde.
+
+        Returns:
+            dict: {Stundenindex: (Nettoumsatz, Bestellungen)}
+        """
+        if not days:
+            return {}
+        rows = self.connection().execute(SQL_HOURLY_TOTALS, (shop, min(days), max(days))).fetchall()
+        return {hour: (revenue, orders) for day, hour, revenue, orders in rows if day in days}
+
+    def clear_dirty(self, shop, versions):
+        """Entfernt Marker, sofern der Tag seitdem nicht erneut vorgemerkt wurde"""
+        with self.transaction() as conn:
+            conn.executemany(SQL_CLEAR_DIRTY, [(shop, day, version) for day, version in versions.items()])
+
+    def delete_shop(self, shop):
+        """Löscht Beiträge, Erstattungen, vorgemerkte Tage und Synchronisationsstand eines Shops"""
+        with self.shop_lock(shop):
+            with self.transaction() as conn:
+                for statement in SQL_DELETE_SHOP:
+                    conn.execute(statement, (shop,))
+        try:
+            os.remove(os.path.join(self.lock_dir, f"{shop}.lock"))
+        except FileNotFoundError:
+            pass
+
+    def daily_totals(self, shop, start_day):
+        """
+        Summiert die gespeicherten Beiträge pro Tag.
+
+        Returns:
+            dict: {Tag: (Nettoumsatz, Bestellungen)}
+        """
+        rows = self.connection().execute(SQL_DAILY_TOTALS, (shop, start_day)).fetchall()
+        return {day: (revenue, orders) for day, revenue, orders in rows}
+
+    def apply_refund(self, shop, order_id, refund_id, amount):
+        """
+        Verbucht eine Erstattung genau einmal auf den Beitrag ihrer Bestellung.
+
+        Returns:
+            str: Tag der Bestellung oder None, wenn die Erstattung bereits verbucht
+                 oder die Bestellung unbekannt ist
+        """
+        with self.transaction() as conn:
+            previous = conn.execute(SQL_SELECT_CONTRIBUTION, (shop, order_id)).fetchone()
+            if not previous or not previous[3]:
+                # Unbekannte oder stornierte Bestellung: die nächste Synchronisation übernimmt den Stand
+                return None
+            if conn.execute(SQL_INSERT_REFUND, (shop, refund_id, order_id, amount)).rowcount == 0:
+                return None
+            conn.execute(SQL_ADD_REFUND, (amount, shop, order_id))
+            conn.execute(SQL_MARK_DIRTY, (shop, previous[0]))
+            return previous[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_order_sync_store():
+    """Gibt den prozessweiten Sync-Speicher zurück"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = OrderSyncStore()
+    return _store
+
+
+def update_average_order_value(shop_metrics, days=30):
+    """Berechnet den durchschnittlichen Bestellwert aus den Tageswerten neu"""
+    revenue = shop_metrics.get_time_series_data('daily_revenue', days)
+    orders = shop_metrics.get_time_series_data('daily_orders', days)
+    total_orders = sum(item['value'] for item in orders)
+    if total_orders > 0:
+        shop_metrics.set_value('average_order_value', sum(item['value'] for item in revenue) / total_orders)
+
+
+def publish_days(shop, write, store=None, since=None, hourly_store=None):
+    """
+    Schreibt die Tagessummen aller vorgemerkten Tage aus den gespeicherten Beiträgen.
+
+    Die Tageswerte werden gesetzt statt addiert: ein wiederholter Lauf nach einem
+    Absturz oder Schreibfehler schreibt nur dieselben Summen erneut. Die Marker
+    werden erst nach erfolgreichem Schreiben entfernt, die Sperre pro Shop
+    verhindert, dass ein älterer Stand einen neueren überschreibt. Dieselben Tage
+    werden stundengenau in den hourly_metrics-Store gebucht (Reihen 'revenue'
+    und 'orders'), aus dessen Rollups lange Zeiträume gelesen werden.
+
+    Args:
+        write (callable): write(revenue, orders) mit {Tag: Wert}; Fehler werden weitergegeben
+        since (str): Zusätzlich alle Tage ab diesem Tag bis heute setzen, auch ohne Bestellungen
+
+    Returns:
+        int: Anzahl geschriebener Tage
+    """
+    store = store or get_order_sync_store()
+    with store.shop_lock(shop):
+        versions, totals = store.dirty_totals(shop, since)
+        days = set(versions)
+        if since:
+            day = datetime.date.fromisoformat(since)
+            while day <= datetime.date.today():
+                days.add(day.isoformat())
+                day += datetime.timedelta(days=1)
+        if not days:
+            return 0
+
+        revenue = {day: totals.get(day, (0.0, 0))[0] for day in sorted(days)}
+        orders = {day: int(totals.get(day, (0.0, 0))[1]) for day in sorted(days)}
+        write(revenue, orders)
+        _publish_hours(shop, store, days, hourly_store or hourly_metrics.get_hourly_store())
+        store.clear_dirty(shop, versions)
+    return len(days)
+
+
+def _publish_hours(shop, store, days, hourly_store):
+    """Setzt alle Stunden der Tage auf die Summen der Beiträge (Stunden ohne Bestellung auf 0)"""
+    totals = store.hourly_totals(shop, days)
+    revenue, orders = {}, {}
+    for day in days:
+        first_hour = (datetime.date.fromisoformat(day) - EPOCH).days * 24
+        for hour in range(first_hour, first_hour + 24):
+            revenue[hour], orders[hour] = totals.get(hour, (0.0, 0))
+    hourly_store.set_hours(shop, 'revenue', revenue)
+    hourly_store.set_hours(shop, 'orders', orders)
+
+
+def backend_writer(shop, backend):
+    """Schreibt Tageswerte direkt in das Metrik-Backend (Webhooks)"""
+    def write(revenue, orders):
+        backend.ensure_shop(shop)
+        backend.save_series(shop, 'daily_revenue', revenue)
+        backend.save_series(shop, 'daily_orders', orders)
+    return write
+
+
+def metrics_writer(shop_metrics):
+    """Schreibt Tageswerte über eine ShopMetrics-Instanz, deren Stand damit aktuell bleibt"""
+    def write(revenue, orders):
+        for day, value in revenue.items():
+            shop_metrics.set_point('daily_revenue', day, value)
+        for day, value in orders.items():
+            shop_metrics.set_point('daily_orders', day, value)
+        shop_metrics.save_metrics(immediate=True, raise_errors=True)
+    return write
+
+
+def apply_order_nodes(shop, nodes, backend=None, store=None):
+    """
+    Übernimmt einzelne Bestellungen (z.B. aus Webhooks) und schreibt die betroffenen Tage.
+
+    Der Aufwand ist unabhängig von der Länge der gespeicherten Historie.
+
+    Returns:
+        str: Höchstes updatedAt der übernommenen Bestellungen
+    """
+    store = store or get_order_sync_store()
+    backend = backend or data_models.get_metrics_backend()
+    _, start_day = store.get_state(shop)
+    _, max_updated = store.claim(shop, nodes, start_day)
+    publish_days(shop, backend_writer(shop, backend), store)
+    return max_updated
+
+
+def apply_refund(shop, order_id, refund_id, amount, backend=None, store=None):
+    """
+    Zieht eine Erstattung vom Umsatz des Bestelltags ab (idempotent über die Erstattungs-ID).
+
+    Returns:
+        bool: True, wenn die Erstattung verbucht wurde
+    """
+    store = store or get_order_sync_store()
+    backend = backend or data_models.get_metrics_backend()
+    if not amount:
+        return False
+
+    booked = store.apply_refund(shop, order_id, refund_id, amount) is not None
+    # Auch bei einer bereits verbuchten Erstattung noch offene Tage schreiben (Wiederholung nach Fehler)
+    publish_days(shop, backend_writer(shop, backend), store)
+    return booked
+
+
+def sync_orders(shop, access_token, shop_metrics, store=None):
+    """
+    Synchronisiert Bestellungen inkrementell ab der gespeicherten Hochwassermarke.
+
+    Beim ersten Lauf werden die Tageswerte der letzten INITIAL_SYNC_DAYS Tage
+    vollständig aus den Bestellbeiträgen aufgebaut. Danach werden nur seit der
+    Hochwassermarke geänderte Bestellungen abgerufen und die betroffenen Tage neu
+    geschrieben, sodass auch nachträgliche Erstattungen und Stornierungen ältere
+    Tage korrigieren. Schlägt das Schreiben der Metriken fehl, wird der Fehler
+    weitergegeben und die Hochwassermarke bleibt stehen.
+
+    Returns:
+        dict: Zusammenfassung mit Anzahl verarbeiteter Bestellungen und neuer Hochwassermarke
+    """
+    store = store or get_order_sync_store()
+    high_water_mark, start_day = store.get_state(shop)
+    initial = high_water_mark is None
+    run_started = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    if initial:
+        start_day = (datetime.date.today() - datetime.timedelta(days=INITIAL_SYNC_DAYS - 1)).isoformat()
+        query = f"created_at:>={start_day}"
+    else:
+        # >= statt >, damit keine Änderungen derselben Sekunde verloren gehen (Deltas sind dann 0)
+        query = f"updated_at:>='{high_water_mark}'"
+
+    processed = 0
+    new_mark = high_water_mark
+    write = metrics_writer(shop_metrics)
+
+    def flush(batch):
+        nonlocal new_mark
+        _, max_updated = store.claim(shop, batch, start_day)
+        if not initial:
+            publish_days(shop, write, store)
+        try:
+            recommender.apply_orders(shop, batch)
+        except Exception as e:
+            logger.error(f"Fehler beim Aktualisieren des Co-Purchase-Index für {shop}: {e}")
+        if max_updated and (new_mark is None or max_updated > new_mark):
+            new_mark = max_updated
+
+    batch = []
+    for edge in shopify_api.iter_orders(shop, access_token, query=query):
+        batch.append(edge.get('node', {}))
+        if len(batch) >= SYNC_BATCH_SIZE:
+            flush(batch)
+            processed += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        processed += len(batch)
+
+    # Beim ersten Lauf alle Tage des Fensters setzen, auch Tage ohne Bestellungen;
+    # sonst noch offene Tage früherer, fehlgeschlagener Läufe nachholen
+    publish_days(shop, write, store, since=start_day if initial else None)
+    if initial:
+        new_mark = new_mark or run_started
+
+    update_average_order_value(shop_metrics)
+    shop_metrics.save_metrics(immediate=True, raise_errors=True)
+    # Hochwassermarke erst nach einem vollständigen Lauf fortschreiben
+    store.save_state(shop, new_mark, start_day)
+
+    logger.info(f"Bestellungen für {shop} synchronisiert: {processed} Bestellungen, Hochwassermarke {new_mark}")
+    return {"processed": processed, "high_water_mark": new_mark, "initial": initial}
@@ -0,0 +1,444 @@
+import os
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+import datetime
+import threading
+from itertools import combinations
+from collections import Counter
+
+import shopify_api
+import data_models
+
+# Logger einrichten
+logger = logging.getLogger('recommender')
+
+# Konstanten
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+RECOMMENDER_DB_FILE = os.path.join(DATA_DIR, 'recommender.db')
+RECOMMENDER_TOP_K = int(os.environ.get('RECOMMENDER_TOP_K', 20))  # Nachbarn pro Produkt
+# Sehr große Bestellungen erzeugen quadratisch viele Paare und sagen wenig über Zusammenhänge aus
+RECOMMENDER_MAX_ITEMS = int(os.environ.get('RECOMMENDER_MAX_ITEMS', 50))
+RECOMMENDER_BATCH_SIZE = 500  # Bestellungen pro Transaktion beim Neuaufbau
+
+# Bulk-Abfrage für den Neuaufbau; Line Items kommen als eigene Zeilen mit __parentId
+BULK_ORDER_PRODUCTS_QUERY = """
+{
+  orders {
+    edges {
+      node {
+        id
+        cancelledAt
+        customer {
+          id
+        }
+        lineItems {
+          edges {
+            node {
+              product {
+                id
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS copurchase_orders (
+    shop TEXT NOT NULL,
+    order_id INTEGER NOT NULL,
+    customer_id INTEGER,
+    products TEXT NOT NULL,
+    PRIMARY KEY (shop, order_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_copurchase_orders_customer ON copurchase_orders (shop, customer_id);
+CREATE TABLE IF NOT EXISTS copurchase_items (
+    shop TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    orders INTEGER NOT NULL,
+    PRIMARY KEY (shop, product_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS copurchase_pairs (
+    shop TEXT NOT NULL,
+    product_a INTEGER NOT NULL,
+    product_b INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (shop, product_a, product_b)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS copurchase_neighbors (
+    shop TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    neighbors TEXT NOT NULL,
+    updated_at TEXT,
+    PRIMARY KEY (shop, product_id)
+) WITHOUT ROWID;
+"""
+SQL_SELECT_ORDER = "SELECT products FROM copurchase_orders WHERE shop = ? AND order_id = ?"
+SQL_UPSERT_ORDER = """
+INSERT INTO copurchase_orders (shop, order_id, customer_id, products) VALUES (?, ?, ?, ?)
+ON CONFLICT (shop, order_id) DO UPDATE SET customer_id = excluded.customer_id, products = excluded.products
+"""
+SQL_ADD_ITEM = """
+INSERT INTO copurchase_items (shop, product_id, orders) VALUES (?, ?, ?)
+ON CONFLICT (shop, product_id) DO UPDATE SET orders = orders + excluded.orders
+"""
+SQL_ADD_PAIR = """
+INSERT INTO copurchase_pairs (shop, product_a, product_b, count) VALUES (?, ?, ?, ?)
+ON CONFLICT (shop, product_a, product_b) DO UPDATE SET count = count + excluded.count
+"""
+SQL_PRUNE_ITEMS = "DELETE FROM copurchase_items WHERE shop = ? AND orders <= 0"
+SQL_PRUNE_PAIRS = "DELETE FROM copurchase_pairs WHERE shop = ? AND product_a = ? AND count <= 0"
+SQL_SELECT_PAIRS = """
+SELECT p.product_b, p.count, i.orders FROM copurchase_pairs p
+JOIN copurchase_items i ON i.shop = p.shop AND i.product_id = p.product_b
+WHERE p.shop = ? AND p.product_a = ? AND p.count > 0
+"""
+SQL_SELECT_ITEM = "SELECT orders FROM copurchase_items WHERE shop = ? AND product_id = ?"
+SQL_UPSERT_NEIGHBORS = """
+INSERT INTO copurchase_neighbors (shop, product_id, neighbors, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT (shop, product_id) DO UPDATE SET neighbors = excluded.neighbors, updated_at = excluded.updated_at
+"""
+SQL_SELECT_NEIGHBORS = "SELECT neighbors FROM copurchase_neighbors WHERE shop = ? AND product_id = ?"
+SQL_SELECT_CUSTOMER_PRODUCTS = """
+SELECT products FROM copurchase_orders INDEXED BY idx_copurchase_orders_customer WHERE shop = ? AND customer_id = ?
+"""
+SQL_SELECT_POPULAR = "SELECT product_id, orders FROM copurchase_items WHERE shop = ? ORDER BY orders DESC LIMIT ?"
+SQL_DELETE_SHOP = [
+    "DELETE FROM copurchase_orders WHERE shop = ?",
+    "DELETE FROM copurchase_items WHERE shop = ?",
+    "DELETE FROM copurchase_pairs WHERE shop = ?",
+    "DELETE FROM copurchase_neighbors WHERE shop = ?",
+]
+
+
+def gid_number(gid):
+    """Numerischer Teil einer Shopify-GID (gid://shopify/Product/123 -> 123)"""
+    try:
+        return int(str(gid).rsplit('/', 1)[-1])
+    except (TypeError, ValueError):
+        return None
+
+
+def product_gid(number):
+    return f"gid://shopify/Product/{number}"
+
+
+def order_products(node):
+    """
+    Gibt die unterschiedlichen Produkt-IDs einer Bestellung sortiert zurück.
+
+    Stornierte Bestellungen zählen nicht als gemeinsamer Kauf.
+    """
+    if node.get('cancelledAt'):
+        return ()
+
+    products = set()
+    for edge in (node.get('lineItems') or {}).get('edges', []):
+        item = edge.get('node', {})
+        product = item.get('product') or (item.get('variant') or {}).get('product') or {}
+        product_id = gid_number(product.get('id'))
+        if product_id is not None:
+            products.add(product_id)
+    return tuple(sorted(products)[:RECOMMENDER_MAX_ITEMS])
+
+
+def _encode_products(products):
+    return ','.join(map(str, products))
+
+
+def _decode_products(value):
+    return tuple(int(product_id) for product_id in value.split(',')) if value else ()
+
+
+class CoPurchaseIndex:
+    """
+    Dünn besetzte Produkt×Produkt-Matrix gemeinsamer Käufe pro Shop (SQLite, WAL).
+
+    Gespeichert werden nur Paare mit mindestens einem gemeinsamen Kauf (in beiden
+    Richtungen), dazu die Bestellanzahl je Produkt und die Produktmenge jeder
+    Bestellung. Damit lassen sich geänderte oder doppelt gelieferte Bestellungen
+    als Differenz verbuchen. Nach jedem Schreibvorgang werden die Nachbarlisten
+    der betroffenen Produkte neu berechnet, Abfragen lesen nur diese Listen.
+    """
+
+    def __init__(self, db_path=RECOMMENDER_DB_FILE, top_k=RECOMMENDER_TOP_K):
+        self.db_path = db_path
+        self.top_k = top_k
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self.connection().executescript(SQL_SCHEMA)
+
+    def connection(self):
+        """Gibt die Verbindung des aktuellen Threads zurück"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def apply_orders(self, shop, nodes, refresh=True):
+        """
+        Verbucht Bestellungen (GraphQL-Knoten) inkrementell in der Matrix.
+
+        Args:
+            refresh (bool): Nachbarlisten der betroffenen Produkte sofort neu berechnen;
+                            beim Neuaufbau geschieht das einmal am Ende über refresh_neighbors
+
+        Returns:
+            set: IDs der Produkte, deren Zeilen sich geändert haben
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            item_deltas = Counter()
+            pair_deltas = Counter()
+            order_rows = {}
+
+            for node in nodes:
+                order_id = gid_number(node.get('id'))
+                if order_id is None:
+                    continue
+                products = order_products(node)
+                customer_id = gid_number((node.get('customer') or {}).get('id'))
+
+                # Mehrfach gelieferte Bestellungen gegen den Stand innerhalb des Batches vergleichen
+                if order_id in order_rows:
+                    previous = _decode_products(order_rows[order_id][3])
+                else:
+                    row = conn.execute(SQL_SELECT_ORDER, (shop, order_id)).fetchone()
+                    previous = _decode_products(row[0]) if row else None
+                if previous == products:
+                    continue
+
+                for sign, product_set in ((-1, previous or ()), (1, products)):
+                    for product_id in product_set:
+                        item_deltas[product_id] += sign
+                    for a, b in combinations(product_set, 2):
+                        pair_deltas[(a, b)] += sign
+                        pair_deltas[(b, a)] += sign
+                order_rows[order_id] = (shop, order_id, customer_id, _encode_products(products))
+
+            item_deltas = {product_id: delta for product_id, delta in item_deltas.items() if delta}
+            pair_deltas = {pair: delta for pair, delta in pair_deltas.items() if delta}
+
+            conn.executemany(SQL_UPSERT_ORDER, order_rows.values())
+            conn.executemany(SQL_ADD_ITEM, [(shop, product_id, delta) for product_id, delta in item_deltas.items()])
+            conn.executemany(SQL_ADD_PAIR, [(shop, a, b, delta) for (a, b), delta in pair_deltas.items()])
+
+            dirty = set(item_deltas) | {a for a, _ in pair_deltas}
+            if any(delta < 0 for delta in item_deltas.values()):
+                conn.execute(SQL_PRUNE_ITEMS, (shop,))
+            for product_id in {a for (a, _), delta in pair_deltas.items() if delta < 0}:
+                conn.execute(SQL_PRUNE_PAIRS, (shop, product_id))
+
+            if refresh:
+                self._refresh_neighbors(conn, shop, dirty)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return dirty
+
+    def refresh_neighbors(self, shop, product_ids, batch_size=RECOMMENDER_BATCH_SIZE):
+        """Berechnet die Nachbarlisten der Produkte in Transaktionen zu je batch_size Produkten neu"""
+        product_ids = list(product_ids)
+        conn = self.connection()
+        for start in range(0, len(product_ids), batch_size):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._refresh_neighbors(conn, shop, product_ids[start:start + batch_size])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _refresh_neighbors(self, conn, shop, product_ids):
+        """
+        Berechnet die Top-k-Nachbarn der Produkte neu.
+
+        Bewertet wird mit der Kosinus-Ähnlichkeit count(a, b) / sqrt(n_a * n_b), damit
+        Bestseller nicht bei jedem Produkt oben stehen. Ändert sich nur n_b, wird die
+        Liste von a erst beim nächsten Kauf von a aktualisiert.
+        """
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        rows = []
+        for product_id in product_ids:
+            item = conn.execute(SQL_SELECT_ITEM, (shop, product_id)).fetchone()
+            orders = item[0] if item else 0
+            neighbors = []
+            if orders > 0:
+                for other_id, count, other_orders in conn.execute(SQL_SELECT_PAIRS, (shop, product_id)):
+                    if other_orders > 0:
+                        neighbors.append((count / (orders * other_orders) ** 0.5, count, other_id))
+                neighbors.sort(reverse=True)
+            top = [[other_id, round(score, 4), count] for score, count, other_id in neighbors[:self.top_k]]
+            rows.append((shop, product_id, json.dumps(top, separators=(',', ':')), now))
+        conn.executemany(SQL_UPSERT_NEIGHBORS, rows)
+
+    def neighbors(self, shop, product_id):
+        """Gibt die gespeicherte Nachbarliste [[Produkt-ID, Score, gemeinsame Käufe], ...] zurück"""
+        row = self.connection().execute(SQL_SELECT_NEIGHBORS, (shop, product_id)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def customer_products(self, shop, customer_id):
+        """Alle Produkte aus den Bestellungen eines Kunden"""
+        products = set()
+        for (value,) in self.connection().execute(SQL_SELECT_CUSTOMER_PRODUCTS, (shop, customer_id)):
+            products.update(_decode_products(value))
+        return products
+
+    def popular(self, shop, limit):
+        return self.connection().execute(SQL_SELECT_POPULAR, (shop, limit)).fetchall()
+
+    def delete_shop(self, shop):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in SQL_DELETE_SHOP:
+                conn.execute(statement, (shop,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_copurchase_index():
+    """Gibt den prozessweiten Co-Purchase-Index zurück"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = CoPurchaseIndex()
+    return _index
+
+
+def similar_products(shop, product_id, k=10, index=None):
+    """
+    Produkte, die am häufigsten zusammen mit einem Produkt gekauft werden.
+
+    Returns:
+        list: [{"product_id": GID, "score": ..., "count": ...}]
+    """
+    index = index or get_copurchase_index()
+    return [
+        {"product_id": product_gid(other_id), "score": score, "count": count}
+        for other_id, score, count in index.neighbors(shop, gid_number(product_id))[:k]
+    ]
+
+
+def recommend_for_customer(shop, customer_id, k=10, index=None):
+    """
+    Empfehlungen für einen Kunden aus den Nachbarlisten seiner gekauften Produkte.
+
+    Die Scores der Nachbarn werden über alle gekauften Produkte addiert, bereits
+    gekaufte Produkte werden ausgelassen.
+
+    Returns:
+        list: [{"product_id": GID, "score": ...}]
+    """
+    index = index or get_copurchase_index()
+    owned = index.customer_products(shop, gid_number(customer_id))
+    scores = Counter()
+    for product_id in owned:
+        for other_id, score, _ in index.neighbors(shop, product_id):
+            if other_id not in owned:
+                scores[other_id] += score
+    return [{"product_id": product_gid(product_id), "score": round(score, 4)}
+            for product_id, score in scores.most_common(k)]
+
+
+def popular_products(shop, k=10, exclude=(), index=None):
+    """Meistgekaufte Produkte als Rückfall für Kunden ohne Kaufhistorie"""
+    index = index or get_copurchase_index()
+    excluded = {gid_number(product_id) for product_id in exclude}
+    return [{"product_id": product_gid(product_id), "orders": orders}
+            for product_id, orders in index.popular(shop, k + len(excluded))
+            if product_id not in excluded][:k]
+
+
+def apply_orders(shop, nodes, index=None):
+    """Verbucht Bestellungen im Index des Shops (z.B. aus der Synchronisation oder Webhooks)"""
+    index = index or get_copurchase_index()
+    return index.apply_orders(shop, nodes)
+
+
+def iter_bulk_orders(records):
+    """Setzt Bestellungen aus den Zeilen einer Bulk-Operation wieder mit ihren Line Items zusammen"""
+    current = None
+    for record in records:
+        if '__parentId' in record:
+            if current is not None and record['__parentId'] == current.get('id'):
+                current['lineItems']['edges'].append({"node": record})
+            continue
+        if current is not None:
+            yield current
+        current = dict(record, lineItems={"edges": []})
+    if current is not None:
+        yield current
+
+
+def rebuild(shop, access_token, index=None):
+    """
+    Baut den Index eines Shops aus der vollständigen Bestellhistorie auf (Bulk-Operation).
+
+    Bereits verbuchte Bestellungen werden dabei nicht doppelt gezählt.
+
+    Returns:
+        int: Anzahl gelesener Bestellungen
+    """
+    index = index or get_copurchase_index()
+    records = shopify_api.run_bulk_export(shop, access_token, BULK_ORDER_PRODUCTS_QUERY)
+
+    processed = 0
+    dirty = set()
+    batch = []
+    for order in iter_bulk_orders(records):
+        batch.append(order)
+        if len(batch) >= RECOMMENDER_BATCH_SIZE:
+            dirty |= index.apply_orders(shop, batch, refresh=False)
+            processed += len(batch)
+            batch = []
+    if batch:
+        dirty |= index.apply_orders(shop, batch, refresh=False)
+        processed += len(batch)
+
+    # Nachbarlisten erst am Ende einmal pro Produkt berechnen
+    index.refresh_neighbors(shop, dirty)
+
+    logger.info(f"Co-Purchase-Index für {shop} aus {processed} Bestellungen aufgebaut")
+    return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Co-Purchase-Index aus der Bestellhistorie aufbauen')
+    parser.add_argument('--shop', action='append', help='Nur diesen Shop aufbauen (mehrfach möglich)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    failed = 0
+    for shop, entry in data_models.get_installed_shops().items():
+        if args.shop and shop not in args.shop:
+            continue
+        try:
+            rebuild(shop, entry.get('access_token'))
+        except Exception as e:
+            logger.error(f"Fehler beim Aufbau des Co-Purchase-Index für {shop}: {e}")
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,597 @@
+import os
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+import datetime
+import threading
+import numpy as np
+from urllib.parse import quote
+
+import shopify_api
+import data_models
+from order_sync import order_contribution
+
+# Logger einrichten
+logger = logging.getLogger('rfm')
+
+# Konstanten
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+RFM_DIR = os.path.join(DATA_DIR, 'rfm')
+RFM_DB_FILE = os.path.join(DATA_DIR, 'rfm.db')
+RFM_CHUNK_SIZE = int(os.environ.get('RFM_CHUNK_SIZE', 100000))  # Bestellungen pro Aggregationsschritt
+RFM_REBUILD_DAYS = int(os.environ.get('RFM_REBUILD_DAYS', 7))  # Vollständiger Neuaufbau (Erstattungen, Stornos)
+RFM_UPDATE_INTERVAL = int(os.environ.get('RFM_UPDATE_INTERVAL', 86400))  # Sekunden zwischen zwei Läufen
+RFM_SCORE_BINS = 5
+RFM_SEGMENT_SAMPLE = 50  # Kunden pro Segment in get_segments
+
+# Reihenfolge entspricht den gespeicherten Segmentcodes
+SEGMENTS = ("high_value", "loyal", "potential", "at_risk", "inactive")
+HIGH_VALUE, LOYAL, POTENTIAL, AT_RISK, INACTIVE = range(len(SEGMENTS))
+
+# Bulk-Abfragen ohne Line Items, damit jede Zeile genau eine Bestellung bzw. einen Kunden enthält
+BULK_CUSTOMER_ORDERS_QUERY = """
+{
+  orders%s {
+    edges {
+      node {
+        id
+        createdAt
+        totalPrice
+        cancelledAt
+        totalRefundedSet {
+          shopMoney {
+            amount
+          }
+        }
+        customer {
+          id
+        }
+      }
+    }
+  }
+}
+"""
+
+BULK_CUSTOMERS_QUERY = """
+{
+  customers {
+    edges {
+      node {
+        id
+      }
+    }
+  }
+}
+"""
+
+SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rfm_state (
+    shop TEXT PRIMARY KEY,
+    high_water_mark TEXT,
+    last_full_build TEXT,
+    built_at TEXT,
+    customers INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS rfm_segments (
+    shop TEXT NOT NULL,
+    customer_id INTEGER NOT NULL,
+    segment TEXT NOT NULL,
+    last_order_day TEXT,
+    frequency INTEGER NOT NULL,
+    monetary REAL NOT NULL,
+    r INTEGER NOT NULL,
+    f INTEGER NOT NULL,
+    m INTEGER NOT NULL,
+    updated_at TEXT,
+    PRIMARY KEY (shop, customer_id)
+);
+CREATE INDEX IF NOT EXISTS idx_rfm_segments_segment ON rfm_segments (shop, segment, monetary);
+"""
+SQL_SELECT_STATE = "SELECT high_water_mark, last_full_build, built_at FROM rfm_state WHERE shop = ?"
+SQL_UPSERT_STATE = """
+INSERT INTO rfm_state (shop, high_water_mark, last_full_build, built_at, customers) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (shop) DO UPDATE SET
+    high_water_mark = excluded.high_water_mark, last_full_build = excluded.last_full_build,
+    built_at = excluded.built_at, customers = excluded.customers
+"""
+SQL_UPSERT_SEGMENT = """
+INSERT INTO rfm_segments (shop, customer_id, segment, last_order_day, frequency, monetary, r, f, m, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (shop, customer_id) DO UPDATE SET
+    segment = excluded.segment, last_order_day = excluded.last_order_day, frequency = excluded.frequency,
+    monetary = excluded.monetary, r = excluded.r, f = excluded.f, m = excluded.m, updated_at = excluded.updated_at
+"""
+SQL_DELETE_SEGMENT = "DELETE FROM rfm_segments WHERE shop = ? AND customer_id = ?"
+SQL_COUNT_SEGMENTS = "SELECT segment, COUNT(*) FROM rfm_segments WHERE shop = ? GROUP BY segment"
+SQL_TOP_CUSTOMERS = """
+SELECT customer_id, last_order_day, frequency, monetary, r, f, m FROM rfm_segments
+WHERE shop = ? AND segment = ? ORDER BY monetary DESC LIMIT ?
+"""
+SQL_DELETE_SHOP_SEGMENTS = "DELETE FROM rfm_segments WHERE shop = ?"
+SQL_DELETE_SHOP_STATE = "DELETE FROM rfm_state WHERE shop = ?"
+
+
+def gid_number(gid):
+    """Numerischer Teil einer Shopify-GID (gid://shopify/Customer/123 -> 123)"""
+    try:
+        return int(str(gid).rsplit('/', 1)[-1])
+    except (TypeError, ValueError):
+        return None
+
+
+def customer_gid(number):
+    return f"gid://shopify/Customer/{number}"
+
+
+def _day_indexes(dates):
+    """Wandelt 'YYYY-MM-DD'-Strings vektorisiert in Tagesindizes um, 'NaT' wird zu -1"""
+    days = np.asarray(dates, dtype='datetime64[D]')
+    return np.where(np.isnat(days), -1, days.astype('<i8')).astype('<i4')
+
+
+class RFMAggregates:
+    """
+    Kennzahlen pro Kunde als parallele, nach Kunden-ID sortierte Arrays.
+
+    last_day ist der Tagesindex der letzten gezählten Bestellung (-1 ohne Bestellung),
+    frequency die Anzahl und monetary der Nettoumsatz der gezählten Bestellungen.
+    """
+
+    __slots__ = ('ids', 'last_day', 'frequency', 'monetary')
+
+    def __init__(self, ids, last_day, frequency, monetary):
+        self.ids = np.asarray(ids, dtype='<i8')
+        self.last_day = np.asarray(last_day, dtype='<i4')
+        self.frequency = np.asarray(frequency, dtype='<i4')
+        self.monetary = np.asarray(monetary, dtype='<f8')
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0), np.empty(0), np.empty(0), np.empty(0))
+
+    @classmethod
+    def from_orders(cls, customer_ids, days, amounts, counted):
+        """Aggregiert einen Block von Bestellungen vektorisiert pro Kunde"""
+        customer_ids = np.asarray(customer_ids, dtype='<i8')
+        ids, inverse = np.unique(customer_ids, return_inverse=True)
+        counted = np.asarray(counted, dtype=bool)
+
+        frequency = np.bincount(inverse, weights=counted, minlength=len(ids)).astype('<i4')
+        monetary = np.bincount(inverse, weights=np.where(counted, amounts, 0.0), minlength=len(ids))
+        last_day = np.full(len(ids), -1, dtype='<i4')
+        np.maximum.at(last_day, inverse, np.where(counted, days, -1).astype('<i4'))
+        return cls(ids, last_day, frequency, monetary)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def merge(self, other):
+        """Führt zwei Aggregate zusammen (Häufigkeit und Umsatz addiert, letzter Tag als Maximum)"""
+        if len(other) == 0:
+            return self
+        if len(self) == 0:
+            return other
+
+        ids = np.union1d(self.ids, other.ids)
+        last_day = np.full(len(ids), -1, dtype='<i4')
+        frequency = np.zeros(len(ids), dtype='<i4')
+        monetary = np.zeros(len(ids), dtype='<f8')
+        for part in (self, other):
+            pos = np.searchsorted(ids, part.ids)
+            np.maximum.at(last_day, pos, part.last_day)
+            frequency[pos] += part.frequency
+            monetary[pos] += part.monetary
+        return RFMAggregates(ids, last_day, frequency, monetary)
+
+
+class RFMAccumulator:
+    """
+    Nimmt Bestellungen und Kunden als Stream entgegen und aggregiert sie blockweise.
+
+    Zwischengespeichert werden nur die Rohwerte eines Blocks, der Speicherbedarf
+    wächst also mit der Zahl der Kunden, nicht mit der Zahl der Bestellungen.
+    """
+
+    def __init__(self, base=None, chunk_size=RFM_CHUNK_SIZE):
+        self.aggregates = base or RFMAggregates.empty()
+        self.chunk_size = chunk_size
+        self.max_created_at = None
+        self.orders = 0
+        self._reset()
+
+    def _reset(self):
+        self._customer_ids = []
+        self._days = []
+        self._amounts = []
+        self._counted = []
+
+    def add_order(self, node):
+        """Übernimmt eine Bestellung (GraphQL-Knoten bzw. Zeile der Bulk-Operation)"""
+        customer_id = gid_number((node.get('customer') or {}).get('id'))
+        created_at = node.get('createdAt')
+        if created_at and (self.max_created_at is None or created_at > self.max_created_at):
+            self.max_created_at = created_at
+        if customer_id is None or not created_at:
+            return
+
+        day, gross, refunded, counted = order_contribution(node)
+        self._customer_ids.append(customer_id)
+        self._days.append(day)
+        self._amounts.append(gross - refunded)
+        self._counted.append(counted)
+        self.orders += 1
+        if len(self._customer_ids) >= self.chunk_size:
+            self.flush()
+
+    def add_customer(self, node):
+        """Übernimmt einen Kunden, damit auch Kunden ohne Bestellung segmentiert werden"""
+        customer_id = gid_number(node.get('id'))
+        if customer_id is None:
+            return
+        self._customer_ids.append(customer_id)
+        self._days.append('NaT')
+        self._amounts.append(0.0)
+        self._counted.append(0)
+        if len(self._customer_ids) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._customer_ids:
+            chunk = RFMAggregates.from_orders(self._customer_ids, _day_indexes(self._days),
+                                              self._amounts, self._counted)
+            self.aggregates = self.aggregates.merge(chunk)
+            self._reset()
+
+    def finish(self):
+        self.flush()
+        return self.aggregates
+
+
+def quantile_scores(values, bins=RFM_SCORE_BINS, higher_is_better=True):
+    """
+    Vergibt Scores 1..bins anhand der Quantile der Werte.
+
+    Gleiche Werte erhalten immer denselben Score; fallen Quantilgrenzen zusammen
+    (z.B. viele Einmalkäufer), bleiben die betroffenen Scores unbesetzt.
+    """
+    values = np.asarray(values, dtype='<f8')
+    if len(values) == 0:
+        return np.empty(0, dtype='<i1')
+
+    edges = np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1])
+    # side='left': Werte auf einer Grenze landen im unteren Score (z.B. alle Einmalkäufer bei F=1)
+    scores = np.searchsorted(edges, values, side='left') + 1
+    if not higher_is_better:
+        scores = bins + 1 - scores
+    return scores.astype('<i1')
+
+
+def score_customers(aggregates, today=None, bins=RFM_SCORE_BINS):
+    """
+    Berechnet R-, F- und M-Scores sowie das Segment jedes Kunden.
+
+    Die Quantile werden nur über Kunden mit Bestellungen gebildet; Kunden
+    ohne Bestellung erhalten 1/1/1 und das Segment "inactive".
+
+    Returns:
+        tuple: (r, f, m, Segmentcodes) als Arrays in der Reihenfolge der Aggregate
+    """
+    today = today if today is not None else int(np.datetime64(datetime.date.today(), 'D').astype('<i4'))
+    buyers = aggregates.frequency > 0
+
+    r = np.ones(len(aggregates), dtype='<i1')
+    f = np.ones(len(aggregates), dtype='<i1')
+    m = np.ones(len(aggregates), dtype='<i1')
+    if buyers.any():
+        recency = today - aggregates.last_day[buyers]
+        r[buyers] = quantile_scores(recency, bins, higher_is_better=False)
+        f[buyers] = quantile_scores(aggregates.frequency[buyers], bins)
+        m[buyers] = quantile_scores(aggregates.monetary[buyers], bins)
+
+    top = bins - 1
+    segments = np.select(
+        [
+            ~buyers,
+            (r >= top) & (f >= top) & (m >= top),
+            (r <= 2) & ((f >= 3) | (m >= 3)),
+            (r >= 3) & (f >= 3),
+            r >= 3,
+        ],
+        [INACTIVE, HIGH_VALUE, AT_RISK, LOYAL, POTENTIAL],
+        default=INACTIVE
+    ).astype('<i1')
+    return r, f, m, segments
+
+
+def segment_customers(customers, orders):
+    """
+    Segmentiert die übergebenen Kunden direkt im Speicher (ohne gespeicherten RFM-Lauf).
+
+    Args:
+        customers (list): Kunden-Edges aus der GraphQL-API
+        orders (list): Bestell-Edges aus der GraphQL-API
+
+    Returns:
+        dict: {Segment: [Kunden]}
+    """
+    accumulator = RFMAccumulator()
+    names = {}
+    for edge in customers or []:
+        node = edge.get('node', {})
+        accumulator.add_customer(node)
+        customer_id = gid_number(node.get('id'))
+        if customer_id is not None:
+            names[customer_id] = f"{node.get('firstName') or ''} {node.get('lastName') or ''}".strip()
+    for edge in orders or []:
+        accumulator.add_order(edge.get('node', {}))
+
+    aggregates = accumulator.finish()
+    r, f, m, codes = score_customers(aggregates)
+
+    segments = {name: [] for name in SEGMENTS}
+    for i in range(len(aggregates)):
+        customer_id = int(aggregates.ids[i])
+        segments[SEGMENTS[codes[i]]].append(_customer_entry(
+            customer_id, aggregates.last_day[i], aggregates.frequency[i], aggregates.monetary[i],
+            r[i], f[i], m[i], names.get(customer_id, '')
+        ))
+    return segments
+
+
+def _customer_entry(customer_id, last_day, frequency, monetary, r, f, m, name=''):
+    if isinstance(last_day, str) or last_day is None:
+        last_order = last_day
+    else:
+        last_order = str(np.datetime64(int(last_day), 'D')) if last_day >= 0 else None
+    return {
+        "id": customer_gid(customer_id),
+        "name": name,
+        "orders_count": int(frequency),
+        "total_spent": round(float(monetary), 2),
+        "last_order": last_order,
+        "rfm": f"{int(r)}{int(f)}{int(m)}"
+    }
+
+
+class RFMStore:
+    """Speichert Segmentzugehörigkeit und Laufstatus pro Shop (SQLite, WAL) und die Aggregate als .npz"""
+
+    def __init__(self, db_path=RFM_DB_FILE, arrays_dir=RFM_DIR):
+        self.db_path = db_path
+        self.arrays_dir = arrays_dir
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        os.makedirs(self.arrays_dir, exist_ok=True)
+        self.connection().executescript(SQL_SCHEMA)
+
+    def connection(self):
+        """Gibt die Verbindung des aktuellen Threads zurück"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _arrays_path(self, shop):
+        return os.path.join(self.arrays_dir, quote(shop, safe='') + '.npz')
+
+    def get_state(self, shop):
+        """Gibt (Hochwassermarke, letzter vollständiger Aufbau, letzter Lauf) oder (None, None, None) zurück"""
+        row = self.connection().execute(SQL_SELECT_STATE, (shop,)).fetchone()
+        return tuple(row) if row else (None, None, None)
+
+    def save_state(self, shop, high_water_mark, last_full_build, customers):
+        conn = self.connection()
+        with conn:
+            conn.execute(SQL_UPSERT_STATE, (shop, high_water_mark, last_full_build,
+                                            datetime.datetime.now().isoformat(), customers))
+
+    def load_arrays(self, shop):
+        """
+        Lädt Aggregate und Scores des letzten Laufs.
+
+        Returns:
+            tuple: (RFMAggregates, r, f, m, Segmentcodes) oder None
+        """
+        path = self._arrays_path(shop)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            aggregates = RFMAggregates(data['ids'], data['last_day'], data['frequency'], data['monetary'])
+            return aggregates, data['r'], data['f'], data['m'], data['segments']
+
+    def save_arrays(self, shop, aggregates, r, f, m, segments):
+        path = self._arrays_path(shop)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as handle:
+            np.savez(handle, ids=aggregates.ids, last_day=aggregates.last_day, frequency=aggregates.frequency,
+                     monetary=aggregates.monetary, r=r, f=f, m=m, segments=segments)
+        os.replace(tmp_path, path)
+
+    def apply_changes(self, shop, rows, removed_ids):
+        """Schreibt nur geänderte Kunden und entfernt gelöschte in einer Transaktion"""
+        conn = self.connection()
+        with conn:
+            conn.executemany(SQL_UPSERT_SEGMENT, rows)
+            conn.executemany(SQL_DELETE_SEGMENT, [(shop, int(customer_id)) for customer_id in removed_ids])
+
+    def segment_counts(self, shop):
+        counts = dict(self.connection().execute(SQL_COUNT_SEGMENTS, (shop,)).fetchall())
+        return {name: counts.get(name, 0) for name in SEGMENTS}
+
+    def top_customers(self, shop, segment, limit=RFM_SEGMENT_SAMPLE):
+        """Kunden eines Segments, absteigend nach Umsatz"""
+        rows = self.connection().execute(SQL_TOP_CUSTOMERS, (shop, segment, limit)).fetchall()
+        return [_customer_entry(*row) for row in rows]
+
+    def delete_shop(self, shop):
+        conn = self.connection()
+        with conn:
+            conn.execute(SQL_DELETE_SHOP_SEGMENTS, (shop,))
+            conn.execute(SQL_DELETE_SHOP_STATE, (shop,))
+        try:
+            os.remove(self._arrays_path(shop))
+        except FileNotFoundError:
+            pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_rfm_store():
+    """Gibt den prozessweiten RFM-Speicher zurück"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = RFMStore()
+    return _store
+
+
+def changed_rows(shop, aggregates, r, f, m, segments, previous=None):
+    """
+    Vergleicht das Ergebnis vektorisiert mit dem letzten Lauf.
+
+    Returns:
+        tuple: (Zeilen für SQL_UPSERT_SEGMENT, IDs nicht mehr vorhandener Kunden)
+    """
+    changed = np.ones(len(aggregates), dtype=bool)
+    removed = np.empty(0, dtype='<i8')
+
+    if previous is not None:
+        old, old_r, old_f, old_m, old_segments = previous
+        if len(old):
+            pos = np.minimum(np.searchsorted(old.ids, aggregates.ids), len(old) - 1)
+            found = old.ids[pos] == aggregates.ids
+            changed = ~found | (
+                (old_segments[pos] != segments) | (old_r[pos] != r) | (old_f[pos] != f) | (old_m[pos] != m)
+                | (old.last_day[pos] != aggregates.last_day) | (old.frequency[pos] != aggregates.frequency)
+                | ~np.isclose(old.monetary[pos], aggregates.monetary)
+            )
+            removed = np.setdiff1d(old.ids, aggregates.ids, assume_unique=True)
+
+    idx = np.flatnonzero(changed)
+    last_days = aggregates.last_day[idx]
+    last_dates = np.where(last_days >= 0, last_days.astype('datetime64[D]').astype(str), None)
+    now = datetime.datetime.now().isoformat(timespec='seconds')
+    names = np.asarray(SEGMENTS, dtype=object)[segments[idx]]
+
+    rows = [
+        (shop, customer_id, segment, last_date, frequency, monetary, score_r, score_f, score_m, now)
+        for customer_id, segment, last_date, frequency, monetary, score_r, score_f, score_m in zip(
+            aggregates.ids[idx].tolist(), names.tolist(), last_dates.tolist(),
+            aggregates.frequency[idx].tolist(), aggregates.monetary[idx].tolist(),
+            r[idx].tolist(), f[idx].tolist(), m[idx].tolist()
+        )
+    ]
+    return rows, removed
+
+
+def update_shop(shop, access_token, store=None, full=None):
+    """
+    Aktualisiert die RFM-Segmente eines Shops.
+
+    Beim ersten Lauf und alle RFM_REBUILD_DAYS Tage werden alle Kunden und
+    Bestellungen per Bulk-Operation gestreamt (damit auch Erstattungen und
+    Stornierungen älterer Bestellungen ankommen), dazwischen nur die seit der
+    Hochwassermarke neu angelegten Bestellungen. Die Scores werden immer über
+    alle Kunden neu berechnet, geschrieben werden nur geänderte Kunden.
+
+    Returns:
+        dict: Zusammenfassung des Laufs
+    """
+    store = store or get_rfm_store()
+    high_water_mark, last_full_build, _ = store.get_state(shop)
+    previous = store.load_arrays(shop)
+
+    if full is None:
+        full = previous is None or high_water_mark is None or not last_full_build or (
+            datetime.datetime.now() - datetime.datetime.fromisoformat(last_full_build)
+        ).days >= RFM_REBUILD_DAYS
+
+    accumulator = RFMAccumulator(None if full else previous[0])
+    if full:
+        last_full_build = datetime.datetime.now().isoformat(timespec='seconds')
+        orders_query = BULK_CUSTOMER_ORDERS_QUERY % ''
+    else:
+        created_filter = f"created_at:>'{high_water_mark}'"
+        orders_query = BULK_CUSTOMER_ORDERS_QUERY % f'(query: {json.dumps(created_filter)})'
+
+    for record in shopify_api.run_bulk_export(shop, access_token, orders_query):
+        accumulator.add_order(record)
+    if full:
+        for record in shopify_api.run_bulk_export(shop, access_token, BULK_CUSTOMERS_QUERY):
+            accumulator.add_customer(record)
+
+    aggregates = accumulator.finish()
+    r, f, m, segments = score_customers(aggregates)
+    rows, removed = changed_rows(shop, aggregates, r, f, m, segments, previous)
+
+    # Reihenfolge: Segmente, dann Arrays, zuletzt die Hochwassermarke
+    store.apply_changes(shop, rows, removed)
+    store.save_arrays(shop, aggregates, r, f, m, segments)
+    store.save_state(shop, accumulator.max_created_at or high_water_mark, last_full_build, len(aggregates))
+
+    summary = {
+        "full": full,
+        "orders": accumulator.orders,
+        "customers": len(aggregates),
+        "changed": len(rows),
+        "removed": len(removed),
+        "segments": dict(zip(SEGMENTS, np.bincount(segments, minlength=len(SEGMENTS)).tolist()))
+    }
+    logger.info(f"RFM-Segmente für {shop} aktualisiert ({'vollständig' if full else 'inkrementell'}): "
+                f"{summary['orders']} Bestellungen, {summary['customers']} Kunden, {summary['changed']} geändert")
+    return summary
+
+
+def update_if_due(shop, access_token, store=None, interval=RFM_UPDATE_INTERVAL):
+    """Führt update_shop aus, wenn der letzte Lauf älter als `interval` Sekunden ist"""
+    store = store or get_rfm_store()
+    _, _, built_at = store.get_state(shop)
+    if built_at and (datetime.datetime.now() - datetime.datetime.fromisoformat(built_at)).total_seconds() < interval:
+        return None
+    return update_shop(shop, access_token, store)
+
+
+def get_segments(shop, limit=RFM_SEGMENT_SAMPLE, store=None):
+    """
+    Gibt die gespeicherten Segmente eines Shops zurück.
+
+    Returns:
+        dict: {Segment: [Kunden, höchstens `limit`, absteigend nach Umsatz]} oder None ohne RFM-Lauf
+    """
+    store = store or get_rfm_store()
+    _, _, built_at = store.get_state(shop)
+    if not built_at:
+        return None
+    return {segment: store.top_customers(shop, segment, limit) for segment in SEGMENTS}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='RFM-Segmente der installierten Shops aktualisieren')
+    parser.add_argument('--shop', action='append', help='Nur diesen Shop aktualisieren (mehrfach möglich)')
+    parser.add_argument('--full', action='store_true', help='Alle Kunden und Bestellungen neu einlesen')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    failed = 0
+    for shop, entry in data_models.get_installed_shops().items():
+        if args.shop and shop not in args.shop:
+            continue
+        try:
+            update_shop(shop, entry.get('access_token'), full=args.full or None)
+        except Exception as e:
+            logger.error(f"Fehler bei der RFM-Segmentierung für {shop}: {e}")
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,376 @@
+import os
+import sys
+import time
+import uuid
+import zlib
+import fcntl
+import random
+import signal
+import logging
+import argparse
+import threading
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import rfm
+import forecasting
+import data_models
+import dashboard_snapshots
+
+try:
+    import redis
+except ImportError:  # Ohne Redis werden Dateisperren verwendet (nur auf einem Host sicher)
+    redis = None
+
+# Logger einrichten
+logger = logging.getLogger('scheduler')
+
+# Environment-Variablen laden
+load_dotenv()
+
+# Konstanten
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+LOCKS_DIR = os.path.join(DATA_DIR, 'locks')
+REDIS_URL = os.environ.get('REDIS_URL')
+SYNC_INTERVAL = int(os.environ.get('SCHEDULER_SYNC_INTERVAL', 3600))  # Sekunden
+SYNC_JITTER = int(os.environ.get('SCHEDULER_JITTER', 60))  # Sekunden
+TICK_INTERVAL = float(os.environ.get('SCHEDULER_TICK', 10.0))  # Sekunden
+REGISTRY_RELOAD_INTERVAL = int(os.environ.get('SCHEDULER_REGISTRY_RELOAD', 300))  # Sekunden
+MAX_WORKERS = int(os.environ.get('SCHEDULER_MAX_WORKERS', 4))
+LOCK_TTL = int(os.environ.get('SCHEDULER_LOCK_TTL', 900))  # Sekunden
+FORECAST_LOCK_KEY = '__forecasts__'
+
+# Gibt die Sperre nur frei, wenn sie noch dem eigenen Token gehört
+REDIS_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class FileShopLock:
+    """Nicht blockierende Sperre pro Shop über flock (prozessübergreifend auf einem Host)"""
+
+    def __init__(self, directory=LOCKS_DIR):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, shop):
+        handle = open(os.path.join(self.directory, quote(shop, safe='') + '.lock'), 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        with self._lock:
+            self._handles[shop] = handle
+        return True
+
+    def release(self, shop):
+        with self._lock:
+            handle = self._handles.pop(shop, None)
+        if handle is not None:
+            handle.close()
+
+
+class RedisShopLock:
+    """
+    Sperre pro Shop in Redis (SET NX mit Ablaufzeit), gültig über mehrere Hosts.
+
+    Gehaltene Sperren werden von einem Hintergrund-Thread alle ttl/3 Sekunden
+    verlängert, damit lange Synchronisationen ihre Sperre nicht verlieren; stirbt
+    der Prozess, läuft die Sperre nach spätestens ttl Sekunden ab.
+    """
+
+    def __init__(self, client, ttl=LOCK_TTL):
+        self.client = client
+        self.ttl = ttl
+        self.renew_interval = max(1.0, ttl / 3)
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._release = client.register_script(REDIS_RELEASE_SCRIPT)
+        self._renewer = None
+        self._renewer_pid = None
+
+    def _key(self, shop):
+        return f"scheduler:lock:{shop}"
+
+    def acquire(self, shop):
+        token = uuid.uuid4().hex
+        if not self.client.set(self._key(shop), token, nx=True, ex=self.ttl):
+            return False
+        with self._lock:
+            self._tokens[shop] = token
+        self._ensure_renewer()
+        return True
+
+    def release(self, shop):
+        with self._lock:
+            token = self._tokens.pop(shop, None)
+        if token is not None:
+            self._release(keys=[self._key(shop)], args=[token])
+
+    def _extend(self, shop, token):
+        """Setzt die Ablaufzeit neu, sofern die Sperre noch dem eigenen Token gehört (WATCH/MULTI)"""
+        key = self._key(shop)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != token.encode('utf-8'):
+                    return False
+                pipe.multi()
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                # Schlüssel wurde zwischen GET und EXPIRE geändert: die Sperre gehört nicht mehr uns
+                return False
+
+    def renew(self):
+        """Verlängert alle gehaltenen Sperren; verlorene Sperren werden verworfen"""
+        with self._lock:
+            held = list(self._tokens.items())
+
+        for shop, token in held:
+            try:
+                extended = self._extend(shop, token)
+            except Exception as e:
+                logger.error(f"Fehler beim Verlängern der Sperre für {shop}: {e}")
+                continue
+            if not extended:
+                logger.error(f"Sperre für {shop} ist abgelaufen oder wurde von einem anderen Worker übernommen")
+                with self._lock:
+                    if self._tokens.get(shop) == token:
+                        del self._tokens[shop]
+
+    def _ensure_renewer(self):
+        """Startet den Verlängerungs-Thread (nach einem Fork von Gunicorn erneut)"""
+        pid = os.getpid()
+        if self._renewer is not None and self._renewer_pid == pid and self._renewer.is_alive():
+            return
+
+        with self._lock:
+            if self._renewer is not None and self._renewer_pid == pid and self._renewer.is_alive():
+                return
+            self._renewer_pid = pid
+            self._renewer = threading.Thread(target=self._run_renewer, name='shop-lock-renewal', daemon=True)
+            self._renewer.start()
+
+    def _run_renewer(self):
+        while True:
+            time.sleep(self.renew_interval)
+            self.renew()
+
+
+def create_shop_lock(redis_url=REDIS_URL):
+    """Verwendet Redis-Sperren, wenn verfügbar, sonst Dateisperren"""
+    if redis_url and redis is not None:
+        try:
+            client = redis.Redis.from_url(redis_url, socket_timeout=5, socket_connect_timeout=5)
+            client.ping()
+            logger.info("Scheduler verwendet Redis-Sperren")
+            return RedisShopLock(client)
+        except Exception as e:
+            logger.error(f"Redis nicht erreichbar, verwende Dateisperren: {e}")
+    return FileShopLock()
+
+
+_shop_lock = None
+_shop_lock_guard = threading.Lock()
+
+
+def get_shop_lock():
+    """Gibt die prozessweite Shop-Sperre zurück (geteilt von Scheduler und Web-Prozess)"""
+    global _shop_lock
+    if _shop_lock is None:
+        with _shop_lock_guard:
+            if _shop_lock is None:
+                _shop_lock = create_shop_lock()
+    return _shop_lock
+
+
+def sync_shop(shop, access_token):
+    """Standard-Synchronisation: Metriken und Snapshots, danach die RFM-Segmente, sofern fällig"""
+    # run_shop hält die Sperre des Shops bereits
+    dashboard_snapshots.refresh_shop(shop, access_token, locked=True)
+    try:
+        rfm.update_if_due(shop, access_token)
+    except Exception as e:
+        logger.error(f"Fehler bei der RFM-Segmentierung für {shop}: {e}")
+
+
+def shop_offset(shop, interval=SYNC_INTERVAL):
+    """Fester Versatz pro Shop innerhalb des Intervalls, damit die Shops über die Stunde verteilt laufen"""
+    return zlib.crc32(shop.encode('utf-8')) % max(1, interval)
+
+
+class SyncScheduler:
+    """Synchronisiert alle installierten Shops periodisch, verteilt über das Intervall"""
+
+    def __init__(self, lock=None, interval=SYNC_INTERVAL, jitter=SYNC_JITTER, max_workers=MAX_WORKERS,
+                 sync_func=None):
+        self.lock = lock or get_shop_lock()
+        self.interval = interval
+        self.jitter = jitter
+        self.sync_func = sync_func or sync_shop
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='shop-sync')
+        self._max_workers = max_workers
+        self._shops = {}
+        self._next_run = {}
+        self._running = set()
+        self._state_lock = threading.Lock()
+        self._last_reload = 0
+        self._last_forecast = 0
+        self._forecast_running = False
+        self._stop = threading.Event()
+
+    def _first_run(self, shop, now):
+        """Erster Lauf am festen Versatz des Shops innerhalb des aktuellen Intervalls"""
+        cycle_start = now - (now % self.interval)
+        run_at = cycle_start + shop_offset(shop, self.interval)
+        if run_at < now:
+            run_at += self.interval
+        return run_at + random.uniform(-self.jitter, self.jitter)
+
+    def reload_shops(self, now=None):
+        """Liest die Shop-Registry neu ein und plant neue Shops ein"""
+        now = now or time.time()
+        shops = data_models.get_installed_shops()
+        with self._state_lock:
+            self._shops = shops
+            for shop in shops:
+                if shop not in self._next_run:
+                    self._next_run[shop] = self._first_run(shop, now)
+            for shop in list(self._next_run):
+                if shop not in shops:
+                    del self._next_run[shop]
+        self._last_reload = now
+        logger.info(f"{len(shops)} Shops im Scheduler eingeplant")
+
+    def due_shops(self, now):
+        """Gibt die fälligen Shops zurück, höchstens so viele wie freie Worker"""
+        with self._state_lock:
+            free = self._max_workers - len(self._running)
+            due = sorted((run_at, shop) for shop, run_at in self._next_run.items()
+                         if run_at <= now and shop not in self._running)
+            return [shop for _, shop in due[:max(0, free)]]
+
+    def run_shop(self, shop):
+        """Synchronisiert einen Shop, sofern kein anderer Worker ihn gerade bearbeitet"""
+        access_token = self._shops.get(shop, {}).get('access_token')
+        if not access_token:
+            return False
+        if not self.lock.acquire(shop):
+            logger.info(f"Shop {shop} wird bereits von einem anderen Worker synchronisiert")
+            return False
+
+        started = time.time()
+        try:
+            self.sync_func(shop, access_token)
+            logger.info(f"Shop {shop} in {time.time() - started:.1f}s synchronisiert")
+            return True
+        except Exception as e:
+            logger.error(f"Fehler bei der Synchronisation von {shop}: {e}")
+            return False
+        finally:
+            self.lock.release(shop)
+
+    def _run_and_reschedule(self, shop):
+        try:
+            self.run_shop(shop)
+        finally:
+            with self._state_lock:
+                self._running.discard(shop)
+                if shop in self._next_run:
+                    # Im festen Raster bleiben, damit sich die Shops nicht zusammenschieben
+                    next_run = self._next_run[shop]
+                    now = time.time()
+                    while next_run <= now:
+                        next_run += self.interval
+                    self._next_run[shop] = next_run + random.uniform(-self.jitter, self.jitter)
+
+    def run_forecasts(self):
+        """Berechnet die Prognosen aller Shops gebündelt (höchstens ein Worker gleichzeitig)"""
+        if not self.lock.acquire(FORECAST_LOCK_KEY):
+            return False
+        try:
+            forecasting.run_batch(list(self._shops))
+            return True
+        except Exception as e:
+            logger.error(f"Fehler bei der Berechnung der Prognosen: {e}")
+            return False
+        finally:
+            self.lock.release(FORECAST_LOCK_KEY)
+            with self._state_lock:
+                self._forecast_running = False
+
+    def tick(self, now=None):
+        """Startet alle fälligen Shop-Synchronisationen"""
+        now = now or time.time()
+        if now - self._last_reload >= REGISTRY_RELOAD_INTERVAL:
+            self.reload_shops(now)
+
+        with self._state_lock:
+            forecast_due = not self._forecast_running and now - self._last_forecast >= forecasting.FORECAST_INTERVAL
+            if forecast_due:
+                self._forecast_running = True
+                self._last_forecast = now
+        if forecast_due:
+            self._executor.submit(self.run_forecasts)
+
+        for shop in self.due_shops(now):
+            with self._state_lock:
+                self._running.add(shop)
+            self._executor.submit(self._run_and_reschedule, shop)
+
+    def run_forever(self, tick_interval=TICK_INTERVAL):
+        logger.info(f"Scheduler gestartet (Intervall {self.interval}s, {self._max_workers} Worker)")
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Fehler im Scheduler: {e}")
+            self._stop.wait(tick_interval)
+        self._executor.shutdown(wait=True)
+        logger.info("Scheduler beendet")
+
+    def stop(self, *args):
+        self._stop.set()
+
+    def run_once(self, shops=None):
+        """Synchronisiert alle (oder die angegebenen) Shops sofort, z.B. für Cron-Jobs"""
+        self.reload_shops()
+        targets = [shop for shop in self._shops if not shops or shop in shops]
+        results = list(self._executor.map(self.run_shop, targets))
+        self._executor.shutdown(wait=True)
+        return dict(zip(targets, results))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Periodische Synchronisation aller installierten Shops')
+    parser.add_argument('--once', action='store_true', help='Alle Shops einmal synchronisieren und beenden')
+    parser.add_argument('--shop', action='append', help='Nur diesen Shop synchronisieren (mit --once)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    scheduler = SyncScheduler()
+
+    if args.once:
+        results = scheduler.run_once(args.shop)
+        failed = [shop for shop, ok in results.items() if not ok]
+        print(f"{len(results)} Shops synchronisiert, {len(failed)} übersprungen oder fehlgeschlagen")
+        return 1 if failed else 0
+
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    scheduler.run_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
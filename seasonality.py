@@ -0,0 +1,233 @@
+import os
+import logging
+import datetime
+import numpy as np
+
+import data_models
+import hourly_metrics
+from timeseries import today_index
+
+# Logger einrichten
+logger = logging.getLogger('seasonality')
+
+# Konstanten
+SEASONALITY_MAX_DAYS = int(os.environ.get('SEASONALITY_MAX_DAYS', 3 * 365))  # Ausgewertete Historie
+SEASONALITY_MIN_CONFIDENCE = float(os.environ.get('SEASONALITY_MIN_CONFIDENCE', 30.0))  # Prozent
+SEASONALITY_CACHE_PREFIX = 'seasonality_'
+HOURLY_SEASONALITY_DAYS = int(os.environ.get('HOURLY_SEASONALITY_DAYS', 28))  # Ausgewertete Tage
+
+# Kandidaten: Name -> (Periode, zulässige Verzögerungen, Glättung, Hochpass) in Tagen bzw. Stunden.
+# Die Glättung (gleitender Mittelwert) entfernt kürzere Muster, sonst würde z.B. ein
+# Wochenmuster bei Verzögerung 28 als Monatsmuster erscheinen. Der Hochpass zieht
+# einen gleitenden Mittelwert ab und entfernt so längere Muster und Trends
+# (0: nur linearer Trend).
+DAILY_PERIODS = {
+    "weekly": (7, (7,), 1, 7),
+    "monthly": (30, (28, 29, 30, 31), 7, 61),  # Kalendermonate sind unterschiedlich lang
+    "yearly": (365, (364, 365, 366), 61, 0),
+}
+HOURLY_PERIODS = {
+    "daily": (24, (24,), 1, 24),
+    "weekly": (168, (168,), 24, 168),
+}
+DAY_NAMES = ['Montag', 'Dienstag', 'Mittwoch', 'Donnerstag', 'Freitag', 'Samstag', 'Sonntag']
+
+
+def _moving_average(x, window):
+    return np.convolve(x, np.ones(window) / window, mode='valid')
+
+
+def _prepare(values, smooth=1, highpass=0):
+    """
+    Bereitet eine Reihe für die Suche nach einer Periode vor.
+
+    Spitzen werden per log1p gedämpft, kürzere Muster geglättet und längere
+    Muster per Hochpass (oder nur der lineare Trend) entfernt.
+    """
+    x = np.log1p(np.clip(values, 0, None))
+    if smooth > 1 and len(x) >= smooth:
+        x = _moving_average(x, smooth)
+    if highpass > 1 and len(x) >= highpass:
+        offset = highpass // 2
+        trend = _moving_average(x, highpass)
+        x = x[offset:offset + len(trend)] - trend
+    elif len(x) >= 2:
+        t = np.arange(len(x))
+        slope, intercept = np.polyfit(t, x, 1)
+        x = x - (slope * t + intercept)
+    return x - x.mean() if len(x) else x
+
+
+def autocorrelation(values, max_lag=None):
+    """
+    Autokorrelation aller Verzögerungen über die FFT (Wiener-Chintschin) in O(n log n).
+
+    Returns:
+        np.ndarray: acf[0..max_lag], acf[0] == 1 (oder Nullen bei konstanter Reihe)
+    """
+    x = np.asarray(values, dtype='<f8')
+    n = len(x)
+    max_lag = n - 1 if max_lag is None else min(max_lag, n - 1)
+    if n < 2:
+        return np.zeros(max_lag + 1)
+
+    size = 1 << (2 * n - 1).bit_length()  # Nullauffüllung gegen zirkuläre Überlappung
+    spectrum = np.fft.rfft(x, size)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum), size)[:max_lag + 1]
+    if acf[0] <= 0:
+        return np.zeros(max_lag + 1)
+    # Unverzerrte Schätzung: jede Verzögerung durch die Anzahl ihrer Paare teilen
+    acf = acf / (n - np.arange(max_lag + 1))
+    return acf / acf[0]
+
+
+def spectral_share(values, period):
+    """Anteil der Varianz, der auf die Frequenz 1/period und ihre Oberschwingungen entfällt"""
+    x = np.asarray(values, dtype='<f8')
+    power = np.abs(np.fft.rfft(x)) ** 2
+    total = power[1:].sum()
+    if total <= 0:
+        return 0.0
+    freqs = np.fft.rfftfreq(len(x))
+    harmonics = np.arange(1, int(period) // 2 + 1) / period
+    bins = np.unique(np.rint(harmonics * len(x)).astype(int))
+    bins = bins[(bins > 0) & (bins < len(freqs))]
+    return float(power[bins].sum() / total)
+
+
+def detect_periods(values, candidates):
+    """
+    Prüft eine Reihe auf die angegebenen Perioden.
+
+    Die Konfidenz ist die höchste Autokorrelation bei den zulässigen Verzögerungen
+    (in Prozent), sofern sie über der Signifikanzschwelle 2/sqrt(n) liegt. Es werden
+    mindestens zwei volle Perioden benötigt.
+
+    Returns:
+        dict: {Name: {"period": ..., "lag": ..., "confidence": ..., "spectral_share": ..., "significant": bool}}
+    """
+    raw = np.nan_to_num(np.asarray(values, dtype='<f8'))
+
+    results = {}
+    for name, (period, lags, smooth, highpass) in candidates.items():
+        x = _prepare(raw, smooth, highpass)
+        acf = autocorrelation(x, max(lags))
+        n = len(x)
+        threshold = 2 / np.sqrt(n) if n else 1.0
+        usable = [lag for lag in lags if lag < len(acf) and n >= 2 * lag]
+        if not usable:
+            results[name] = {"period": period, "lag": None, "confidence": 0.0,
+                             "spectral_share": 0.0, "significant": False}
+            continue
+        lag = max(usable, key=lambda candidate: acf[candidate])
+        peak = float(acf[lag])
+        confidence = round(max(0.0, min(peak, 1.0)) * 100, 1)
+        results[name] = {
+            "period": period,
+            "lag": lag,
+            "confidence": confidence,
+            "spectral_share": round(spectral_share(x, lag), 3),
+            "significant": bool(peak > threshold and confidence >= SEASONALITY_MIN_CONFIDENCE)
+        }
+    return results
+
+
+def weekday_profile(series):
+    """Mittelwert je Wochentag (Montag = 0) über die Reihe"""
+    values = np.nan_to_num(series.values)
+    weekdays = (np.arange(series.start, series.end + 1) + 3) % 7  # 1970-01-01 war ein Donnerstag
+    counts = np.bincount(weekdays, minlength=7)
+    sums = np.bincount(weekdays, weights=values, minlength=7)
+    return np.divide(sums, counts, out=np.zeros(7), where=counts > 0)
+
+
+def analyze_daily(series):
+    """
+    Sucht wöchentliche, monatliche und jährliche Muster in einer täglichen Reihe.
+
+    Returns:
+        dict: {"seasonality": stärkste signifikante Periode, "none" oder "unknown",
+               "confidence": ..., "periods": {...}, "best_day": bei wöchentlichem Muster}
+    """
+    if len(series) < 14:
+        return {"seasonality": "unknown", "confidence": 0, "periods": {}}
+
+    periods = detect_periods(series.fill_gaps('zero').values, DAILY_PERIODS)
+    result = _summarize(periods)
+    if periods["weekly"]["significant"]:
+        result["best_day"] = DAY_NAMES[int(np.argmax(weekday_profile(series.window(91, series.end))))]
+    return result
+
+
+def analyze_hourly(values):
+    """Sucht tägliche und wöchentliche Muster in einer stündlichen Reihe (beginnend um 0 Uhr)"""
+    values = np.asarray(values, dtype='<f8')
+    if len(values) < 48:
+        return {"seasonality": "unknown", "confidence": 0, "periods": {}}
+
+    periods = detect_periods(values, HOURLY_PERIODS)
+    result = _summarize(periods)
+    if periods["daily"]["significant"]:
+        hours = np.arange(len(values)) % 24
+        profile = np.bincount(hours, weights=np.nan_to_num(values), minlength=24)
+        result["peak_hour"] = int(np.argmax(profile))
+    return result
+
+
+def _summarize(periods):
+    significant = {name: info for name, info in periods.items() if info["significant"]}
+    if not significant:
+        return {"seasonality": "none", "confidence": 0, "periods": periods}
+    name = max(significant, key=lambda key: significant[key]["confidence"])
+    return {"seasonality": name, "confidence": significant[name]["confidence"], "periods": periods}
+
+
+def series_fingerprint(series):
+    """Kennung des Datenstands; ändert sie sich, wird die Analyse neu berechnet"""
+    known = ~np.isnan(series.values)
+    return f"{series.start}:{series.end}:{int(known.sum())}:{float(np.nansum(series.values)):.4f}"
+
+
+def get_seasonality(shop_metrics, metric_name, max_days=SEASONALITY_MAX_DAYS, backend=None):
+    """
+    Gibt die Saisonalität einer Metrik zurück, zwischengespeichert pro Shop und Metrik.
+
+    Neu berechnet wird nur, wenn sich der Datenstand der Reihe geändert hat.
+    """
+    series = shop_metrics.get_series(metric_name)
+    if series is None or len(series) == 0:
+        return {"seasonality": "unknown", "confidence": 0, "periods": {}}
+
+    # Fenster am letzten vorhandenen Tag ausrichten, damit es sich nur mit neuen Daten ändert
+    window = series.slice(max(series.start, series.end - max_days + 1), series.end)
+    fingerprint = series_fingerprint(window)
+    backend = backend or data_models.get_metrics_backend()
+    cache_key = f"{SEASONALITY_CACHE_PREFIX}{metric_name}"
+
+    cached = backend.load_artifact(shop_metrics.shop_domain, cache_key)
+    if cached and cached.get("fingerprint") == fingerprint:
+        return cached["result"]
+
+    result = analyze_daily(window)
+    backend.save_artifact(shop_metrics.shop_domain, cache_key, {
+        "fingerprint": fingerprint,
+        "computed_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "result": result
+    })
+    logger.info(f"Saisonalität für {shop_metrics.shop_domain}/{metric_name} neu berechnet: {result['seasonality']}")
+    return result
+
+
+def get_hourly_seasonality(shop, metric_name='pageviews', days=HOURLY_SEASONALITY_DAYS, store=None):
+    """
+    Sucht tägliche und wöchentliche Muster in den stündlichen Werten der letzten `days` vollen Tage.
+
+    Der Bereich beginnt um Mitternacht (UTC), damit peak_hour der UTC-Uhrzeit entspricht; der
+    angebrochene heutige Tag bleibt außen vor.
+    """
+    store = store or hourly_metrics.get_hourly_store()
+    end_hour = today_index() * 24
+    values = store.hourly_values(shop, metric_name, end_hour - days * 24, end_hour)
+    if not values.any():
+        return {"seasonality": "unknown", "confidence": 0, "periods": {}}
+    return analyze_hourly(values)
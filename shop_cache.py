@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+try:
+    import redis
+except ImportError:  # Redis ist optional, ohne läuft der prozesslokale Cache
+    redis = None
+
+# Logger einrichten
+logger = logging.getLogger('shop_cache')
+
+# Konstanten
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHE_KEY_PREFIX = os.environ.get('SHOP_CACHE_PREFIX', 'shopcache')
+CACHE_DEFAULT_TIMEOUT = int(os.environ.get('SHOP_CACHE_DEFAULT_TIMEOUT', 300))  # Sekunden
+COMPRESS_MIN_BYTES = int(os.environ.get('SHOP_CACHE_COMPRESS_MIN_BYTES', 1024))
+LOCAL_MAX_ENTRIES = int(os.environ.get('SHOP_CACHE_LOCAL_MAX_ENTRIES', 2048))
+# Wie lange abgelaufene Werte noch ausgeliefert werden, während im Hintergrund aktualisiert wird
+CACHE_STALE_TTL = int(os.environ.get('SHOP_CACHE_STALE_TTL', 900))  # Sekunden
+REFRESH_LOCK_TIMEOUT = int(os.environ.get('SHOP_CACHE_REFRESH_LOCK_TIMEOUT', 60))  # Sekunden
+REFRESH_MAX_WORKERS = int(os.environ.get('SHOP_CACHE_REFRESH_WORKERS', 4))
+
+# Frische-Dauer pro Abfragetyp in Sekunden
+CACHE_TTLS = {
+    'shop_info': int(os.environ.get('SHOP_CACHE_TTL_SHOP_INFO', 3600)),
+    'products': int(os.environ.get('SHOP_CACHE_TTL_PRODUCTS', 300)),
+    'orders': int(os.environ.get('SHOP_CACHE_TTL_ORDERS', 120)),
+    'customers': int(os.environ.get('SHOP_CACHE_TTL_CUSTOMERS', 300)),
+}
+
+# Erstes Byte jedes Eintrags kennzeichnet das Format
+FORMAT_JSON = b'j'
+FORMAT_ZLIB = b'z'
+
+
+def encode_value(value):
+    """Serialisiert kompakt als JSON und komprimiert größere Werte mit zlib"""
+    raw = json.dumps(value, separators=(',', ':'), default=str).encode('utf-8')
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        return FORMAT_ZLIB + zlib.compress(raw, 6)
+    return FORMAT_JSON + raw
+
+
+def decode_value(data):
+    """Kehrt encode_value um"""
+    marker, payload = data[:1], data[1:]
+    if marker == FORMAT_ZLIB:
+        payload = zlib.decompress(payload)
+    return json.loads(payload)
+
+
+class LocalCacheBackend:
+    """Prozesslokaler Fallback mit TTL und LRU-Begrenzung"""
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # Schlüssel -> (Ablaufzeit, Daten)
+        self._shop_keys = {}
+        self._locks = {}  # Sperrschlüssel -> Ablaufzeit
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def set(self, shop, key, data, timeout):
+        with self._lock:
+            self._entries[key] = (time.time() + timeout, data)
+            self._entries.move_to_end(key)
+            self._shop_keys.setdefault(shop, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def acquire_lock(self, key, timeout):
+        with self._lock:
+            now = time.time()
+            if self._locks.get(key, 0) > now:
+                return False
+            self._locks[key] = now + timeout
+            return True
+
+    def release_lock(self, key):
+        with self._lock:
+            self._locks.pop(key, None)
+
+    def delete_shop(self, shop):
+        with self._lock:
+            keys = self._shop_keys.pop(shop, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._shop_keys.clear()
+
+
+class RedisCacheBackend:
+    """Gemeinsamer Cache aller Worker in Redis mit Schlüssel-Set pro Shop"""
+
+    def __init__(self, client, prefix=CACHE_KEY_PREFIX):
+        self.client = client
+        self.prefix = prefix
+        # Redis < 7 kennt EXPIRE NX/GT nicht, dann wird vorher die TTL verglichen
+        self._expire_options = True
+
+    def _index_key(self, shop):
+        return f"{self.prefix}:index:{shop}"
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, shop, key, data, timeout):
+        index_key = self._index_key(shop)
+        # Das Index-Set lebt etwas länger als der langlebigste Eintrag
+        index_ttl = timeout * 2
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(key, data, ex=timeout)
+        pipe.sadd(index_key, key)
+        if self._expire_options:
+            # Nur verlängern, nie verkürzen: NX für ein neues Set, GT für ein bestehendes
+            pipe.expire(index_key, index_ttl, nx=True)
+            pipe.expire(index_key, index_ttl, gt=True)
+        try:
+            pipe.execute()
+            if self._expire_options:
+                return
+        except redis.ResponseError as e:
+            if not self._expire_options:
+                raise
+            logger.warning(f"Redis unterstützt EXPIRE NX/GT nicht, vergleiche TTL vorher: {e}")
+            self._expire_options = False
+        self._extend_index(index_key, index_ttl)
+
+    def _extend_index(self, index_key, ttl):
+        """Verlängert die TTL des Index-Sets, wenn sie kürzer ist (-1 = ohne Ablauf, -2 = fehlt)"""
+        if self.client.ttl(index_key) < ttl:
+            self.client.expire(index_key, ttl)
+
+    def acquire_lock(self, key, timeout):
+        """Sperre über SET NX, damit pro Schlüssel nur ein Worker aktualisiert"""
+        return bool(self.client.set(key, b'1', nx=True, ex=timeout))
+
+    def release_lock(self, key):
+        self.client.delete(key)
+
+    def delete_shop(self, shop):
+        """Löscht nur die Schlüssel dieses Shops – O(Anzahl Schlüssel des Shops)"""
+        index_key = self._index_key(shop)
+        keys = self.client.smembers(index_key)
+        pipe = self.client.pipeline(transaction=False)
+        if keys:
+            pipe.delete(*keys)
+        pipe.delete(index_key)
+        pipe.execute()
+        return len(keys)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=f"{self.prefix}:*", count=500):
+            self.client.delete(key)
+
+
+def create_cache_backend(redis_url=REDIS_URL):
+    """Verwendet Redis, wenn konfiguriert und erreichbar, sonst den prozesslokalen Cache"""
+    if redis_url and redis is not None:
+        try:
+            client = redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2)
+            client.ping()
+            logger.info("Shop-Cache verwendet Redis")
+            return RedisCacheBackend(client)
+        except Exception as e:
+            logger.error(f"Redis nicht erreichbar, verwende prozesslokalen Cache: {e}")
+    elif redis_url:
+        logger.warning("REDIS_URL gesetzt, aber das Paket 'redis' ist nicht installiert")
+    return LocalCacheBackend()
+
+
+class ShopCache:
+    """
+    Cache für Shopify-Abfragen mit Schlüsseln im Namensraum des jeweiligen Shops.
+
+    Nach Ablauf der Frische-Dauer werden Werte noch CACHE_STALE_TTL Sekunden
+    weiter ausgeliefert (stale-while-revalidate), während genau ein Worker
+    pro Schlüssel den Wert im Hintergrund neu abruft.
+    """
+
+    def __init__(self, backend=None, prefix=CACHE_KEY_PREFIX, ttls=None, stale_ttl=CACHE_STALE_TTL):
+        self._backend = backend
+        self.prefix = prefix
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+        self._refresh_executor = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = create_cache_backend()
+        return self._backend
+
+    def make_key(self, shop, name, args=(), kwargs=None):
+        """Baut den Schlüssel aus Shop, Funktionsname und einem Hash der Argumente"""
+        raw = json.dumps([list(args), sorted((kwargs or {}).items())], separators=(',', ':'), default=str)
+        digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        return f"{self.prefix}:shop:{shop}:{name}:{digest}"
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_entry(self, key):
+        """
+        Liest einen Eintrag (Cache-Fehler gelten als Miss).
+
+        Returns:
+            tuple: (Wert, Speicherzeitpunkt) oder None
+        """
+        try:
+            data = self.backend.get(key)
+        except Exception as e:
+            logger.error(f"Fehler beim Lesen aus dem Shop-Cache: {e}")
+            self._count("errors")
+            return None
+        if data is None:
+            return None
+        stored_at, value = decode_value(data)
+        return value, stored_at
+
+    def set(self, shop, key, value, timeout=CACHE_DEFAULT_TIMEOUT, stale_ttl=None):
+        """Speichert einen Wert; im Backend lebt er Frische-Dauer plus Stale-Fenster"""
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        try:
+            self.backend.set(shop, key, encode_value([time.time(), value]), timeout + stale_ttl)
+        except Exception as e:
+            logger.error(f"Fehler beim Schreiben in den Shop-Cache: {e}")
+            self._count("errors")
+
+    def _refresh(self, shop, key, lock_key, func, args, kwargs, timeout, stale_ttl):
+        try:
+            value = func(*args, **kwargs)
+            if value is not None:
+                self.set(shop, key, value, timeout, stale_ttl)
+            self._count("refreshes")
+        except Exception as e:
+            logger.error(f"Fehler bei der Hintergrund-Aktualisierung von {key}: {e}")
+            self._count("errors")
+        finally:
+            try:
+                self.backend.release_lock(lock_key)
+            except Exception as e:
+                logger.error(f"Fehler beim Freigeben der Cache-Sperre {lock_key}: {e}")
+
+    def _schedule_refresh(self, shop, key, func, args, kwargs, timeout, stale_ttl):
+        """Startet die Aktualisierung, sofern kein anderer Worker sie bereits übernommen hat"""
+        lock_key = f"{key}:refresh"
+        try:
+            if not self.backend.acquire_lock(lock_key, REFRESH_LOCK_TIMEOUT):
+                return False
+        except Exception as e:
+            logger.error(f"Fehler beim Setzen der Cache-Sperre {lock_key}: {e}")
+            return False
+
+        if self._refresh_executor is None:
+            with self._lock:
+                if self._refresh_executor is None:
+                    self._refresh_executor = ThreadPoolExecutor(
+                        max_workers=REFRESH_MAX_WORKERS, thread_name_prefix='shop-cache-refresh'
+                    )
+        self._refresh_executor.submit(self._refresh, shop, key, lock_key, func, args, kwargs, timeout, stale_ttl)
+        return True
+
+    def cached(self, name, timeout=None, stale_ttl=None):
+        """
+        Decorator für Funktionen mit der Signatur (shop, access_token, ...).
+
+        Ohne timeout gilt die Frische-Dauer aus CACHE_TTLS für diesen Abfragetyp.
+        Das Access Token fließt nicht in den Schlüssel ein; der Shop bildet den Namensraum.
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(shop, access_token, *args, **kwargs):
+                fresh_ttl = timeout if timeout is not None else self.ttls.get(name, CACHE_DEFAULT_TIMEOUT)
+                key = self.make_key(shop, name, args, kwargs)
+
+                entry = self.get_entry(key)
+                if entry is not None:
+                    value, stored_at = entry
+                    if time.time() - stored_at < fresh_ttl:
+                        self._count("hits")
+                    else:
+                        # Abgelaufen: sofort ausliefern, im Hintergrund neu laden
+                        self._count("stale_hits")
+                        self._schedule_refresh(shop, key, func, (shop, access_token) + args, kwargs,
+                                               fresh_ttl, stale_ttl)
+                    return value
+
+                self._count("misses")
+                value = func(shop, access_token, *args, **kwargs)
+                if value is not None:
+                    self.set(shop, key, value, fresh_ttl, stale_ttl)
+                return value
+            return wrapper
+        return decorator
+
+    def invalidate_shop(self, shop):
+        """Löscht alle Einträge eines Shops"""
+        try:
+            removed = self.backend.delete_shop(shop)
+            logger.info(f"{removed} Cache-Einträge für Shop {shop} gelöscht")
+            return removed
+        except Exception as e:
+            logger.error(f"Fehler beim Löschen des Caches für Shop {shop}: {e}")
+            return 0
+
+    def clear(self):
+        self.backend.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["backend"] = type(self.backend).__name__
+        return stats
+
+
+shop_cache = ShopCache()
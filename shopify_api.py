@@ -2,34 +2,66 @@ import requests
 import json
 import logging
 import time
+import threading
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import wraps
-from flask_caching import Cache
+from flask import current_app, has_app_context
 from gql import Client, gql
-from gql.transport.aiohttp import AIOHTTPTransport
+from gql.transport.requests import RequestsHTTPTransport
 from gql.transport.exceptions import TransportQueryError
 import os
 from dotenv import load_dotenv
 
+from shop_cache import shop_cache
+
 # Logger einrichten
 logger = logging.getLogger('shopify_api')
 
 # Environment-Variablen laden
 load_dotenv()
 
-# Cache-Konfiguration
-cache_config = {
-    "DEBUG": os.environ.get('DEBUG', 'False').lower() == 'true',
-    "CACHE_TYPE": "SimpleCache",  # In Produktion durch "RedisCache" ersetzen
-    "CACHE_DEFAULT_TIMEOUT": 300,  # Standard-Timeout in Sekunden (5 Minuten)
-}
-
-# Cache initialisieren (wird später im app-Kontext initialisiert)
-cache = Cache(config=cache_config)
+# Gemeinsamer Cache aller Worker (Redis über REDIS_URL, sonst prozesslokal)
+cache = shop_cache
 
 # Konstanten für API-Ratenbegrenzungen
 MAX_API_RETRIES = 3
 API_RATE_LIMIT_DELAY = 1  # Sekunden
 
+# Konstanten für wiederverwendbare Verbindungen
+SHOPIFY_API_VERSION = '2023-10'
+# Basis-URL der Admin-API; für Tests gegen einen lokalen Mock-Server überschreibbar (z.B. "http://127.0.0.1:8000")
+SHOPIFY_ADMIN_BASE_URL = os.environ.get('SHOPIFY_ADMIN_BASE_URL', 'https://{shop}')
+API_TIMEOUT = 30  # Sekunden
+CLIENT_POOL_MAX_SIZE = int(os.environ.get('SHOPIFY_CLIENT_POOL_SIZE', 100))
+CLIENT_IDLE_TIMEOUT = float(os.environ.get('SHOPIFY_CLIENT_IDLE_TIMEOUT', 300))  # Sekunden
+
+# Konstanten für die Pagination über die gesamte Historie
+PAGE_SIZE_MIN = 10
+PAGE_SIZE_TARGET_SECONDS = 2.0  # Zielgröße: eine Seite soll etwa so lange dauern
+PAGE_SIZE_LIMITS = {
+    # Obergrenzen, damit verschachtelte Verbindungen das Query-Kosten-Limit nicht sprengen
+    "orders": 100,
+    "products": 100,
+    "customers": 250,
+    "webhookSubscriptions": 100
+}
+
+# Konstanten für Bulk-Exporte
+BULK_POLL_INTERVAL = float(os.environ.get('SHOPIFY_BULK_POLL_INTERVAL', 2.0))  # Sekunden
+BULK_TIMEOUT = float(os.environ.get('SHOPIFY_BULK_TIMEOUT', 3600))  # Sekunden
+
+# Konstanten für die kostenbasierte Drosselung (Shopify GraphQL Leaky Bucket)
+THROTTLE_DEFAULT_MAXIMUM = 1000.0  # Punkte
+THROTTLE_DEFAULT_RESTORE_RATE = 50.0  # Punkte pro Sekunde
+THROTTLE_MAX_WAIT = float(os.environ.get('SHOPIFY_THROTTLE_MAX_WAIT', 60))  # Sekunden
+
+# Konstanten für parallele Abrufe
+FETCH_MAX_WORKERS = int(os.environ.get('SHOPIFY_FETCH_WORKERS', 16))
+SHOP_MAX_CONCURRENCY = int(os.environ.get('SHOPIFY_SHOP_CONCURRENCY', 4))
+
 # GraphQL-Abfragen
 PRODUCTS_QUERY = """
 query GetProducts($first: Int!, $after: String) {
@@ -91,6 +123,20 @@ query GetOrders($first: Int!, $after: String, $query: String) {
         totalPrice
         totalTax
         subtotalPrice
+        cancelledAt
+        totalRefundedSet {
+          shopMoney {
+            amount
+          }
+        }
+        refunds {
+          id
+          totalRefundedSet {
+            shopMoney {
+              amount
+            }
+          }
+        }
         financialStatus
         fulfillmentStatus
         customer {
@@ -198,6 +244,154 @@ query GetShopInfo {
 }
 """
 
+BULK_OPERATION_RUN_MUTATION = """
+mutation RunBulkQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation {
+      id
+      status
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+"""
+
+BULK_OPERATION_CANCEL_MUTATION = """
+mutation CancelBulkOperation($id: ID!) {
+  bulkOperationCancel(id: $id) {
+    bulkOperation {
+      id
+      status
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+"""
+
+CURRENT_BULK_OPERATION_QUERY = """
+query GetCurrentBulkOperation {
+  currentBulkOperation {
+    id
+    status
+    errorCode
+    objectCount
+    url
+    partialDataUrl
+  }
+}
+"""
+
+# Bulk-Abfrage für Bestellungen (ohne Pagination-Argumente, Filter wird eingesetzt)
+BULK_ORDERS_QUERY = """
+{
+  orders%s {
+    edges {
+      node {
+        id
+        createdAt
+        updatedAt
+        totalPrice
+        cancelledAt
+        totalRefundedSet {
+          shopMoney {
+            amount
+          }
+        }
+        refunds {
+          id
+          totalRefundedSet {
+            shopMoney {
+              amount
+            }
+          }
+        }
+        financialStatus
+        customer {
+          id
+        }
+        lineItems {
+          edges {
+            node {
+              id
+              quantity
+              product {
+                id
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+WEBHOOK_SUBSCRIPTIONS_QUERY = """
+query GetWebhookSubscriptions($first: Int!, $after: String) {
+  webhookSubscriptions(first: $first, after: $after) {
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+    edges {
+      node {
+        id
+        topic
+        endpoint {
+          __typename
+          ... on WebhookHttpEndpoint {
+            callbackUrl
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+WEBHOOK_SUBSCRIPTION_CREATE_MUTATION = """
+mutation webhookSubscriptionCreate($topic: WebhookSubscriptionTopic!, $callbackUrl: URL!) {
+  webhookSubscriptionCreate(
+    topic: $topic
+    webhookSubscription: {
+      callbackUrl: $callbackUrl
+      format: JSON
+    }
+  ) {
+    webhookSubscription {
+      id
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+"""
+
+WEBHOOK_SUBSCRIPTION_DELETE_MUTATION = """
+mutation webhookSubscriptionDelete($id: ID!) {
+  webhookSubscriptionDelete(id: $id) {
+    deletedWebhookSubscriptionId
+    userErrors {
+      field
+      message
+    }
+  }
+}
+"""
+
+def _is_throttled(error):
+    """Prüft, ob ein GraphQL-Fehler eine Drosselung durch Shopify meldet"""
+    error_data = getattr(error, 'errors', None)
+    return bool(error_data) and any('THROTTLED' in str(err) for err in error_data)
+
 def with_error_handling(func):
     """Dekorator für einheitliche Fehlerbehandlung der API-Funktionen"""
     @wraps(func)
@@ -210,8 +404,7 @@ def with_error_handling(func):
                 return func(*args, **kwargs)
             except TransportQueryError as e:
                 # GraphQL spezifischer Fehler
-                error_data = getattr(e, 'errors', None)
-                if error_data and any('THROTTLED' in str(err) for err in error_data):
+                if _is_throttled(e):
                     # Rate-Limit erreicht, warten und erneut versuchen
                     wait_time = API_RATE_LIMIT_DELAY * (2 ** retries)  # Exponentielles Backoff
                     logger.warning(f"Shopify API rate limit erreicht. Warte {wait_time}s vor dem nächsten Versuch.")
@@ -234,34 +427,468 @@ def with_error_handling(func):
         
     return wrapper
 
+def with_throttle_retry(func):
+    """
+    Dekorator für Mutationen: wiederholt ausschließlich bei THROTTLED.
+    
+    Eine gedrosselte Anfrage wird von Shopify vor der Ausführung abgewiesen.
+    Bei anderen Fehlern (Timeout, Verbindungsabbruch) ist offen, ob die
+    Mutation bereits ausgeführt wurde, daher wird nicht wiederholt.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = 0
+        
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except TransportQueryError as e:
+                retries += 1
+                if not _is_throttled(e) or retries >= MAX_API_RETRIES:
+                    logger.error(f"GraphQL-Fehler: {e}")
+                    raise
+                wait_time = API_RATE_LIMIT_DELAY * (2 ** (retries - 1))
+                logger.warning(f"Shopify API rate limit erreicht. Warte {wait_time}s vor dem nächsten Versuch.")
+                time.sleep(wait_time)
+            except Exception as e:
+                logger.error(f"API-Fehler: {type(e).__name__}: {e}")
+                raise
+        
+    return wrapper
+
 def init_app(app):
     """Initialisiert die Shopify-API mit der Flask-App"""
-    global cache
-    cache.init_app(app)
-    logger.info("Shopify API mit Caching initialisiert")
-
-def get_graphql_client(shop, access_token):
-    """Erstellt einen GraphQL-Client für Shopify"""
-    transport = AIOHTTPTransport(
-        url=f"https://{shop}/admin/api/2023-10/graphql.json",
-        headers={"X-Shopify-Access-Token": access_token}
-    )
-    return Client(transport=transport, fetch_schema_from_transport=False)
+    logger.info(f"Shopify API mit Caching initialisiert ({cache.get_stats()['backend']})")
+
+def admin_api_url(shop, path):
+    """Gibt die URL eines Admin-API-Endpunkts des Shops zurück"""
+    base_url = SHOPIFY_ADMIN_BASE_URL.format(shop=shop).rstrip('/')
+    return f"{base_url}/admin/api/{SHOPIFY_API_VERSION}/{path}"
+
+class ShopCostBucket:
+    """
+    Lokales Abbild des GraphQL-Kosten-Buckets eines Shops.
+    
+    Vor jeder Abfrage werden die vorhergesagten Kosten abgezogen; reicht das
+    verfügbare Guthaben nicht, wartet der Aufruf, bis der Bucket genug Punkte
+    nachgefüllt hat. Günstigere Abfragen, die bereits passen, dürfen dabei
+    vor wartenden teuren Abfragen laufen. Nach jeder Antwort wird der Stand aus
+    extensions.cost.throttleStatus übernommen.
+    """
+    
+    def __init__(self, maximum=THROTTLE_DEFAULT_MAXIMUM, restore_rate=THROTTLE_DEFAULT_RESTORE_RATE):
+        self.maximum = maximum
+        self.restore_rate = restore_rate
+        self.available = maximum
+        self.reserved = 0.0
+        self.updated = time.monotonic()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+        self._condition = threading.Condition()
+    
+    def _refill(self, now):
+        self.available = min(self.maximum, self.available + (now - self.updated) * self.restore_rate)
+        self.updated = now
+    
+    def acquire(self, cost, max_wait=THROTTLE_MAX_WAIT):
+        """Zieht die vorhergesagten Kosten ab und wartet bei Bedarf auf Nachfüllung"""
+        cost = min(cost, self.maximum)
+        started = time.monotonic()
+        waited = False
+        
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self.available >= cost or now - started >= max_wait:
+                    # Wie bei Shopify: Kosten beim Start abziehen, Differenz nach der Antwort erstatten
+                    self.available -= cost
+                    self.reserved += cost
+                    break
+                waited = True
+                self._condition.wait((cost - self.available) / self.restore_rate)
+            
+            if waited:
+                self.waits += 1
+                self.wait_seconds += time.monotonic() - started
+        return cost
+    
+    def release(self, reserved_cost, extensions=None, throttled=False):
+        """Gibt die Reservierung frei und gleicht den Bucket mit der Antwort von Shopify ab"""
+        cost_info = (extensions or {}).get("cost") or {}
+        status = cost_info.get("throttleStatus")
+        
+        with self._condition:
+            self.reserved = max(0.0, self.reserved - reserved_cost)
+            now = time.monotonic()
+            if status:
+                self.maximum = float(status.get("maximumAvailable", self.maximum))
+                self.restore_rate = float(status.get("restoreRate", self.restore_rate))
+                self.available = float(status.get("currentlyAvailable", self.available))
+                self.updated = now
+            else:
+                # Zu viel reservierte Kosten erstatten (ohne Angabe: Reservierung gilt als verbraucht)
+                self._refill(now)
+                actual_cost = cost_info.get("actualQueryCost", reserved_cost)
+                self.available = min(self.maximum, self.available + reserved_cost - actual_cost)
+            
+            if throttled:
+                self.throttled += 1
+                self.available = min(self.available, 0.0)
+            self._condition.notify_all()
+    
+    def snapshot(self):
+        with self._condition:
+            self._refill(time.monotonic())
+            return {
+                "maximum_available": self.maximum,
+                "currently_available": round(self.available, 1),
+                "restore_rate": self.restore_rate,
+                "reserved": round(self.reserved, 1),
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "throttled": self.throttled
+            }
+
+class CostThrottle:
+    """Verwaltet die Kosten-Buckets aller Shops und sagt Abfragekosten voraus"""
+    
+    def __init__(self):
+        self._buckets = {}
+        self._costs = {}  # Operationsname -> (requestedQueryCost, first)
+        self._lock = threading.Lock()
+    
+    def bucket(self, shop):
+        with self._lock:
+            bucket = self._buckets.get(shop)
+            if bucket is None:
+                bucket = ShopCostBucket()
+                self._buckets[shop] = bucket
+            return bucket
+    
+    @staticmethod
+    def _operation_key(document):
+        for definition in getattr(document, "definitions", []):
+            name = getattr(definition, "name", None)
+            if name is not None:
+                return name.value
+        return "anonymous"
+    
+    def predict_cost(self, document, variable_values=None):
+        """Schätzt die Kosten einer Abfrage anhand bisher gemessener Kosten derselben Operation"""
+        first = (variable_values or {}).get("first") or 1
+        with self._lock:
+            known = self._costs.get(self._operation_key(document))
+        if known:
+            known_cost, known_first = known
+            return max(1.0, known_cost * first / max(known_first, 1))
+        # Konservative Schätzung für unbekannte Abfragen mit verschachtelten Verbindungen
+        return 10.0 + first * 12.0
+    
+    def record_cost(self, document, variable_values, extensions):
+        cost_info = (extensions or {}).get("cost") or {}
+        requested = cost_info.get("requestedQueryCost")
+        if requested is None:
+            return
+        first = (variable_values or {}).get("first") or 1
+        with self._lock:
+            self._costs[self._operation_key(document)] = (float(requested), first)
+    
+    def metrics(self, shop=None):
+        """Gibt die aktuellen Bucket-Stände (eines oder aller Shops) zurück"""
+        with self._lock:
+            buckets = dict(self._buckets)
+        if shop is not None:
+            bucket = buckets.get(shop)
+            return bucket.snapshot() if bucket else None
+        return {name: bucket.snapshot() for name, bucket in buckets.items()}
+
+throttle = CostThrottle()
+
+def get_throttle_metrics(shop=None):
+    """Gibt die Stände der GraphQL-Kosten-Buckets zurück"""
+    return throttle.metrics(shop)
+
+class PooledShopClient:
+    """
+    Verbundener GraphQL-Client eines Shops.
+
+    Die zugrunde liegende requests-Session hält die TCP/TLS-Verbindungen
+    per Keep-Alive offen und wird auch für REST-Anfragen verwendet.
+    """
+    
+    def __init__(self, shop, access_token):
+        self.shop = shop
+        self.access_token = access_token
+        self.transport = RequestsHTTPTransport(
+            url=admin_api_url(shop, "graphql.json"),
+            headers={"X-Shopify-Access-Token": access_token},
+            timeout=API_TIMEOUT
+        )
+        self.client = Client(transport=self.transport, fetch_schema_from_transport=False)
+        self.session = self.client.connect_sync()
+        self.last_used = time.monotonic()
+        self.active = 0
+        self._lock = threading.Lock()
+    
+    def _acquire(self):
+        with self._lock:
+            self.active += 1
+            self.last_used = time.monotonic()
+    
+    def _release(self):
+        with self._lock:
+            self.active -= 1
+            self.last_used = time.monotonic()
+    
+    def execute(self, document, variable_values=None, **kwargs):
+        """Führt eine GraphQL-Abfrage kostengedrosselt über die bestehende Verbindung aus"""
+        bucket = throttle.bucket(self.shop)
+        reserved = bucket.acquire(throttle.predict_cost(document, variable_values))
+        
+        self._acquire()
+        try:
+            result = self.session.execute(document, variable_values=variable_values,
+                                          get_execution_result=True, **kwargs)
+        except TransportQueryError as e:
+            bucket.release(reserved, getattr(e, 'extensions', None), throttled='THROTTLED' in str(e))
+            raise
+        except Exception:
+            bucket.release(reserved)
+            raise
+        finally:
+            self._release()
+        
+        bucket.release(reserved, result.extensions)
+        throttle.record_cost(document, variable_values, result.extensions)
+        return result.data
+    
+    def request(self, method, url, **kwargs):
+        """Führt eine REST-Anfrage über dieselbe Keep-Alive-Session aus"""
+        headers = {
+            "X-Shopify-Access-Token": self.access_token,
+            "Content-Type": "application/json"
+        }
+        headers.update(kwargs.pop('headers', {}))
+        kwargs.setdefault('timeout', API_TIMEOUT)
+        
+        self._acquire()
+        try:
+            return self.transport.session.request(method, url, headers=headers, **kwargs)
+        finally:
+            self._release()
+    
+    def is_idle(self, now, idle_timeout):
+        return self.active == 0 and now - self.last_used >= idle_timeout
+    
+    def close(self):
+        try:
+            self.client.close_sync()
+        except Exception as e:
+            logger.debug(f"Fehler beim Schließen des Clients für {self.shop}: {e}")
+
+class ShopifyClientPool:
+    """Begrenzter LRU-Pool verbundener Clients pro Shop mit Verdrängung inaktiver Einträge"""
+    
+    def __init__(self, max_size=CLIENT_POOL_MAX_SIZE, idle_timeout=CLIENT_IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, shop, access_token):
+        """
+        Gibt den Client des Shops zurück und legt ihn bei Bedarf an.
+        
+        Der Client ist nicht ausgeliehen und kann jederzeit verdrängt werden;
+        Abfragen laufen daher immer über lease().
+        """
+        return self._checkout(shop, access_token, acquire=False)
+    
+    @contextmanager
+    def lease(self, shop, access_token):
+        """
+        Leiht den Client des Shops für die Dauer des with-Blocks aus.
+        
+        Der Client wird noch unter der Pool-Sperre als aktiv markiert und kann
+        daher nicht verdrängt und geschlossen werden, bevor der Block endet.
+        """
+        pooled = self._checkout(shop, access_token, acquire=True)
+        try:
+            yield pooled
+        finally:
+            pooled._release()
+    
+    def _checkout(self, shop, access_token, acquire):
+        key = (shop, access_token)
+        with self._lock:
+            pooled = self._clients.get(key)
+            if pooled is not None:
+                self._clients.move_to_end(key)
+                self._mark_used(pooled, acquire)
+                return pooled
+        
+        # Verbindungsaufbau außerhalb der Sperre
+        pooled = PooledShopClient(shop, access_token)
+        
+        evicted = []
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing is not None:
+                evicted.append(pooled)
+                pooled = existing
+            else:
+                self._clients[key] = pooled
+            self._clients.move_to_end(key)
+            # Vor der Verdrängung markieren, damit der eigene Client nicht geschlossen wird
+            self._mark_used(pooled, acquire)
+            evicted.extend(self._collect_evictions(keep=key))
+        
+        for client in evicted:
+            client.close()
+        return pooled
+    
+    @staticmethod
+    def _mark_used(pooled, acquire):
+        """Markiert einen Client als benutzt bzw. aktiv (Aufruf unter Pool-Sperre)"""
+        if acquire:
+            pooled._acquire()
+        else:
+            with pooled._lock:
+                pooled.last_used = time.monotonic()
+    
+    def _collect_evictions(self, keep=None):
+        """Entfernt inaktive und überzählige Clients außer dem gerade ausgegebenen (Aufruf unter Sperre)"""
+        now = time.monotonic()
+        evicted = []
+        
+        for key, client in list(self._clients.items()):
+            if client.is_idle(now, self.idle_timeout):
+                evicted.append(self._clients.pop(key))
+        
+        # Älteste unbenutzte Einträge verdrängen, solange der Pool zu groß ist
+        for key, client in list(self._clients.items()):
+            if len(self._clients) <= self.max_size:
+                break
+            if client.active == 0 and key != keep:
+                evicted.append(self._clients.pop(key))
+        
+        return evicted
+    
+    def evict_shop(self, shop):
+        """Schließt alle Clients eines Shops (z.B. nach Deinstallation oder Token-Wechsel)"""
+        with self._lock:
+            keys = [key for key in self._clients if key[0] == shop]
+            evicted = [self._clients.pop(key) for key in keys]
+        for client in evicted:
+            client.close()
+    
+    def close_all(self):
+        with self._lock:
+            evicted = list(self._clients.values())
+            self._clients.clear()
+        for client in evicted:
+            client.close()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._clients),
+                "max_size": self.max_size,
+                "active": sum(client.active for client in self._clients.values())
+            }
+
+client_pool = ShopifyClientPool()
+
+class _InFlightCall:
+    """Ein laufender Upstream-Aufruf, auf dessen Ergebnis weitere Aufrufer warten"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Bündelt gleichzeitige identische Abfragen innerhalb des Prozesses.
+    
+    Der erste Aufrufer führt die Abfrage aus, alle weiteren mit demselben
+    Schlüssel warten und erhalten dasselbe Ergebnis (oder dieselbe Ausnahme).
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {}
+    
+    def do(self, shop, key, func, *args, **kwargs):
+        with self._lock:
+            stats = self._stats.setdefault(shop, {"executed": 0, "coalesced": 0})
+            call = self._calls.get(key)
+            if call is not None:
+                stats["coalesced"] += 1
+                leader = False
+            else:
+                call = _InFlightCall()
+                self._calls[key] = call
+                stats["executed"] += 1
+                leader = True
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+    
+    def metrics(self, shop=None):
+        with self._lock:
+            if shop is not None:
+                return dict(self._stats.get(shop, {"executed": 0, "coalesced": 0}))
+            return {name: dict(values) for name, values in self._stats.items()}
+
+single_flight = SingleFlight()
+
+def coalesce(name):
+    """Decorator: gleichzeitige Aufrufe mit gleichem Shop, gleicher Abfrage und gleichen Variablen teilen sich einen Request"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(shop, access_token, *args, **kwargs):
+            key = (shop, name, json.dumps([args, sorted(kwargs.items())], default=str))
+            return single_flight.do(shop, key, func, shop, access_token, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def get_coalescing_metrics(shop=None):
+    """Gibt zurück, wie viele Aufrufe ausgeführt bzw. mit einem laufenden Aufruf gebündelt wurden"""
+    return single_flight.metrics(shop)
 
 @with_error_handling
-@cache.memoize(timeout=300)  # 5 Minuten Cache
+@cache.cached('shop_info')  # Frische-Dauer aus shop_cache.CACHE_TTLS
+@coalesce('shop_info')
 def get_shop_info(shop, access_token):
     """Ruft Informationen über den Shop ab"""
-    client = get_graphql_client(shop, access_token)
     query = gql(SHOP_INFO_QUERY)
-    result = client.execute(query)
+    with client_pool.lease(shop, access_token) as client:
+        result = client.execute(query)
     return result['shop']
 
 @with_error_handling
-@cache.memoize(timeout=300)  # 5 Minuten Cache
+@cache.cached('products')  # Frische-Dauer aus shop_cache.CACHE_TTLS
+@coalesce('products')
 def get_products(shop, access_token, limit=50, cursor=None):
     """Ruft Produkte aus dem Shop ab mit Pagination"""
-    client = get_graphql_client(shop, access_token)
     query = gql(PRODUCTS_QUERY)
     
     variables = {
@@ -271,14 +898,15 @@ def get_products(shop, access_token, limit=50, cursor=None):
     if cursor:
         variables["after"] = cursor
         
-    result = client.execute(query, variable_values=variables)
+    with client_pool.lease(shop, access_token) as client:
+        result = client.execute(query, variable_values=variables)
     return result["products"]
 
 @with_error_handling
-@cache.memoize(timeout=300)  # 5 Minuten Cache
+@cache.cached('orders')  # Frische-Dauer aus shop_cache.CACHE_TTLS
+@coalesce('orders')
 def get_orders(shop, access_token, limit=50, cursor=None, date_range=None):
     """Ruft Bestellungen aus dem Shop ab mit Pagination und optionalem Datumsfilter"""
-    client = get_graphql_client(shop, access_token)
     query = gql(ORDERS_QUERY)
     
     variables = {
@@ -292,14 +920,15 @@ def get_orders(shop, access_token, limit=50, cursor=None, date_range=None):
     if date_range:
         variables["query"] = date_range
         
-    result = client.execute(query, variable_values=variables)
+    with client_pool.lease(shop, access_token) as client:
+        result = client.execute(query, variable_values=variables)
     return result["orders"]
 
 @with_error_handling
-@cache.memoize(timeout=300)  # 5 Minuten Cache
+@cache.cached('customers')  # Frische-Dauer aus shop_cache.CACHE_TTLS
+@coalesce('customers')
 def get_customers(shop, access_token, limit=50, cursor=None, search_query=None):
     """Ruft Kunden aus dem Shop ab mit Pagination und optionaler Suche"""
-    client = get_graphql_client(shop, access_token)
     query = gql(CUSTOMERS_QUERY)
     
     variables = {
@@ -312,38 +941,283 @@ def get_customers(shop, access_token, limit=50, cursor=None, search_query=None):
     if search_query:
         variables["query"] = search_query
         
-    result = client.execute(query, variable_values=variables)
+    with client_pool.lease(shop, access_token) as client:
+        result = client.execute(query, variable_values=variables)
     return result["customers"]
 
+@with_error_handling
+def _fetch_page(client, document, variables):
+    """Ruft eine einzelne Seite einer Verbindung ab (ohne Cache)"""
+    return client.execute(document, variable_values=variables)
+
+@with_throttle_retry
+def _run_mutation(client, document, variables):
+    """Führt eine Mutation aus (ohne Wiederholung außer bei Drosselung)"""
+    return client.execute(document, variable_values=variables)
+
+def _iter_connection(shop, access_token, query_string, root_field, variables=None, page_size=50):
+    """
+    Folgt pageInfo.endCursor über alle Seiten einer Verbindung und liefert die Edges einzeln.
+    
+    Die Seitengröße passt sich an: schnelle Seiten vergrößern sie bis zur
+    Obergrenze der Verbindung, langsame oder zu teure Seiten verkleinern sie.
+    Es wird immer nur eine Seite im Speicher gehalten.
+    """
+    document = gql(query_string)
+    max_size = PAGE_SIZE_LIMITS.get(root_field, 50)
+    size = max(PAGE_SIZE_MIN, min(page_size, max_size))
+    cursor = None
+    
+    while True:
+        page_variables = dict(variables or {}, first=size)
+        if cursor:
+            page_variables["after"] = cursor
+        
+        started = time.monotonic()
+        try:
+            # Client nur für die Dauer einer Seite ausleihen, nicht über die Verarbeitung hinweg
+            with client_pool.lease(shop, access_token) as client:
+                result = _fetch_page(client, document, page_variables)
+        except TransportQueryError as e:
+            # Zu teure Abfrage: mit kleinerer Seite erneut versuchen
+            if 'MAX_COST_EXCEEDED' in str(e) and size > PAGE_SIZE_MIN:
+                size = max(PAGE_SIZE_MIN, size // 2)
+                logger.warning(f"Abfragekosten zu hoch für {root_field}, reduziere Seitengröße auf {size}")
+                continue
+            raise
+        elapsed = time.monotonic() - started
+        
+        connection = result[root_field]
+        for edge in connection.get("edges", []):
+            yield edge
+        
+        page_info = connection.get("pageInfo", {})
+        if not page_info.get("hasNextPage") or not page_info.get("endCursor"):
+            return
+        cursor = page_info["endCursor"]
+        
+        # Seitengröße anhand der Antwortzeit anpassen
+        if elapsed < PAGE_SIZE_TARGET_SECONDS / 2:
+            size = min(max_size, size * 2)
+        elif elapsed > PAGE_SIZE_TARGET_SECONDS:
+            size = max(PAGE_SIZE_MIN, size // 2)
+
+def iter_orders(shop, access_token, query=None, page_size=50):
+    """Liefert alle Bestellungen (optional gefiltert) als Stream von Edges"""
+    variables = {"query": query} if query else None
+    return _iter_connection(shop, access_token, ORDERS_QUERY, "orders", variables, page_size)
+
+def iter_products(shop, access_token, page_size=50):
+    """Liefert alle Produkte als Stream von Edges"""
+    return _iter_connection(shop, access_token, PRODUCTS_QUERY, "products", None, page_size)
+
+def iter_customers(shop, access_token, search_query=None, page_size=100):
+    """Liefert alle Kunden (optional gefiltert) als Stream von Edges"""
+    variables = {"query": search_query} if search_query else None
+    return _iter_connection(shop, access_token, CUSTOMERS_QUERY, "customers", variables, page_size)
+
+def iter_webhook_subscriptions(shop, access_token):
+    """Liefert alle Webhook-Abonnements des Shops als Stream von Edges"""
+    return _iter_connection(shop, access_token, WEBHOOK_SUBSCRIPTIONS_QUERY, "webhookSubscriptions", None, 100)
+
+def execute_mutation(shop, access_token, mutation, variables, root_field):
+    """
+    Führt eine Mutation über den gepoolten Client aus.
+    
+    Raises:
+        ValueError: Wenn Shopify userErrors zurückgibt
+    """
+    with client_pool.lease(shop, access_token) as client:
+        result = _run_mutation(client, gql(mutation), variables)
+    payload = result[root_field]
+    
+    if payload.get("userErrors"):
+        messages = "; ".join(error.get("message", "") for error in payload["userErrors"])
+        raise ValueError(f"{root_field} fehlgeschlagen: {messages}")
+    return payload
+
+def start_bulk_export(shop, access_token, bulk_query):
+    """Startet eine Bulk-Operation und gibt ihre ID zurück"""
+    with client_pool.lease(shop, access_token) as client:
+        result = _run_mutation(client, gql(BULK_OPERATION_RUN_MUTATION), {"query": bulk_query})
+    payload = result["bulkOperationRunQuery"]
+    
+    if payload.get("userErrors"):
+        messages = "; ".join(error.get("message", "") for error in payload["userErrors"])
+        raise ValueError(f"Bulk-Operation konnte nicht gestartet werden: {messages}")
+    
+    operation = payload["bulkOperation"]
+    logger.info(f"Bulk-Operation {operation['id']} für {shop} gestartet ({operation['status']})")
+    return operation["id"]
+
+def wait_for_bulk_operation(shop, access_token, operation_id=None,
+                            poll_interval=BULK_POLL_INTERVAL, timeout=BULK_TIMEOUT):
+    """
+    Fragt den Status der laufenden Bulk-Operation ab, bis sie abgeschlossen ist.
+    
+    Returns:
+        dict: Die abgeschlossene Operation inkl. 'url' der JSONL-Ergebnisdatei
+    """
+    query = gql(CURRENT_BULK_OPERATION_QUERY)
+    deadline = time.monotonic() + timeout
+    
+    while True:
+        with client_pool.lease(shop, access_token) as client:
+            operation = _fetch_page(client, query, None)["currentBulkOperation"]
+        if operation is None:
+            raise ValueError(f"Keine Bulk-Operation für {shop} gefunden")
+        if operation_id and operation["id"] != operation_id:
+            raise ValueError(f"Bulk-Operation {operation_id} wurde durch {operation['id']} ersetzt")
+        
+        status = operation["status"]
+        if status == "COMPLETED":
+            logger.info(f"Bulk-Operation {operation['id']} abgeschlossen: {operation.get('objectCount')} Objekte")
+            return operation
+        if status in ("FAILED", "CANCELED", "EXPIRED"):
+            raise ValueError(f"Bulk-Operation {operation['id']} beendet mit Status {status} "
+                             f"({operation.get('errorCode')})")
+        
+        if time.monotonic() >= deadline:
+            # Abbrechen, damit die Operation den einzigen Bulk-Slot des Shops nicht weiter belegt
+            cancel_bulk_operation(shop, access_token, operation['id'])
+            raise TimeoutError(f"Bulk-Operation {operation['id']} nach {timeout}s nicht abgeschlossen")
+        time.sleep(poll_interval)
+
+def cancel_bulk_operation(shop, access_token, operation_id):
+    """Bricht eine laufende Bulk-Operation ab (Fehler werden nur protokolliert)"""
+    try:
+        execute_mutation(shop, access_token, BULK_OPERATION_CANCEL_MUTATION, {"id": operation_id},
+                         "bulkOperationCancel")
+        logger.info(f"Bulk-Operation {operation_id} für {shop} abgebrochen")
+    except Exception as e:
+        logger.error(f"Fehler beim Abbrechen der Bulk-Operation {operation_id}: {e}")
+
+def iter_bulk_results(url, chunk_size=64 * 1024):
+    """Liest die JSONL-Ergebnisdatei einer Bulk-Operation zeilenweise als Stream"""
+    if not url:
+        return
+    
+    with requests.get(url, stream=True, timeout=API_TIMEOUT) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(chunk_size=chunk_size):
+            if line:
+                yield json.loads(line)
+
+def run_bulk_export(shop, access_token, bulk_query, poll_interval=BULK_POLL_INTERVAL, timeout=BULK_TIMEOUT):
+    """Startet eine Bulk-Operation, wartet auf das Ergebnis und liefert die Datensätze als Stream"""
+    operation_id = start_bulk_export(shop, access_token, bulk_query)
+    operation = wait_for_bulk_operation(shop, access_token, operation_id, poll_interval, timeout)
+    return iter_bulk_results(operation.get("url"))
+
+def export_orders_to_metrics(shop, access_token, query=None, backend=None, store=None,
+                             poll_interval=BULK_POLL_INTERVAL, timeout=BULK_TIMEOUT):
+    """
+    Exportiert Bestellungen per Bulk-Operation und übernimmt sie wie Webhooks über order_sync.
+    
+    Untergeordnete Zeilen (Line Items mit __parentId) werden übersprungen und die
+    Bestellungen blockweise als Beiträge verbucht; geschrieben werden nur die Tage,
+    deren Summen sich dadurch ändern. So bleibt die von sync_orders gepflegte
+    Reihe konsistent und höchstens ein Block liegt im Speicher.
+    
+    Returns:
+        int: Anzahl übernommener Bestellungen
+    """
+    import order_sync  # order_sync importiert shopify_api
+    
+    filter_args = f'(query: {json.dumps(query)})' if query else ''
+    records = run_bulk_export(shop, access_token, BULK_ORDERS_QUERY % filter_args, poll_interval, timeout)
+    
+    nodes = (
+        record for record in records
+        if "__parentId" not in record and "/Order/" in record.get("id", "")
+    )
+    count = 0
+    while True:
+        batch = list(itertools.islice(nodes, order_sync.SYNC_BATCH_SIZE))
+        if not batch:
+            break
+        order_sync.apply_order_nodes(shop, batch, backend=backend, store=store)
+        count += len(batch)
+    
+    logger.info(f"{count} Bestellungen für {shop} per Bulk-Export übernommen")
+    return count
+
+_fetch_executor = ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS, thread_name_prefix='shopify-fetch')
+_shop_semaphores = {}
+_shop_semaphores_lock = threading.Lock()
+
+def _shop_semaphore(shop):
+    """Gibt die Semaphore zurück, die gleichzeitige Anfragen pro Shop begrenzt"""
+    with _shop_semaphores_lock:
+        semaphore = _shop_semaphores.get(shop)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(SHOP_MAX_CONCURRENCY)
+            _shop_semaphores[shop] = semaphore
+        return semaphore
+
+def _run_for_shop(app, shop, func, args, kwargs):
+    """Führt einen API-Aufruf im Worker-Thread aus (mit App-Kontext für den Cache)"""
+    with _shop_semaphore(shop):
+        if app is None:
+            return func(*args, **kwargs)
+        with app.app_context():
+            return func(*args, **kwargs)
+
+def fetch_shop_bundle(shop, access_token, limit=25, include=("shop_info", "products", "orders", "customers")):
+    """
+    Ruft Shop-Informationen, Produkte, Bestellungen und Kunden parallel ab.
+    
+    Die Latenz entspricht damit dem langsamsten statt der Summe aller Aufrufe.
+    Fehlgeschlagene Teilabrufe werden unter 'errors' gemeldet, die übrigen
+    Ergebnisse bleiben nutzbar.
+    
+    Returns:
+        dict: {"shop_info": ..., "products": ..., "orders": ..., "customers": ..., "errors": {...}}
+    """
+    calls = {
+        "shop_info": (get_shop_info, (shop, access_token), {}),
+        "products": (get_products, (shop, access_token), {"limit": limit}),
+        "orders": (get_orders, (shop, access_token), {"limit": limit}),
+        "customers": (get_customers, (shop, access_token), {"limit": limit})
+    }
+    app = current_app._get_current_object() if has_app_context() else None
+    
+    futures = {
+        name: _fetch_executor.submit(_run_for_shop, app, shop, func, args, kwargs)
+        for name, (func, args, kwargs) in calls.items() if name in include
+    }
+    
+    bundle = {"errors": {}}
+    for name, future in futures.items():
+        try:
+            bundle[name] = future.result()
+        except Exception as e:
+            logger.error(f"Fehler beim parallelen Abruf von {name} für {shop}: {e}")
+            bundle[name] = None if name == "shop_info" else {}
+            bundle["errors"][name] = str(e)
+    
+    return bundle
+
 def clear_cache_for_shop(shop_domain):
-    """Löscht den Cache für einen bestimmten Shop"""
-    # Im SimpleCache ist das direktes Löschen nach Schlüssel nicht einfach möglich
-    # In der Produktionsumgebung mit Redis wäre das einfacher
-    logger.info(f"Cache für Shop {shop_domain} wird gelöscht")
-    cache.clear()  # Löscht den gesamten Cache - in Produktion spezifischer implementieren
+    """Löscht den Cache für einen bestimmten Shop (nur dessen Schlüssel)"""
+    return cache.invalidate_shop(shop_domain)
 
 def make_rest_api_request(shop, access_token, endpoint, method="GET", data=None):
     """
     Führt eine REST-API-Anfrage an Shopify aus (für Funktionen, die nicht über GraphQL verfügbar sind)
     """
-    url = f"https://{shop}/admin/api/2023-10/{endpoint}"
-    headers = {
-        "X-Shopify-Access-Token": access_token,
-        "Content-Type": "application/json"
-    }
+    url = admin_api_url(shop, endpoint)
+    
+    if method not in ("GET", "POST", "PUT", "DELETE"):
+        raise ValueError(f"Ungültige HTTP-Methode: {method}")
     
     for attempt in range(MAX_API_RETRIES):
         try:
-            if method == "GET":
-                response = requests.get(url, headers=headers)
-            elif method == "POST":
-                response = requests.post(url, headers=headers, json=data)
-            elif method == "PUT":
-                response = requests.put(url, headers=headers, json=data)
-            elif method == "DELETE":
-                response = requests.delete(url, headers=headers)
-            else:
-                raise ValueError(f"Ungültige HTTP-Methode: {method}")
+            with client_pool.lease(shop, access_token) as client:
+                if method in ("POST", "PUT"):
+                    response = client.request(method, url, json=data)
+                else:
+                    response = client.request(method, url)
                 
             response.raise_for_status()
             return response.json()
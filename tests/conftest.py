@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Module lesen DATA_DIR beim Import; Tests schreiben nie in das echte Datenverzeichnis
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='mini_flask_env-tests-'))
+os.environ.setdefault('METRICS_BACKEND', 'sqlite')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,127 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import order_sync
+import shopify_api
+from metrics_store import SQLiteMetricsBackend
+
+SHOP = 'bulk.myshopify.com'
+OPERATION_ID = 'gid://shopify/BulkOperation/1'
+
+
+def order_line(number, price, day, cancelled=False):
+    return {
+        'id': f"gid://shopify/Order/{number}",
+        'createdAt': f"{day}T10:00:00Z",
+        'updatedAt': f"{day}T12:00:00Z",
+        'cancelledAt': f"{day}T13:00:00Z" if cancelled else None,
+        'totalPrice': str(price),
+        'totalRefundedSet': {'shopMoney': {'amount': '0.0'}},
+    }
+
+
+class MockShopify(BaseHTTPRequestHandler):
+    """Beantwortet die GraphQL-Aufrufe des Bulk-Exports und liefert die JSONL-Ergebnisdatei aus"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        query = body['query']
+        self.server.calls.append(query)
+        if 'bulkOperationRunQuery' in query and self.server.failures:
+            failure = self.server.failures.pop(0)
+            if failure == 'THROTTLED':
+                payload = {'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}]}
+                return self._send('application/json', json.dumps(payload).encode())
+            return self._send('text/plain', b'gateway timeout', status=504)
+        if 'bulkOperationRunQuery' in query:
+            data = {'bulkOperationRunQuery': {'bulkOperation': {'id': OPERATION_ID, 'status': 'CREATED'},
+                                              'userErrors': []}}
+        elif 'bulkOperationCancel' in query:
+            data = {'bulkOperationCancel': {'bulkOperation': {'id': OPERATION_ID, 'status': 'CANCELING'},
+                                            'userErrors': []}}
+        else:
+            data = {'currentBulkOperation': {
+                'id': OPERATION_ID, 'status': self.server.status, 'errorCode': None, 'objectCount': '3',
+                'url': f"http://127.0.0.1:{self.server.server_port}/orders.jsonl", 'partialDataUrl': None}}
+        self._send('application/json', json.dumps({'data': data}).encode())
+
+    def do_GET(self):
+        self._send('application/jsonl', ''.join(json.dumps(line) + '\n' for line in self.server.lines).encode())
+
+    def _send(self, content_type, payload, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), MockShopify)
+    httpd.calls, httpd.status, httpd.lines, httpd.failures = [], 'COMPLETED', [], []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(shopify_api, 'API_RATE_LIMIT_DELAY', 0)
+    monkeypatch.setattr(shopify_api, 'SHOPIFY_ADMIN_BASE_URL', f"http://127.0.0.1:{httpd.server_port}")
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    shopify_api.client_pool.evict_shop(SHOP)
+
+
+def test_export_books_orders_through_order_sync(server, tmp_path):
+    day = '2026-10-01'
+    server.lines = [
+        order_line(1, 30, day),
+        {'id': 'gid://shopify/LineItem/9', 'quantity': 1, '__parentId': 'gid://shopify/Order/1'},
+        order_line(2, 20, day),
+        order_line(3, 50, day, cancelled=True),
+    ]
+    backend = SQLiteMetricsBackend(str(tmp_path / 'metrics.db'))
+    store = order_sync.OrderSyncStore(str(tmp_path / 'order_sync.db'))
+    store.save_state(SHOP, None, '2026-09-01')
+    backend.save_series(SHOP, 'daily_revenue', {'2026-09-30': 7.0})
+
+    assert shopify_api.export_orders_to_metrics(SHOP, 'token', backend=backend, store=store,
+                                                poll_interval=0) == 3
+    # Wiederholter Export derselben Bestellungen zählt nichts doppelt
+    shopify_api.export_orders_to_metrics(SHOP, 'token', backend=backend, store=store, poll_interval=0)
+
+    revenue = backend.load_series(SHOP, 'daily_revenue')
+    assert revenue[day] == 50.0
+    assert backend.load_series(SHOP, 'daily_orders')[day] == 2
+    # Andere Tage der Reihe bleiben unverändert
+    assert revenue['2026-09-30'] == 7.0
+
+
+def test_wait_cancels_operation_on_timeout(server):
+    server.status = 'RUNNING'
+    with pytest.raises(TimeoutError):
+        shopify_api.wait_for_bulk_operation(SHOP, 'token', OPERATION_ID, poll_interval=0, timeout=0)
+    assert any('bulkOperationCancel' in query for query in server.calls)
+
+
+def mutation_calls(server):
+    return sum('bulkOperationRunQuery' in query for query in server.calls)
+
+
+def test_mutation_is_not_retried_on_generic_error(server):
+    server.failures = ['timeout']
+    with pytest.raises(Exception):
+        shopify_api.start_bulk_export(SHOP, 'token', '{ orders { edges { node { id } } } }')
+    # Ob Shopify die Mutation ausgeführt hat, ist offen: kein zweiter Versuch
+    assert mutation_calls(server) == 1
+
+
+def test_mutation_is_retried_when_throttled(server):
+    server.failures = ['THROTTLED']
+    operation_id = shopify_api.start_bulk_export(SHOP, 'token', '{ orders { edges { node { id } } } }')
+    assert operation_id == OPERATION_ID
+    assert mutation_calls(server) == 2
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+import shopify_api
+
+
+class FakeClient:
+    def __init__(self, shop, access_token):
+        self.shop = shop
+        self.access_token = access_token
+        self.last_used = time.monotonic()
+        self.active = 0
+        self.closed = False
+        self._lock = shopify_api.threading.Lock()
+
+    _acquire = shopify_api.PooledShopClient._acquire
+    _release = shopify_api.PooledShopClient._release
+    is_idle = shopify_api.PooledShopClient.is_idle
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(shopify_api, 'PooledShopClient', FakeClient)
+    return shopify_api.ShopifyClientPool(max_size=1, idle_timeout=60)
+
+
+def test_leased_client_is_not_evicted(pool):
+    with pool.lease('a.myshopify.com', 'token') as client:
+        assert client.active == 1
+        # Ein zweiter Shop überschreitet die Poolgröße, der ausgeliehene Client bleibt offen
+        other = pool.get('b.myshopify.com', 'token')
+        assert not client.closed
+        assert pool.stats()['size'] == 2
+    assert client.active == 0
+
+    # Nach der Rückgabe darf der älteste unbenutzte Client verdrängt werden
+    pool.get('c.myshopify.com', 'token')
+    assert client.closed and other.closed
+
+
+def test_get_refreshes_last_used(pool):
+    client = pool.get('a.myshopify.com', 'token')
+    client.last_used -= 120
+    assert pool.get('a.myshopify.com', 'token') is client
+    assert not client.is_idle(time.monotonic(), pool.idle_timeout)
+
+
+def test_lease_releases_on_error(pool):
+    with pytest.raises(RuntimeError):
+        with pool.lease('a.myshopify.com', 'token') as client:
+            raise RuntimeError('Upstream-Fehler')
+    assert client.active == 0
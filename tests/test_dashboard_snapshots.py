@@ -0,0 +1,34 @@
+import sys
+
+import dashboard_snapshots
+from data_models import ShopMetrics, get_metrics_backend
+
+
+def test_snapshots_keep_quick_tips_between_refreshes():
+    shop = 'tips.myshopify.com'
+    tips = [{"title": "Versandkosten", "text": "Ab 50 € kostenlos versenden."}]
+
+    snapshots = dashboard_snapshots.build_snapshots(shop, ShopMetrics(shop), periods=(7,), quick_tips=tips)
+    assert snapshots[7]["ai_quick_tips"] == tips
+
+    # Neuaufbau ohne Shopify-Abruf (z.B. nach einem Webhook) übernimmt die gespeicherten Tipps
+    rebuilt = dashboard_snapshots.build_snapshots(shop, ShopMetrics(shop), periods=(7,))
+    assert rebuilt[7]["ai_quick_tips"] == tips
+    assert get_metrics_backend().load_artifact(shop, 'dashboard_snapshot_7')["ai_quick_tips"] == tips
+
+
+def test_quick_tips_fall_back_without_growth_advisor(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'growth_advisor', None)
+    shop = 'no-tips.myshopify.com'
+    assert dashboard_snapshots.build_quick_tips(ShopMetrics(shop), {"products": [], "customers": []}) is None
+
+
+def test_missing_snapshot_is_built_in_background(monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(dashboard_snapshots, 'schedule_refresh',
+                        lambda shop, access_token=None: scheduled.append((shop, access_token)))
+
+    snapshot = dashboard_snapshots.get_snapshot('new-shop.myshopify.com', 30, 'token')
+
+    assert snapshot['pending'] and snapshot['total_orders'] == 0 and snapshot['sales_data'] == []
+    assert scheduled == [('new-shop.myshopify.com', 'token')]
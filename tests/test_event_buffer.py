@@ -0,0 +1,76 @@
+from event_buffer import EventBuffer
+
+
+class FlakyWriter:
+    def __init__(self):
+        self.failing = set()
+        self.written = []
+
+    def __call__(self, events):
+        if events[0][0] in self.failing:
+            raise OSError("disk full")
+        self.written.extend(events)
+
+
+def make_buffer(writer, **kwargs):
+    buffer = EventBuffer(writer, **kwargs)
+    # Kein Flush-Thread im Test, geschrieben wird nur über flush()
+    buffer._ensure_worker = lambda: None
+    return buffer
+
+
+def test_failed_events_are_requeued_and_written_later():
+    writer = FlakyWriter()
+    buffer = make_buffer(writer)
+    writer.failing.add('a')
+    buffer.add('a', 'pageviews', {'n': 1})
+    buffer.add('b', 'pageviews', {'n': 2})
+
+    assert buffer.flush() == 1
+    assert buffer.get_stats('a')['pending'] == 1
+    assert buffer.get_stats('a')['failed'] == 1
+
+    buffer.add('a', 'pageviews', {'n': 3})
+    writer.failing.clear()
+    assert buffer.flush() == 2
+    # Reihenfolge bleibt erhalten: zurückgelegte Ereignisse vor neuen
+    assert [data['n'] for _, _, data in writer.written] == [2, 1, 3]
+    assert buffer.get_stats('a')['pending'] == 0
+
+
+def test_requeue_drops_oldest_events_beyond_capacity():
+    writer = FlakyWriter()
+    buffer = make_buffer(writer, max_events=3)
+    writer.failing.add('a')
+    for n in range(3):
+        buffer.add('a', 'pageviews', {'n': n})
+    buffer.flush()
+
+    # Während des Schreibfehlers ist der Puffer voll, neue Ereignisse werden abgewiesen
+    assert not buffer.add('a', 'pageviews', {'n': 3})
+    writer.failing.clear()
+    buffer.flush()
+    assert [data['n'] for _, _, data in writer.written] == [0, 1, 2]
+
+
+def test_overflow_after_failed_flush_is_counted_as_dropped():
+    writer = FlakyWriter()
+    buffer = make_buffer(writer, max_events=3)
+    writer.failing.add('a')
+    buffer.add('a', 'pageviews', {'n': 0})
+    buffer.add('a', 'pageviews', {'n': 1})
+
+    # Ein während des Flushs angenommenes Ereignis simulieren
+    original = buffer.writer
+
+    def writer_with_concurrent_add(events):
+        buffer._events.extend([('b', 'pageviews', {'n': 2}), ('b', 'pageviews', {'n': 3})])
+        buffer._pending['b'] += 2
+        original(events)
+
+    buffer.writer = writer_with_concurrent_add
+    buffer.flush()
+
+    assert [data['n'] for _, _, data in buffer._events] == [1, 2, 3]
+    assert buffer.get_stats('a')['dropped'] == 1
+    assert buffer.get_stats('a')['pending'] == 1
@@ -0,0 +1,137 @@
+import os
+import json
+import datetime
+
+import pytest
+
+import data_models
+from event_store import ShopEventLog, JOURNAL_FILE, _segment_name
+
+NOW = datetime.datetime(2026, 10, 18, 12, 0, 0)
+
+
+def event(days_ago, page='home'):
+    timestamp = (NOW - datetime.timedelta(days=days_ago)).isoformat()
+    return 'pageviews', {'page': page, 'timestamp': timestamp}
+
+
+@pytest.fixture
+def log(tmp_path):
+    # Kleine Segmente, damit jedes Append-Paket ein eigenes Segment abschließt
+    return ShopEventLog(str(tmp_path / 'shop'), segment_max_bytes=100, retention_days=30)
+
+
+def test_append_rolls_segments_and_reads_in_order(log):
+    for i in range(6):
+        log.append([event(0, f"p{i}"), event(0, f"p{i}")])
+
+    assert len(log.segments()) == 6
+    pages = [data['page'] for _, data in log.iter_events('pageviews')]
+    assert pages == [f"p{i}" for i in range(6) for _ in range(2)]
+    assert list(log.iter_events('clicks')) == []
+
+
+def test_iter_events_skips_torn_last_line(log):
+    log.append([event(0, 'a')])
+    with open(os.path.join(log.directory, _segment_name(1)), 'ab') as f:
+        f.write(b'{"t":"pageviews","d":{"page"')
+
+    assert [data['page'] for _, data in log.iter_events()] == ['a']
+
+
+def test_compaction_expires_old_events_and_merges_segments(tmp_path):
+    log = ShopEventLog(str(tmp_path / 'shop'), segment_max_bytes=150, retention_days=30)
+    for days_ago in (90, 80, 70, 60, 20, 10):
+        log.append([event(days_ago, f"old{days_ago}"), event(days_ago), event(0, 'new')])
+    log.append([event(0, 'active')])
+    assert len(log.segments()) == 7
+
+    removed = log.compact(min_segments=2, now=NOW)
+
+    # Die vier abgelaufenen Segmente schrumpfen auf je ein Ereignis und werden paarweise zusammengeführt
+    assert removed == 2
+    assert len(log.segments()) == 5
+    pages = [data['page'] for _, data in log.iter_events()]
+    assert pages == ['new'] * 4 + ['old20', 'home', 'new', 'old10', 'home', 'new', 'active']
+
+
+def test_expire_removes_fully_expired_segments(tmp_path):
+    log = ShopEventLog(str(tmp_path / 'shop'), segment_max_bytes=100, retention_days=30)
+    for days_ago in (90, 80, 1):
+        log.append([event(days_ago), event(days_ago)])
+
+    assert log.expire(now=NOW) == (2, 4)
+    assert len(list(log.iter_events())) == 2
+
+
+def test_events_are_kept_without_configured_retention(tmp_path):
+    log = ShopEventLog(str(tmp_path / 'shop'), segment_max_bytes=100)
+    for days_ago in (900, 400, 1):
+        log.append([event(days_ago), event(days_ago)])
+
+    log.compact(min_segments=2, now=NOW)
+    assert len(list(log.iter_events())) == 6
+
+
+def test_compaction_without_expired_events_keeps_full_segments(log):
+    for _ in range(5):
+        log.append([event(1), event(1)])
+
+    assert log.compact(min_segments=2, now=NOW) == 0
+    assert len(log.segments()) == 5
+
+
+def test_replace_swaps_before_removing_segments(log):
+    for i in range(4):
+        log.append([event(0, f"p{i}"), event(0, f"p{i}")])
+
+    log.replace([event(0, 'fresh')])
+
+    assert log.segments() == [1]
+    assert [data['page'] for _, data in log.iter_events()] == ['fresh']
+    assert not os.path.exists(os.path.join(log.directory, JOURNAL_FILE))
+
+
+def test_interrupted_swap_is_completed_or_rolled_back(tmp_path):
+    directory = str(tmp_path / 'shop')
+    log = ShopEventLog(directory, segment_max_bytes=100, retention_days=0)
+    for i in range(3):
+        log.append([event(0, f"p{i}"), event(0, f"p{i}")])
+
+    # Absturz nach dem Austausch: Segment 1 enthält schon alles, 2 und 3 stehen noch im Journal
+    with open(os.path.join(directory, _segment_name(1)), 'ab') as f:
+        for number in (2, 3):
+            with open(os.path.join(directory, _segment_name(number)), 'rb') as src:
+                f.write(src.read())
+    with open(os.path.join(directory, JOURNAL_FILE), 'w') as f:
+        json.dump({"tmp": _segment_name(1) + '.compact', "remove": [2, 3]}, f)
+
+    recovered = ShopEventLog(directory, segment_max_bytes=100, retention_days=0)
+    assert recovered.segments() == [1]
+    assert [data['page'] for _, data in recovered.iter_events()] == ['p0', 'p0', 'p1', 'p1', 'p2', 'p2']
+
+    # Absturz vor dem Austausch: Temporärdatei wird verworfen, die Segmente bleiben
+    tmp_path_file = os.path.join(directory, _segment_name(1) + '.replace')
+    with open(tmp_path_file, 'wb') as f:
+        f.write(b'{"t":"pageviews","d":{"page":"lost"}}\n')
+    with open(os.path.join(directory, JOURNAL_FILE), 'w') as f:
+        json.dump({"tmp": os.path.basename(tmp_path_file), "remove": [1]}, f)
+
+    recovered = ShopEventLog(directory, segment_max_bytes=100, retention_days=0)
+    assert not os.path.exists(tmp_path_file)
+    assert len(list(recovered.iter_events())) == 6
+
+
+def test_shop_tracking_data_streams_from_event_store():
+    shop = 'tracking-view.myshopify.com'
+    data_models.add_tracking_events([(shop, 'pageviews', {'page': '/a'}), (shop, 'clicks', {'element': 'b'})])
+
+    shop_data = data_models.get_shop_tracking_data(shop)
+    assert isinstance(shop_data['pageviews'], data_models.TrackingEvents)
+    # Jede Iteration liest erneut aus dem Log
+    assert [event['page'] for event in shop_data['pageviews']] == ['/a']
+    assert [event['page'] for event in shop_data['pageviews']] == ['/a']
+
+    # Unveränderte Sichten überschreiben beim Speichern nichts
+    data_models.save_tracking_data(data_models.load_tracking_data())
+    assert [event['element'] for event in data_models.get_shop_tracking_data(shop)['clicks']] == ['b']
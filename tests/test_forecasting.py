@@ -0,0 +1,36 @@
+import datetime
+
+import pytest
+
+import forecasting
+import data_models
+from metrics_store import SQLiteMetricsBackend
+
+SHOP = 'forecast.myshopify.com'
+
+
+def test_forecast_starts_today_from_complete_days(tmp_path):
+    backend = SQLiteMetricsBackend(str(tmp_path / 'metrics.db'))
+    shop_metrics = data_models.ShopMetrics(SHOP, backend=backend)
+    today = datetime.date.today()
+    for offset in range(1, 43):
+        day = today - datetime.timedelta(days=offset)
+        shop_metrics.set_point('daily_orders', day.isoformat(), 10 + (day.weekday() == 5) * 20)
+    # Der angebrochene heutige Tag darf die Prognose nicht nach unten ziehen
+    shop_metrics.set_point('daily_orders', today.isoformat(), 1)
+    shop_metrics.save_metrics(immediate=True)
+
+    assert forecasting.run_batch([SHOP], metrics=('daily_orders',), horizon=7, backend=backend)["series"] == 1
+    points = forecasting.get_forecast(SHOP, 'daily_orders', backend=backend)["points"]
+
+    assert [point["date"] for point in points] == [(today + datetime.timedelta(days=k)).isoformat()
+                                                  for k in range(7)]
+    saturday = next(point for point in points if datetime.date.fromisoformat(point["date"]).weekday() == 5)
+    weekday = next(point for point in points if datetime.date.fromisoformat(point["date"]).weekday() == 1)
+    assert saturday["value"] > 25 and 5 < weekday["value"] < 15
+
+
+def test_get_forecast_does_not_fit_in_request(tmp_path, monkeypatch):
+    backend = SQLiteMetricsBackend(str(tmp_path / 'metrics.db'))
+    monkeypatch.setattr(forecasting, 'run_batch', lambda *args, **kwargs: pytest.fail('run_batch aufgerufen'))
+    assert forecasting.get_forecast(SHOP, 'daily_orders', backend=backend) is None
@@ -0,0 +1,114 @@
+import datetime
+import time
+
+import numpy as np
+import pytest
+
+import dashboard_snapshots
+import data_models
+import hourly_metrics
+import order_sync
+from timeseries import today_index
+
+SHOP = 'hourly.myshopify.com'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return hourly_metrics.HourlyMetricsStore(str(tmp_path / 'hourly.db'))
+
+
+def test_total_matches_brute_force_sum(store):
+    rng = np.random.default_rng(7)
+    start = int(np.datetime64('2025-01-01T00', 'h').astype(np.int64))
+    hours = start + rng.choice(2 * 365 * 24, size=3000, replace=False)
+    values = rng.integers(1, 50, size=len(hours)).astype(float)
+    store.set_hours(SHOP, 'pageviews', dict(zip(hours.tolist(), values.tolist())))
+    # Geänderte Stunden buchen nur die Differenz in die Rollups
+    store.set_hours(SHOP, 'pageviews', {int(hours[0]): 0.0, int(hours[1]): values[1] + 10})
+    values[0], values[1] = 0.0, values[1] + 10
+
+    for _ in range(50):
+        first, end = np.sort(rng.integers(start - 100, start + 2 * 365 * 24 + 100, size=2))
+        expected = values[(hours >= first) & (hours < end)].sum()
+        total = store.total(SHOP, 'pageviews', int(first), int(end))
+        assert (total or 0.0) == pytest.approx(expected)
+
+
+def test_series_uses_weeks_for_a_year(store):
+    end = (today_index() + 1) * 24
+    store.set_hours(SHOP, 'orders', {end - 1: 2.0, end - 300 * 24: 3.0})
+    resolution, buckets, values = store.series(SHOP, 'orders', end - 365 * 24, end)
+    assert resolution == hourly_metrics.WEEK
+    assert len(buckets) <= hourly_metrics.HOURLY_SERIES_MAX_POINTS
+    assert values.sum() == 5.0
+
+
+def test_orders_are_booked_hourly(tmp_path, store):
+    sync_store = order_sync.OrderSyncStore(str(tmp_path / 'order_sync.db'))
+    day = '2026-10-01'
+    node = {'id': 'gid://shopify/Order/1', 'createdAt': f"{day}T10:15:00Z",
+            'updatedAt': f"{day}T10:15:00Z", 'totalPrice': '40'}
+    sync_store.claim(SHOP, [node])
+    order_sync.publish_days(SHOP, lambda revenue, orders: None, sync_store, hourly_store=store)
+
+    hour = order_sync.order_hour(node)
+    assert hour == int(np.datetime64(f"{day}T10", 'h').astype(np.int64))
+    assert store.total(SHOP, 'revenue', hour, hour + 1) == 40.0
+
+    # Stornierung setzt die Stunde zurück
+    sync_store.claim(SHOP, [dict(node, cancelledAt=f"{day}T12:00:00Z", updatedAt=f"{day}T12:00:00Z")])
+    order_sync.publish_days(SHOP, lambda revenue, orders: None, sync_store, hourly_store=store)
+    assert store.total(SHOP, 'orders', hour - 24, hour + 24) == 0.0
+
+
+def test_bucketed_total_includes_older_daily_history(monkeypatch, store):
+    monkeypatch.setattr(hourly_metrics, 'get_hourly_store', lambda: store)
+    shop_metrics = data_models.ShopMetrics('daily-history.myshopify.com')
+    today = datetime.date.today()
+    for offset in range(10):
+        shop_metrics.set_point('daily_pageviews', (today - datetime.timedelta(days=offset)).isoformat(), 5)
+    shop_metrics.save_metrics(immediate=True)
+    # Stündlich gespeichert sind nur die letzten beiden Tage
+    first_hour = (today_index() - 1) * 24
+    store.set_hours(shop_metrics.shop_domain, 'pageviews', {first_hour: 4.0, first_hour + 30: 6.0})
+
+    series = shop_metrics.get_series('daily_pageviews').window(30)
+    assert dashboard_snapshots._bucketed_total(shop_metrics, 'pageviews', 30, series) == 8 * 5 + 10
+    records = dashboard_snapshots._bucketed_records(shop_metrics, 'pageviews', 90,
+                                                    shop_metrics.get_series('daily_pageviews').window(90))
+    assert sum(record["value"] for record in records) == 8 * 5 + 10
+
+
+@pytest.fixture
+def berlin_time(monkeypatch):
+    monkeypatch.setenv('TZ', 'Europe/Berlin')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_timestamps_are_converted_to_utc_hours(berlin_time):
+    hours, valid = hourly_metrics.timestamps_to_hours([
+        '2026-07-01T12:30:00',         # lokale Serverzeit, Sommerzeit UTC+2
+        '2026-01-15T12:30:00.123456',  # Winterzeit UTC+1
+        '2026-07-01T12:30:00Z',
+        '2026-07-01T12:30:00+05:30',
+        '2026-07-01T00:15:00-04:00',
+        'kaputt',
+        None,
+    ])
+    expected = ['2026-07-01T10', '2026-01-15T11', '2026-07-01T12', '2026-07-01T07', '2026-07-01T04']
+    assert valid.tolist() == [True] * 5 + [False, False]
+    assert hours[:5].tolist() == [int(np.datetime64(hour, 'h').astype(np.int64)) for hour in expected]
+
+
+def test_pageviews_and_orders_share_utc_hours(tmp_path, monkeypatch, store, berlin_time):
+    monkeypatch.setattr(hourly_metrics, 'get_hourly_store', lambda: store)
+    shop_metrics = data_models.ShopMetrics('traffic-utc.myshopify.com')
+    # Seitenaufruf um 12:15 Berliner Zeit, Bestellung in derselben Minute in UTC
+    shop_metrics.update_traffic_metrics({'pageviews': [{'timestamp': '2026-07-01T12:15:00', 'visitor_id': 'v1'}]})
+    hour = order_sync.order_hour({'createdAt': '2026-07-01T10:15:00Z'})
+
+    assert store.total(shop_metrics.shop_domain, 'pageviews', hour, hour + 1) == 1.0
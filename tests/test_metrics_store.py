@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+import data_models
+from metrics_store import ColumnarMetricsBackend, SQLiteMetricsBackend
+
+SHOP = 'store.myshopify.com'
+
+
+@pytest.fixture(params=['columnar', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'columnar':
+        return ColumnarMetricsBackend(str(tmp_path / 'metrics'))
+    return SQLiteMetricsBackend(str(tmp_path / 'metrics.db'))
+
+
+def test_artifacts_are_not_loaded_with_shop_metrics(backend):
+    backend.save_series(SHOP, 'daily_revenue', {'2026-10-01': 5.0})
+    backend.save_snapshot(SHOP, 'device_stats', {'mobile': 2})
+    backend.save_artifact(SHOP, 'dashboard_snapshot_365', {'sales_data': [0] * 365})
+
+    assert set(backend.load_shop(SHOP)) == {'daily_revenue', 'device_stats'}
+    assert backend.load_artifact(SHOP, 'dashboard_snapshot_365') == {'sales_data': [0] * 365}
+    assert backend.load_artifact(SHOP, 'forecast_daily_revenue', 'missing') == 'missing'
+
+    backend.delete_shop(SHOP)
+    assert backend.load_artifact(SHOP, 'dashboard_snapshot_365') is None
+
+
+def test_legacy_artifact_snapshots_are_ignored(backend):
+    backend.save_snapshot(SHOP, 'forecast_daily_revenue', {'values': [1, 2]})
+    backend.save_snapshot(SHOP, 'device_stats', {'mobile': 2})
+
+    # Neu geöffnetes Backend wie nach einem Update
+    reopened = type(backend)(backend.base_dir if hasattr(backend, 'base_dir') else backend.db_path)
+    assert set(reopened.load_shop(SHOP)) == {'device_stats'}
+
+
+def test_count_metrics_keep_integer_values(backend):
+    backend.save_series(SHOP, 'daily_orders', {'2026-10-01': 3, '2026-10-02': 4})
+    backend.increment_series(SHOP, 'daily_orders', {'2026-10-02': 1})
+    backend.save_series(SHOP, 'daily_revenue', {'2026-10-01': 3})
+
+    days, values = backend.load_series_arrays(SHOP, 'daily_orders')
+    assert values.dtype.kind == 'i' and values.tolist() == [3, 5]
+    assert backend.load_series_arrays(SHOP, 'daily_revenue')[1].dtype.kind == 'f'
+    assert all(type(value) is int for value in backend.load_series(SHOP, 'daily_orders').values())
+
+
+def test_shop_metrics_read_series_lazily_as_arrays(backend, monkeypatch):
+    backend.save_series(SHOP, 'daily_orders', {'2026-10-01': 3, '2026-10-03': 1})
+    backend.save_snapshot(SHOP, 'device_stats', {'mobile': 2})
+    monkeypatch.setattr(type(backend), 'load_shop', lambda *args: pytest.fail('load_shop aufgerufen'))
+
+    shop_metrics = data_models.ShopMetrics(SHOP, backend=backend)
+    assert dict(shop_metrics.metrics) == {'device_stats': {'mobile': 2}}
+
+    shop_metrics.increment_point('daily_orders', '2026-10-03', 2)
+    shop_metrics.set_point('daily_orders', '2026-10-04', 7)
+    series = shop_metrics.get_series('daily_orders')
+    assert series.integral
+    assert series.to_points() == {'2026-10-01': 3, '2026-10-03': 3, '2026-10-04': 7}
+    assert shop_metrics.get_series('device_stats') is None
+    assert shop_metrics.get_series('daily_visitors') is None
+
+
+def test_columnar_delete_waits_for_shop_lock(tmp_path):
+    backend = ColumnarMetricsBackend(str(tmp_path / 'metrics'))
+    backend.save_series(SHOP, 'daily_revenue', {'2026-10-01': 5.0})
+    deleted = threading.Event()
+
+    with backend._lock(SHOP, backend._path(SHOP, 'daily_revenue', '.npy')):
+        worker = threading.Thread(target=lambda: (backend.delete_shop(SHOP), deleted.set()))
+        worker.start()
+        # Ein laufender Schreiber hält die Shop-Sperre geteilt
+        assert not deleted.wait(0.2)
+    worker.join()
+    assert not backend.has_shop(SHOP)
@@ -0,0 +1,56 @@
+import sqlite3
+from collections import defaultdict
+
+import data_models
+from metrics_store import SQLiteMetricsBackend
+
+
+class FlakyBackend(SQLiteMetricsBackend):
+    """Schlägt bei den ersten `failures` Delta-Schreibvorgängen fehl"""
+
+    def __init__(self, db_path, failures=1):
+        super().__init__(db_path)
+        self.failures = failures
+
+    def increment_series(self, shop, metric, deltas):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        super().increment_series(shop, metric, deltas)
+
+
+def _deltas(**values):
+    deltas = defaultdict(lambda: defaultdict(float))
+    for metric_name, (date, delta) in values.items():
+        deltas[metric_name][date] += delta
+    return deltas
+
+
+def test_failed_flush_is_retried_without_double_counting(tmp_path):
+    backend = FlakyBackend(str(tmp_path / 'metrics.db'))
+    buffer = data_models.MetricsWriteBehind(interval=3600)
+
+    buffer.submit('a.myshopify.com', backend, {'daily_visitors': {'2026-01-01': 5}},
+                  _deltas(daily_orders=('2026-01-01', 2)), {'device_stats': {'mobile': 1}})
+    assert buffer.flush() == 0
+    assert buffer.pending_shops() == ['a.myshopify.com']
+    # Punkte wurden vor dem Fehler geschrieben und nicht erneut eingereiht
+    assert backend.load_series('a.myshopify.com', 'daily_visitors') == {'2026-01-01': 5.0}
+
+    buffer.submit('a.myshopify.com', backend, {}, _deltas(daily_orders=('2026-01-01', 3)), {})
+    assert buffer.flush() == 1
+    assert buffer.pending_shops() == []
+    assert backend.load_series('a.myshopify.com', 'daily_orders') == {'2026-01-01': 5.0}
+    assert backend.load_snapshot('a.myshopify.com', 'device_stats') == {'mobile': 1}
+
+
+def test_newer_point_replaces_requeued_deltas(tmp_path):
+    backend = FlakyBackend(str(tmp_path / 'metrics.db'))
+    buffer = data_models.MetricsWriteBehind(interval=3600)
+
+    buffer.submit('a.myshopify.com', backend, {}, _deltas(daily_orders=('2026-01-01', 2)), {})
+    buffer.flush()
+    buffer.submit('a.myshopify.com', backend, {'daily_orders': {'2026-01-01': 7}}, _deltas(), {})
+    buffer.flush()
+
+    assert backend.load_series('a.myshopify.com', 'daily_orders') == {'2026-01-01': 7.0}
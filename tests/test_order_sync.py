@@ -0,0 +1,190 @@
+import sqlite3
+import datetime
+import threading
+
+import pytest
+
+import order_sync
+import data_models
+from metrics_store import SQLiteMetricsBackend
+
+SHOP = 'test.myshopify.com'
+TODAY = datetime.date.today().isoformat()
+
+
+def order(number, price, day=TODAY, refunded=0.0, cancelled=False, updated='2026-01-01T00:00:00Z'):
+    return {
+        'id': f"gid://shopify/Order/{number}",
+        'createdAt': f"{day}T10:00:00Z",
+        'updatedAt': updated,
+        'cancelledAt': '2026-01-01T00:00:00Z' if cancelled else None,
+        'totalPrice': str(price),
+        'totalRefundedSet': {'shopMoney': {'amount': refunded}},
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return order_sync.OrderSyncStore(str(tmp_path / 'order_sync.db'))
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SQLiteMetricsBackend(str(tmp_path / 'metrics.db'))
+
+
+def daily(backend, metric):
+    return backend.load_series(SHOP, metric).get(TODAY)
+
+
+def test_repeated_orders_are_counted_once(store, backend):
+    nodes = [order(1, 10), order(2, 20)]
+    order_sync.apply_order_nodes(SHOP, nodes, backend=backend, store=store)
+    order_sync.apply_order_nodes(SHOP, nodes, backend=backend, store=store)
+
+    assert daily(backend, 'daily_revenue') == 30.0
+    assert daily(backend, 'daily_orders') == 2.0
+
+
+def test_update_and_cancellation_replace_previous_contribution(store, backend):
+    order_sync.apply_order_nodes(SHOP, [order(1, 10), order(2, 20)], backend=backend, store=store)
+    order_sync.apply_order_nodes(SHOP, [order(1, 10, refunded=4.0)], backend=backend, store=store)
+    assert daily(backend, 'daily_revenue') == 26.0
+
+    order_sync.apply_order_nodes(SHOP, [order(2, 20, cancelled=True)], backend=backend, store=store)
+    assert daily(backend, 'daily_revenue') == 6.0
+    assert daily(backend, 'daily_orders') == 1.0
+
+
+def test_refund_is_applied_once(store, backend):
+    order_sync.apply_order_nodes(SHOP, [order(1, 50)], backend=backend, store=store)
+
+    assert order_sync.apply_refund(SHOP, 'gid://shopify/Order/1', 'r1', 15.0, backend=backend, store=store)
+    assert not order_sync.apply_refund(SHOP, 'gid://shopify/Order/1', 'r1', 15.0, backend=backend, store=store)
+    assert not order_sync.apply_refund(SHOP, 'gid://shopify/Order/9', 'r2', 5.0, backend=backend, store=store)
+    assert daily(backend, 'daily_revenue') == 35.0
+
+
+def test_orders_before_start_day_are_ignored(store, backend):
+    store.save_state(SHOP, '2026-01-01T00:00:00Z', TODAY)
+    yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+
+    order_sync.apply_order_nodes(SHOP, [order(1, 10, day=yesterday), order(2, 5)], backend=backend, store=store)
+
+    assert backend.load_series(SHOP, 'daily_revenue') == {TODAY: 5.0}
+
+
+def test_concurrent_claims_do_not_double_count(tmp_path):
+    db_path = str(tmp_path / 'order_sync.db')
+    backend = SQLiteMetricsBackend(str(tmp_path / 'metrics.db'))
+    nodes = [order(number, 1) for number in range(200)]
+    errors = []
+
+    def worker():
+        try:
+            # Eigener Store je Thread wie in getrennten Gunicorn-Workern
+            order_sync.apply_order_nodes(SHOP, nodes, backend=backend,
+                                         store=order_sync.OrderSyncStore(db_path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert daily(backend, 'daily_revenue') == 200.0
+    assert daily(backend, 'daily_orders') == 200.0
+
+
+class FailingBackend(SQLiteMetricsBackend):
+    fail = True
+
+    def save_series(self, shop, metric, points):
+        if self.fail:
+            raise sqlite3.OperationalError("database is locked")
+        super().save_series(shop, metric, points)
+
+
+def test_failed_metric_write_is_published_later(store, tmp_path):
+    backend = FailingBackend(str(tmp_path / 'metrics.db'))
+    with pytest.raises(sqlite3.OperationalError):
+        order_sync.apply_order_nodes(SHOP, [order(1, 10)], backend=backend, store=store)
+
+    backend.fail = False
+    # Wiederholte Zustellung derselben Bestellung: kein Delta mehr, der offene Tag wird trotzdem geschrieben
+    order_sync.apply_order_nodes(SHOP, [order(1, 10)], backend=backend, store=store)
+    assert daily(backend, 'daily_revenue') == 10.0
+    assert store.dirty_totals(SHOP)[0] == {}
+
+
+def test_sync_keeps_high_water_mark_when_metrics_fail(store, tmp_path, monkeypatch):
+    backend = FailingBackend(str(tmp_path / 'metrics.db'))
+    backend.fail = False
+    store.save_state(SHOP, '2026-01-01T00:00:00Z', TODAY)
+    monkeypatch.setattr(order_sync.shopify_api, 'iter_orders',
+                        lambda *args, **kwargs: iter([{'node': order(1, 10, updated='2026-02-01T00:00:00Z')}]))
+    monkeypatch.setattr(order_sync.recommender, 'apply_orders', lambda *args, **kwargs: None)
+
+    shop_metrics = data_models.ShopMetrics(SHOP, backend=backend)
+    backend.fail = True
+    with pytest.raises(sqlite3.OperationalError):
+        order_sync.sync_orders(SHOP, 'token', shop_metrics, store=store)
+    assert store.get_state(SHOP)[0] == '2026-01-01T00:00:00Z'
+
+    backend.fail = False
+    result = order_sync.sync_orders(SHOP, 'token', data_models.ShopMetrics(SHOP, backend=backend), store=store)
+    assert result['high_water_mark'] == '2026-02-01T00:00:00Z'
+    assert daily(backend, 'daily_revenue') == 10.0
+
+
+def test_revenue_metrics_only_touch_days_in_stream(backend):
+    shop_metrics = data_models.ShopMetrics(SHOP, backend=backend)
+    shop_metrics.set_point('daily_revenue', TODAY, 99.0)
+    shop_metrics.set_point('daily_orders', TODAY, 3)
+    shop_metrics.save_metrics(immediate=True)
+
+    yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    shop_metrics.update_revenue_metrics([
+        {'node': order(1, 30, day=yesterday, refunded=5.0)},
+        {'node': order(2, 20, day=yesterday, cancelled=True)},
+    ])
+    shop_metrics.save_metrics(immediate=True)
+
+    revenue = backend.load_series(SHOP, 'daily_revenue')
+    orders = backend.load_series(SHOP, 'daily_orders')
+    # Netto ohne Stornierung, heute bleibt unverändert
+    assert revenue[yesterday] == 25.0 and orders[yesterday] == 1
+    assert revenue[TODAY] == 99.0 and orders[TODAY] == 3
+    assert shop_metrics.metrics['average_order_value'] == (99.0 + 25.0) / 4
+
+
+def refund_payload(refund_id, amount):
+    return {'id': refund_id, 'order_id': 1,
+            'transactions': [{'kind': 'refund', 'status': 'success', 'amount': str(amount)}]}
+
+
+def test_refund_in_order_update_is_not_applied_again(store, backend):
+    payload = {
+        'id': 1, 'created_at': f"{TODAY}T10:00:00Z", 'updated_at': f"{TODAY}T11:00:00Z",
+        'cancelled_at': None, 'total_price': '50.00', 'line_items': [],
+        'refunds': [refund_payload(77, 15)],
+    }
+    # orders/updated mit der Erstattung wird vor refunds/create zugestellt
+    order_sync.apply_order_nodes(SHOP, [order_sync.webhook_order_node(payload)], backend=backend, store=store)
+    assert not order_sync.apply_refund(SHOP, 'gid://shopify/Order/1', '77',
+                                       order_sync.refund_amount(refund_payload(77, 15)),
+                                       backend=backend, store=store)
+    assert daily(backend, 'daily_revenue') == 35.0
+
+    # Eine weitere, noch unbekannte Erstattung wird verbucht
+    assert order_sync.apply_refund(SHOP, 'gid://shopify/Order/1', '78', 5.0, backend=backend, store=store)
+    assert daily(backend, 'daily_revenue') == 30.0
+
+
+def test_graphql_refund_ids_match_webhook_ids():
+    node = order(1, 50, refunded=15.0)
+    node['refunds'] = [{'id': 'gid://shopify/Refund/77', 'totalRefundedSet': {'shopMoney': {'amount': '15.0'}}}]
+    assert order_sync.order_refunds(node) == [('77', 15.0)]
@@ -0,0 +1,77 @@
+import numpy as np
+
+import rfm
+from rfm import RFMAggregates
+
+SHOP = 'rfm.myshopify.com'
+TODAY = 1000
+
+
+def aggregates():
+    # Kunde 6 hat keine Bestellung
+    return RFMAggregates(
+        ids=[1, 2, 3, 4, 5, 6],
+        last_day=[999, 998, 700, 997, 600, -1],
+        frequency=[10, 8, 9, 1, 1, 0],
+        monetary=[1000.0, 800.0, 900.0, 10.0, 5.0, 0.0],
+    )
+
+
+def segment_names(segments):
+    return [rfm.SEGMENTS[code] for code in segments]
+
+
+def test_score_customers_assigns_quantile_scores_and_segments():
+    r, f, m, segments = rfm.score_customers(aggregates(), today=TODAY)
+
+    assert r.tolist() == [5, 4, 2, 3, 1, 1]
+    assert f.tolist() == [5, 3, 4, 1, 1, 1]
+    assert m.tolist() == [5, 3, 4, 2, 1, 1]
+    assert segment_names(segments) == ['high_value', 'loyal', 'at_risk', 'potential', 'inactive', 'inactive']
+
+
+def test_score_customers_without_buyers():
+    empty = RFMAggregates([1, 2], [-1, -1], [0, 0], [0.0, 0.0])
+    r, f, m, segments = rfm.score_customers(empty, today=TODAY)
+
+    assert r.tolist() == f.tolist() == m.tolist() == [1, 1]
+    assert segment_names(segments) == ['inactive', 'inactive']
+
+
+def test_equal_values_share_a_score():
+    scores = rfm.quantile_scores([1, 1, 1, 1, 2, 5])
+    assert len(set(scores[:4].tolist())) == 1
+
+
+def test_changed_rows_without_previous_run_returns_all_customers():
+    current = aggregates()
+    rows, removed = rfm.changed_rows(SHOP, current, *rfm.score_customers(current, today=TODAY))
+
+    assert [row[1] for row in rows] == [1, 2, 3, 4, 5, 6]
+    assert rows[0][:6] == (SHOP, 1, 'high_value', '1972-09-26', 10, 1000.0)
+    # Kunde ohne Bestellung hat kein Datum der letzten Bestellung
+    assert rows[5][3] is None
+    assert len(removed) == 0
+
+
+def test_changed_rows_returns_only_differences():
+    old = aggregates()
+    previous = (old, *rfm.score_customers(old, today=TODAY))
+    rows, removed = rfm.changed_rows(SHOP, old, *previous[1:], previous=previous)
+    assert rows == [] and len(removed) == 0
+
+    # Kunde 2 kauft erneut, Kunde 5 ist gelöscht, Kunde 7 ist neu
+    current = RFMAggregates(
+        ids=[1, 2, 3, 4, 6, 7],
+        last_day=[999, 1000, 700, 997, -1, -1],
+        frequency=[10, 9, 9, 1, 0, 0],
+        monetary=[1000.0, 850.0, 900.0, 10.0, 0.0, 0.0],
+    )
+    rows, removed = rfm.changed_rows(SHOP, current, *rfm.score_customers(current, today=TODAY),
+                                     previous=previous)
+
+    changed_ids = {row[1] for row in rows}
+    assert {2, 7} <= changed_ids
+    assert 6 not in changed_ids
+    assert removed.tolist() == [5]
+    assert np.isin(list(changed_ids), current.ids).all()
@@ -0,0 +1,41 @@
+import fakeredis
+import pytest
+
+from shop_cache import RedisCacheBackend
+
+SHOP = 'cache.myshopify.com'
+
+
+@pytest.fixture(params=[7, 6], ids=['expire-options', 'ttl-compare'])
+def backend(request):
+    # Redis 6 kennt EXPIRE NX/GT nicht und nutzt den TTL-Vergleich
+    return RedisCacheBackend(fakeredis.FakeRedis(version=request.param), prefix='test')
+
+
+def index_ttl(backend):
+    return backend.client.ttl(backend._index_key(SHOP))
+
+
+def test_new_index_gets_expiry(backend):
+    backend.set(SHOP, 'test:a', b'1', 100)
+    assert 190 < index_ttl(backend) <= 200
+    assert backend.get('test:a') == b'1'
+
+
+def test_short_entry_does_not_shorten_index(backend):
+    backend.set(SHOP, 'test:long', b'1', 3600)
+    backend.set(SHOP, 'test:short', b'2', 60)
+    assert index_ttl(backend) > 3600
+
+    backend.set(SHOP, 'test:longer', b'3', 7200)
+    assert index_ttl(backend) > 7200
+
+
+def test_delete_shop_removes_all_entries(backend):
+    backend.set(SHOP, 'test:long', b'1', 3600)
+    backend.set(SHOP, 'test:short', b'2', 60)
+    backend.set('other.myshopify.com', 'test:other', b'3', 60)
+
+    assert backend.delete_shop(SHOP) == 2
+    assert backend.get('test:long') is None and backend.get('test:short') is None
+    assert backend.get('test:other') == b'3'
@@ -0,0 +1,57 @@
+import fakeredis
+import pytest
+
+import dashboard_snapshots
+import scheduler
+
+SHOP = 'lock.myshopify.com'
+
+
+@pytest.fixture
+def shop_lock(tmp_path, monkeypatch):
+    lock = scheduler.FileShopLock(str(tmp_path / 'locks'))
+    monkeypatch.setattr(scheduler, '_shop_lock', lock)
+    return lock
+
+
+def test_refresh_skips_sync_while_shop_is_locked(shop_lock, monkeypatch):
+    monkeypatch.setattr(dashboard_snapshots, '_sync_and_build',
+                        lambda *args: pytest.fail('Synchronisation trotz gehaltener Sperre'))
+    other_worker = scheduler.FileShopLock(shop_lock.directory)
+    assert other_worker.acquire(SHOP)
+    try:
+        snapshots = dashboard_snapshots.refresh_shop(SHOP, 'token')
+    finally:
+        other_worker.release(SHOP)
+    assert set(snapshots) == set(dashboard_snapshots.SNAPSHOT_PERIODS)
+
+
+def test_refresh_holds_shop_lock_during_sync(shop_lock, monkeypatch):
+    def sync_and_build(shop, access_token):
+        # Ein Scheduler-Worker bekommt die Sperre während der Synchronisation nicht
+        assert not scheduler.FileShopLock(shop_lock.directory).acquire(shop)
+        return {}
+
+    monkeypatch.setattr(dashboard_snapshots, '_sync_and_build', sync_and_build)
+    assert dashboard_snapshots.refresh_shop(SHOP, 'token') == {}
+    assert shop_lock.acquire(SHOP)
+    shop_lock.release(SHOP)
+
+
+def test_redis_lock_is_renewed_while_held(monkeypatch):
+    client = fakeredis.FakeRedis()
+    lock = scheduler.RedisShopLock(client, ttl=60)
+    monkeypatch.setattr(lock, '_ensure_renewer', lambda: None)
+    key = lock._key(SHOP)
+
+    assert lock.acquire(SHOP)
+    client.expire(key, 5)
+    lock.renew()
+    assert client.ttl(key) > 5
+
+    # Von einem anderen Worker übernommene Sperre wird nicht verlängert und nicht freigegeben
+    client.set(key, 'fremd', ex=5)
+    lock.renew()
+    assert client.ttl(key) <= 5
+    lock.release(SHOP)
+    assert client.get(key) == b'fremd'
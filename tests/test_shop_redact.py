@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import data_models
+import order_sync
+from event_buffer import EventBuffer
+from event_store import get_event_store
+from metrics_store import ColumnarMetricsBackend, SQLiteMetricsBackend
+from webhook_queue import WebhookQueue
+
+SHOP = 'redact.myshopify.com'
+OTHER = 'keep.myshopify.com'
+
+
+@pytest.mark.parametrize('backend_class', [SQLiteMetricsBackend, ColumnarMetricsBackend])
+def test_metrics_backend_deletes_only_the_shop(tmp_path, backend_class):
+    backend = backend_class(str(tmp_path / 'metrics.db' if backend_class is SQLiteMetricsBackend else tmp_path))
+    for shop in (SHOP, OTHER):
+        backend.save_series(shop, 'daily_revenue', {'2026-10-01': 10.0})
+        backend.save_artifact(shop, 'dashboard_snapshot_7', {'total_sales': 10.0})
+
+    backend.delete_shop(SHOP)
+
+    assert not backend.has_shop(SHOP)
+    assert backend.load_shop(SHOP) == {}
+    assert backend.load_series(OTHER, 'daily_revenue') == {'2026-10-01': 10.0}
+
+
+def test_order_sync_store_deletes_contributions_and_state(tmp_path):
+    store = order_sync.OrderSyncStore(str(tmp_path / 'order_sync.db'))
+    node = {'id': 'gid://shopify/Order/1', 'createdAt': '2026-10-01T10:00:00Z',
+            'updatedAt': '2026-10-01T10:00:00Z', 'totalPrice': '10'}
+    for shop in (SHOP, OTHER):
+        store.save_state(shop, '2026-10-01T10:00:00Z', '2026-09-01')
+        store.claim(shop, [node])
+        store.apply_refund(shop, node['id'], 'r1', 2.0)
+
+    store.delete_shop(SHOP)
+
+    assert store.get_state(SHOP) == (None, None)
+    assert store.daily_totals(SHOP, '2026-01-01') == {}
+    assert store.dirty_totals(SHOP) == ({}, {})
+    # Nach dem Löschen wird die Erstattung wieder als neu erkannt, andere Shops bleiben unberührt
+    assert store.apply_refund(SHOP, node['id'], 'r1', 2.0) is None
+    assert store.daily_totals(OTHER, '2026-01-01') == {'2026-10-01': (8.0, 1)}
+
+
+def test_webhook_queue_deletes_shop_jobs(tmp_path):
+    queue = WebhookQueue(str(tmp_path / 'webhooks.db'))
+    queue.enqueue('w1', 'orders/create', SHOP, {'email': 'kunde@example.com'})
+    queue.enqueue('w2', 'orders/create', OTHER, {})
+
+    assert queue.delete_shop(SHOP) == 1
+    assert [job['shop'] for job in queue.claim()] == [OTHER]
+
+
+def test_event_buffer_discards_shop_events():
+    buffer = EventBuffer(writer=lambda batch: None)
+    buffer._ensure_worker = lambda: None
+    buffer.add(SHOP, 'pageviews', {'page': '/'})
+    buffer.add(OTHER, 'pageviews', {'page': '/'})
+
+    assert buffer.discard_shop(SHOP) == 1
+    assert buffer.get_stats(SHOP)['pending'] == 0
+    assert buffer.get_stats()['buffered'] == 1
+
+
+def test_delete_shop_data_removes_metrics_events_and_registry():
+    data_models.register_shop(SHOP, 'token')
+    shop_metrics = data_models.ShopMetrics(SHOP, write_behind=True)
+    shop_metrics.set_point('daily_revenue', '2026-10-01', 10.0)
+    shop_metrics.save_metrics(immediate=True)
+    shop_metrics.set_point('daily_revenue', '2026-10-02', 5.0)
+    shop_metrics.save_metrics()
+    store = get_event_store()
+    store.append(SHOP, [('pageviews', {'page': '/', 'timestamp': '2026-10-01T10:00:00'})])
+
+    data_models.delete_shop_data(SHOP)
+    data_models.get_metrics_write_behind().flush()
+
+    assert SHOP not in data_models.get_installed_shops()
+    assert data_models.get_metrics_backend().load_shop(SHOP) == {}
+    assert list(store.iter_shop_events(SHOP)) == []
+    assert not os.path.isdir(store._shop_dir(SHOP))
@@ -0,0 +1,81 @@
+import math
+
+import numpy as np
+import pytest
+
+from timeseries import DailySeries
+
+
+def series(start, values, integral=False):
+    return DailySeries(start, np.array(values, dtype='<f8'), integral)
+
+
+def as_list(s):
+    return [None if math.isnan(v) else v for v in s.values.tolist()]
+
+
+def test_slice_inside_range():
+    s = series(100, [1, 2, 3, 4, 5])
+    part = s.slice(101, 103)
+    assert part.start == 101
+    assert as_list(part) == [2, 3, 4]
+
+
+def test_slice_pads_days_outside_stored_data():
+    s = series(100, [1, 2, 3], integral=True)
+    part = s.slice(98, 104)
+    assert part.start == 98 and part.integral
+    assert as_list(part) == [None, None, 1, 2, 3, None, None]
+
+
+def test_slice_without_overlap_and_empty_range():
+    s = series(100, [1, 2, 3])
+    assert as_list(s.slice(200, 202)) == [None, None, None]
+    assert len(s.slice(105, 104)) == 0
+
+
+def test_slice_copies_values():
+    s = series(100, [1, 2, 3])
+    s.slice(100, 102).values[0] = 99
+    assert s.values[0] == 1
+
+
+def test_fill_gaps_zero():
+    s = series(0, [np.nan, 2, np.nan, 4])
+    assert as_list(s.fill_gaps('zero')) == [0, 2, 0, 4]
+
+
+def test_fill_gaps_ffill_starts_with_zero():
+    s = series(0, [np.nan, 2, np.nan, np.nan, 5, np.nan], integral=True)
+    filled = s.fill_gaps('ffill')
+    assert as_list(filled) == [0, 2, 2, 2, 5, 5]
+    assert filled.integral
+
+
+def test_fill_gaps_linear_uses_nearest_value_at_edges():
+    s = series(0, [np.nan, 2, np.nan, np.nan, 8, np.nan], integral=True)
+    filled = s.fill_gaps('linear')
+    assert as_list(filled) == [2, 2, 4, 6, 8, 8]
+    # Interpolierte Werte sind keine ganzen Zahlen mehr
+    assert not filled.integral
+
+
+def test_fill_gaps_all_missing_and_no_gaps():
+    assert as_list(series(0, [np.nan, np.nan]).fill_gaps('linear')) == [0, 0]
+    complete = series(0, [1, 2])
+    assert complete.fill_gaps('ffill') is complete
+
+
+def test_fill_gaps_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        series(0, [1]).fill_gaps('spline')
+
+
+def test_with_points_overlays_and_extends():
+    s = series(100, [1, np.nan, 3], integral=True)
+    updated = s.with_points({'1970-04-12': 9, '1970-04-14': 5})  # Tage 101 und 103
+    assert updated.start == 100
+    assert as_list(updated) == [1, 9, 3, 5]
+    assert updated.integral
+    assert as_list(s) == [1, None, 3]
+    assert not s.with_points({'1970-04-12': 1.5}).integral
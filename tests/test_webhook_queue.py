@@ -0,0 +1,74 @@
+import pytest
+
+from webhook_queue import WebhookQueue, WebhookWorker
+
+SHOP = 'hooks.myshopify.com'
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WebhookQueue(str(tmp_path / 'webhook_queue.db'), max_attempts=3, retry_base_delay=0)
+
+
+def test_duplicate_webhook_ids_are_enqueued_once(queue):
+    assert queue.enqueue('w1', 'orders/create', SHOP, {'id': 1})
+    assert not queue.enqueue('w1', 'orders/create', SHOP, {'id': 1})
+
+    jobs = queue.claim()
+    assert [job['webhook_id'] for job in jobs] == ['w1']
+    assert jobs[0]['payload'] == {'id': 1}
+
+    # Auch nach der Verarbeitung bleibt die ID zur Deduplizierung erhalten
+    queue.complete(jobs[0]['id'])
+    assert not queue.enqueue('w1', 'orders/create', SHOP, {'id': 1})
+    assert queue.claim() == []
+
+
+def test_claimed_jobs_are_reissued_after_lease_expires(tmp_path):
+    queue = WebhookQueue(str(tmp_path / 'webhook_queue.db'), lease_seconds=0)
+    queue.enqueue('w1', 'orders/create', SHOP, {})
+
+    assert len(queue.claim()) == 1
+    # Worker ohne Abschluss gestorben: die Lease ist abgelaufen
+    assert len(queue.claim()) == 1
+
+
+def test_failed_job_is_retried_after_backoff(tmp_path):
+    queue = WebhookQueue(str(tmp_path / 'webhook_queue.db'), max_attempts=3, retry_base_delay=3600)
+    queue.enqueue('w1', 'orders/create', SHOP, {})
+    job = queue.claim()[0]
+
+    assert not queue.fail(job['id'], job['attempts'], RuntimeError('boom'))
+    assert queue.claim() == []
+    assert queue.get_stats()['pending'] == 1
+
+
+def test_worker_moves_job_to_dead_letters_and_requeues(queue):
+    calls = []
+    worker = WebhookWorker(queue)
+
+    @worker.handler('orders/create')
+    def handle(shop, payload):
+        calls.append(payload)
+        if len(calls) <= 3:
+            raise RuntimeError('boom')
+
+    queue.enqueue('w1', 'orders/create', SHOP, {'id': 1})
+    assert worker.process_pending() == 0
+    assert len(calls) == 3
+
+    dead = queue.dead_letters()
+    assert [(job['webhook_id'], job['attempts'], job['last_error']) for job in dead] == [('w1', 3, 'boom')]
+
+    assert queue.requeue_dead(dead[0]['id']) == 1
+    assert worker.process_pending() == 1
+    assert queue.dead_letters() == []
+    assert queue.get_stats()['done'] == 1
+
+
+def test_unhandled_topic_ends_in_dead_letters(queue):
+    worker = WebhookWorker(queue)
+    queue.enqueue('w1', 'unknown/topic', SHOP, {})
+
+    assert worker.process_pending() == 0
+    assert 'Kein Handler' in queue.dead_letters()[0]['last_error']
@@ -0,0 +1,31 @@
+from webhook_registration import desired_subscriptions, diff_subscriptions
+
+BASE_URL = 'https://app.example.com'
+
+
+def test_diff_keeps_matching_and_removes_duplicates():
+    desired = desired_subscriptions(BASE_URL, ('ORDERS_CREATE', 'APP_UNINSTALLED'))
+    existing = [
+        ('1', 'ORDERS_CREATE', f'{BASE_URL}/webhook/orders/create'),
+        ('2', 'ORDERS_CREATE', f'{BASE_URL}/webhook/orders/create'),
+        ('3', 'SHOP_UPDATE', f'{BASE_URL}/webhook/shop/update'),
+    ]
+    to_create, to_delete = diff_subscriptions(desired, existing, BASE_URL, ('ORDERS_CREATE', 'APP_UNINSTALLED'))
+
+    assert to_create == [('APP_UNINSTALLED', f'{BASE_URL}/webhook/app/uninstalled')]
+    assert to_delete == ['2', '3']
+
+
+def test_diff_replaces_managed_topics_on_old_base_url():
+    topics = ('ORDERS_CREATE',)
+    desired = desired_subscriptions(BASE_URL, topics)
+    existing = [
+        # Abonnement von vor einem Domainwechsel der App
+        ('1', 'ORDERS_CREATE', 'https://old.example.com/webhook/orders/create'),
+        # Nicht verwaltetes Topic einer fremden Integration bleibt bestehen
+        ('2', 'PRODUCTS_UPDATE', 'https://other.example.com/hooks'),
+    ]
+    to_create, to_delete = diff_subscriptions(desired, existing, BASE_URL, topics)
+
+    assert to_create == [('ORDERS_CREATE', f'{BASE_URL}/webhook/orders/create')]
+    assert to_delete == ['1']
@@ -0,0 +1,194 @@
+import datetime
+import logging
+import numpy as np
+
+from metrics_store import dates_to_days, days_to_dates
+
+# Logger einrichten
+logger = logging.getLogger('timeseries')
+
+GAP_FILL_METHODS = ('zero', 'ffill', 'linear')
+
+
+def today_index():
+    """Tagesindex (Tage seit 1970-01-01) des heutigen Datums"""
+    return int(np.datetime64(datetime.date.today(), 'D').astype('<i4'))
+
+
+class DailySeries:
+    """
+    Tägliche Zeitreihe als zusammenhängendes float64-Array.
+
+    Position i enthält den Wert des Tages start + i (Tagesindex wie im
+    Metrik-Backend); fehlende Tage sind NaN. Bereichsabfragen sind damit
+    reine Slices, Summen, Mittelwerte und Lückenfüllung laufen vektorisiert.
+    """
+
+    __slots__ = ('start', 'values', 'integral')
+
+    def __init__(self, start, values, integral=False):
+        self.start = int(start)
+        self.values = np.asarray(values, dtype='<f8')
+        # Ganzzahlige Reihen (z.B. Bestellungen) werden wieder als int ausgegeben
+        self.integral = integral
+
+    @classmethod
+    def empty(cls):
+        return cls(today_index(), np.empty(0))
+
+    @classmethod
+    def from_arrays(cls, days, values):
+        """Erstellt eine Reihe aus Tagesindizes und Werten (beliebige Reihenfolge, Lücken erlaubt)"""
+        days = np.asarray(days, dtype='<i4')
+        raw = np.asarray(values)
+        if len(days) == 0:
+            return cls.empty()
+
+        start = int(days.min())
+        dense = np.full(int(days.max()) - start + 1, np.nan)
+        dense[days - start] = raw
+        return cls(start, dense, integral=raw.dtype.kind in 'iub')
+
+    @classmethod
+    def from_points(cls, points):
+        """Erstellt eine Reihe aus einem {'YYYY-MM-DD': Wert}-Dictionary"""
+        if not points:
+            return cls.empty()
+        return cls.from_arrays(dates_to_days(list(points.keys())), list(points.values()))
+
+    @classmethod
+    def from_record_array(cls, arr):
+        """Erstellt eine Reihe aus einem strukturierten Array des spaltenorientierten Backends"""
+        return cls.from_arrays(arr['day'], arr['value'])
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def end(self):
+        """Tagesindex des letzten Tages (inklusive)"""
+        return self.start + len(self.values) - 1
+
+    def slice(self, first_day, last_day):
+        """
+        Gibt die Reihe für [first_day, last_day] zurück.
+
+        Tage außerhalb der gespeicherten Daten werden als NaN ergänzt, es
+        wird nur ein Teilbereich kopiert.
+        """
+        length = max(0, last_day - first_day + 1)
+        out = np.full(length, np.nan)
+        lo = max(first_day, self.start)
+        hi = min(last_day, self.end)
+        if lo <= hi:
+            out[lo - first_day:hi - first_day + 1] = self.values[lo - self.start:hi - self.start + 1]
+        return DailySeries(first_day, out, self.integral)
+
+    def with_points(self, points):
+        """
+        Gibt eine Kopie mit gesetzten Tageswerten zurück (der Bereich wird bei Bedarf erweitert).
+
+        Args:
+            points (dict): {'YYYY-MM-DD': Wert}
+        """
+        if not points:
+            return self
+        update = DailySeries.from_points(points)
+        if len(self.values) == 0:
+            return update
+
+        first_day = min(self.start, update.start)
+        out = self.slice(first_day, max(self.end, update.end))
+        known = ~np.isnan(update.values)
+        out.values[update.start - first_day:update.end - first_day + 1][known] = update.values[known]
+        out.integral = self.integral and update.integral
+        return out
+
+    def window(self, days, end=None):
+        """Gibt die letzten `days` Tage bis einschließlich `end` (Standard: heute) zurück"""
+        end = today_index() if end is None else end
+        return self.slice(end - days + 1, end)
+
+    def fill_gaps(self, method='zero'):
+        """
+        Füllt fehlende Tage.
+
+        Args:
+            method (str): 'zero' (0), 'ffill' (letzter bekannter Wert, davor 0)
+                          oder 'linear' (lineare Interpolation, Ränder mit dem nächsten Wert)
+        """
+        if method not in GAP_FILL_METHODS:
+            raise ValueError(f"Unbekannte Methode zur Lückenfüllung: {method}")
+
+        values = self.values
+        missing = np.isnan(values)
+        if not missing.any():
+            return self
+
+        if method == 'zero':
+            filled = np.where(missing, 0.0, values)
+        elif method == 'ffill':
+            # Index des letzten bekannten Werts je Position
+            idx = np.where(missing, 0, np.arange(len(values)))
+            np.maximum.accumulate(idx, out=idx)
+            filled = values[idx]
+            filled[np.isnan(filled)] = 0.0
+        else:
+            known = np.flatnonzero(~missing)
+            if len(known) == 0:
+                filled = np.zeros_like(values)
+            else:
+                filled = np.interp(np.arange(len(values)), known, values[known])
+        return DailySeries(self.start, filled, self.integral and method != 'linear')
+
+    def sum(self):
+        """Summe aller vorhandenen Werte"""
+        return float(np.nansum(self.values))
+
+    def mean(self, skip_gaps=False):
+        """Mittelwert; fehlende Tage zählen standardmäßig als 0"""
+        if len(self.values) == 0:
+            return 0.0
+        if skip_gaps:
+            known = self.values[~np.isnan(self.values)]
+            return float(known.mean()) if len(known) else 0.0
+        return self.sum() / len(self.values)
+
+    def half_sums(self):
+        """Summen der ersten und zweiten Hälfte (bei ungerader Länge ist die zweite länger)"""
+        half = len(self.values) // 2
+        return float(np.nansum(self.values[:half])), float(np.nansum(self.values[half:]))
+
+    def growth_rate(self):
+        """
+        Prozentuale Veränderung des Tagesmittels der zweiten gegenüber der ersten Hälfte.
+
+        Returns:
+            float: Wachstumsrate in Prozent, 0 wenn keine Basis vorhanden ist
+        """
+        half = len(self.values) // 2
+        if half == 0:
+            return 0
+        first, second = self.half_sums()
+        avg_first = first / half
+        avg_second = second / (len(self.values) - half)
+        if avg_first == 0:
+            return 0
+        return round((avg_second - avg_first) / avg_first * 100, 2)
+
+    def dates(self):
+        """Datumsstrings ('YYYY-MM-DD') aller Tage der Reihe"""
+        return days_to_dates(np.arange(self.start, self.end + 1, dtype='<i4'))
+
+    def to_records(self):
+        """Gibt die Reihe (Lücken als 0) im Format [{"date": ..., "value": ...}] zurück"""
+        values = np.nan_to_num(self.values, nan=0.0)
+        values = values.astype(np.int64).tolist() if self.integral else values.tolist()
+        return [{"date": date, "value": value} for date, value in zip(self.dates().tolist(), values)]
+
+    def to_points(self):
+        """Gibt die vorhandenen Tage als {'YYYY-MM-DD': Wert}-Dictionary zurück"""
+        known = np.flatnonzero(~np.isnan(self.values))
+        values = self.values[known]
+        values = values.astype(np.int64).tolist() if self.integral else values.tolist()
+        return dict(zip(days_to_dates(known + self.start).tolist(), values))
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+# Logger einrichten
+logger = logging.getLogger('webhook_queue')
+
+# Konstanten
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+WEBHOOK_QUEUE_DB_FILE = os.path.join(DATA_DIR, 'webhook_queue.db')
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 8))
+WEBHOOK_RETRY_BASE_DELAY = float(os.environ.get('WEBHOOK_RETRY_BASE_DELAY', 5.0))  # Sekunden
+WEBHOOK_LEASE_SECONDS = float(os.environ.get('WEBHOOK_LEASE_SECONDS', 120.0))
+WEBHOOK_POLL_INTERVAL = float(os.environ.get('WEBHOOK_POLL_INTERVAL', 2.0))  # Sekunden
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', 20))
+# Shopify wiederholt Webhooks bis zu 48 Stunden, erledigte IDs werden länger zur Deduplizierung aufbewahrt
+WEBHOOK_RETENTION_DAYS = int(os.environ.get('WEBHOOK_RETENTION_DAYS', 7))
+
+STATUS_PENDING = 'pending'
+STATUS_PROCESSING = 'processing'
+STATUS_DONE = 'done'
+STATUS_DEAD = 'dead'
+
+SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    webhook_id TEXT NOT NULL UNIQUE,
+    topic TEXT NOT NULL,
+    shop TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_jobs_status_next ON webhook_jobs (status, next_attempt);
+"""
+SQL_ENQUEUE = """
+INSERT OR IGNORE INTO webhook_jobs (webhook_id, topic, shop, payload, status, next_attempt, created_at, updated_at)
+VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)
+"""
+SQL_SELECT_DUE = """
+SELECT id, webhook_id, topic, shop, payload, attempts FROM webhook_jobs
+WHERE status IN ('pending', 'processing') AND next_attempt <= ?
+ORDER BY next_attempt LIMIT ?
+"""
+SQL_CLAIM = "UPDATE webhook_jobs SET status = 'processing', next_attempt = ?, updated_at = ? WHERE id = ?"
+SQL_COMPLETE = "UPDATE webhook_jobs SET status = 'done', payload = '', last_error = NULL, updated_at = ? WHERE id = ?"
+SQL_FAIL = """
+UPDATE webhook_jobs SET status = ?, attempts = ?, next_attempt = ?, last_error = ?, updated_at = ? WHERE id = ?
+"""
+SQL_REQUEUE_DEAD = """
+UPDATE webhook_jobs SET status = 'pending', attempts = 0, next_attempt = ?, updated_at = ?
+WHERE status = 'dead' AND (? IS NULL OR id = ?)
+"""
+SQL_SELECT_DEAD = """
+SELECT id, webhook_id, topic, shop, attempts, last_error, updated_at FROM webhook_jobs
+WHERE status = 'dead' ORDER BY updated_at DESC LIMIT ?
+"""
+SQL_COUNT_BY_STATUS = "SELECT status, COUNT(*) FROM webhook_jobs GROUP BY status"
+SQL_PURGE_DONE = "DELETE FROM webhook_jobs WHERE status = 'done' AND updated_at < ?"
+SQL_DELETE_SHOP = "DELETE FROM webhook_jobs WHERE shop = ?"
+
+
+class WebhookQueue:
+    """Dauerhafte Warteschlange für Webhooks (SQLite, WAL) mit Deduplizierung über die Webhook-ID"""
+
+    def __init__(self, db_path=WEBHOOK_QUEUE_DB_FILE, max_attempts=WEBHOOK_MAX_ATTEMPTS,
+                 retry_base_delay=WEBHOOK_RETRY_BASE_DELAY, lease_seconds=WEBHOOK_LEASE_SECONDS):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self.connection().executescript(SQL_SCHEMA)
+
+    def connection(self):
+        """Gibt die Verbindung des aktuellen Threads zurück"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, webhook_id, topic, shop, payload):
+        """
+        Legt einen Webhook in die Warteschlange.
+
+        Returns:
+            bool: False, wenn die Webhook-ID bereits bekannt ist (Wiederholung durch Shopify)
+        """
+        now = time.time()
+        cursor = self.connection().execute(
+            SQL_ENQUEUE, (webhook_id, topic, shop, json.dumps(payload, separators=(',', ':')), now, now, now)
+        )
+        return cursor.rowcount > 0
+
+    def claim(self, limit=WEBHOOK_BATCH_SIZE):
+        """
+        Reserviert fällige Aufträge für diesen Worker.
+
+        Aufträge in Bearbeitung werden über eine Lease reserviert; stirbt ein
+        Worker, werden sie nach Ablauf der Lease erneut vergeben.
+
+        Returns:
+            list: Aufträge als Dicts
+        """
+        now = time.time()
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(SQL_SELECT_DUE, (now, limit)).fetchall()
+            for row in rows:
+                conn.execute(SQL_CLAIM, (now + self.lease_seconds, now, row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        return [
+            {"id": row[0], "webhook_id": row[1], "topic": row[2], "shop": row[3],
+             "payload": json.loads(row[4]), "attempts": row[5]}
+            for row in rows
+        ]
+
+    def complete(self, job_id):
+        """Markiert einen Auftrag als erledigt; die ID bleibt zur Deduplizierung erhalten"""
+        self.connection().execute(SQL_COMPLETE, (time.time(), job_id))
+
+    def fail(self, job_id, attempts, error):
+        """
+        Plant einen fehlgeschlagenen Auftrag mit exponentiellem Backoff neu ein.
+
+        Returns:
+            bool: True, wenn der Auftrag in die Dead-Letter-Ablage verschoben wurde
+        """
+        now = time.time()
+        attempts += 1
+        dead = attempts >= self.max_attempts
+        status = STATUS_DEAD if dead else STATUS_PENDING
+        next_attempt = now + self.retry_base_delay * (2 ** (attempts - 1))
+        self.connection().execute(SQL_FAIL, (status, attempts, next_attempt, str(error)[:1000], now, job_id))
+        return dead
+
+    def dead_letters(self, limit=100):
+        """Gibt die zuletzt endgültig fehlgeschlagenen Aufträge zurück"""
+        rows = self.connection().execute(SQL_SELECT_DEAD, (limit,)).fetchall()
+        return [
+            {"id": row[0], "webhook_id": row[1], "topic": row[2], "shop": row[3],
+             "attempts": row[4], "last_error": row[5], "failed_at": row[6]}
+            for row in rows
+        ]
+
+    def requeue_dead(self, job_id=None):
+        """Stellt einen (oder alle) Dead-Letter-Aufträge erneut ein"""
+        now = time.time()
+        return self.connection().execute(SQL_REQUEUE_DEAD, (now, now, job_id, job_id)).rowcount
+
+    def purge(self, retention_days=WEBHOOK_RETENTION_DAYS):
+        """Entfernt erledigte Aufträge nach Ablauf der Aufbewahrungsfrist"""
+        cutoff = time.time() - retention_days * 86400
+        return self.connection().execute(SQL_PURGE_DONE, (cutoff,)).rowcount
+
+    def delete_shop(self, shop):
+        """Entfernt alle Aufträge eines Shops samt Payload (z.B. für shop/redact)"""
+        return self.connection().execute(SQL_DELETE_SHOP, (shop,)).rowcount
+
+    def get_stats(self):
+        """Gibt die Anzahl der Aufträge pro Status zurück"""
+        counts = dict(self.connection().execute(SQL_COUNT_BY_STATUS).fetchall())
+        return {status: counts.get(status, 0)
+                for status in (STATUS_PENDING, STATUS_PROCESSING, STATUS_DONE, STATUS_DEAD)}
+
+
+class WebhookWorker:
+    """Hintergrund-Thread, der fällige Webhooks an die registrierten Handler übergibt"""
+
+    def __init__(self, queue, poll_interval=WEBHOOK_POLL_INTERVAL, batch_size=WEBHOOK_BATCH_SIZE):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.handlers = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._worker_pid = None
+
+    def handler(self, *topics):
+        """Decorator zum Registrieren eines Handlers für ein oder mehrere Topics"""
+        def decorator(func):
+            for topic in topics:
+                self.handlers[topic] = func
+            return func
+        return decorator
+
+    def notify(self):
+        """Weckt den Worker nach dem Einreihen eines Webhooks auf"""
+        self.ensure_running()
+        self._wakeup.set()
+
+    def process_pending(self):
+        """
+        Verarbeitet alle aktuell fälligen Aufträge.
+
+        Returns:
+            int: Anzahl erfolgreich verarbeiteter Aufträge
+        """
+        processed = 0
+        while True:
+            jobs = self.queue.claim(self.batch_size)
+            if not jobs:
+                return processed
+
+            for job in jobs:
+                handler = self.handlers.get(job["topic"])
+                try:
+                    if handler is None:
+                        raise LookupError(f"Kein Handler für Topic {job['topic']} registriert")
+                    handler(job["shop"], job["payload"])
+                    self.queue.complete(job["id"])
+                    processed += 1
+                except Exception as e:
+                    if self.queue.fail(job["id"], job["attempts"], e):
+                        logger.error(f"Webhook {job['webhook_id']} ({job['topic']}) endgültig fehlgeschlagen: {e}")
+                    else:
+                        logger.warning(f"Webhook {job['webhook_id']} ({job['topic']}) fehlgeschlagen, neuer Versuch folgt: {e}")
+
+    def ensure_running(self):
+        """Startet den Worker-Thread (nach einem Fork von Gunicorn erneut)"""
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            self._worker_pid = pid
+            self._worker = threading.Thread(target=self._run, name='webhook-worker', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        last_purge = 0
+        while True:
+            try:
+                self.process_pending()
+                if time.time() - last_purge >= 3600:
+                    self.queue.purge()
+                    last_purge = time.time()
+            except Exception as e:
+                logger.error(f"Fehler im Webhook-Worker: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+
+_queue = None
+_worker = None
+_queue_lock = threading.Lock()
+
+
+def get_webhook_queue():
+    """Gibt die prozessweite Webhook-Warteschlange zurück"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WebhookQueue()
+    return _queue
+
+
+def get_webhook_worker():
+    """Gibt den prozessweiten Webhook-Worker zurück"""
+    global _worker
+    if _worker is None:
+        queue = get_webhook_queue()
+        with _queue_lock:
+            if _worker is None:
+                _worker = WebhookWorker(queue)
+    return _worker
@@ -0,0 +1,192 @@
+import os
+import sys
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import shopify_api
+import data_models
+
+# Logger einrichten
+logger = logging.getLogger('webhook_registration')
+
+# Konstanten
+REGISTRATION_MAX_WORKERS = int(os.environ.get('WEBHOOK_REGISTRATION_WORKERS', 8))
+
+# Gewünschte Webhook-Topics. Die GDPR-Pflicht-Webhooks (customers/data_request,
+# customers/redact, shop/redact) werden im Partner-Dashboard konfiguriert und
+# lassen sich nicht über webhookSubscriptionCreate abonnieren.
+DESIRED_TOPICS = (
+    "APP_UNINSTALLED",
+    "SHOP_UPDATE",
+    "ORDERS_CREATE",
+    "ORDERS_UPDATED",
+    "REFUNDS_CREATE",
+)
+
+_executor = ThreadPoolExecutor(max_workers=REGISTRATION_MAX_WORKERS, thread_name_prefix='webhook-registration')
+
+
+def callback_url(base_url, topic):
+    """Gibt die Callback-URL für ein Topic zurück (z.B. ORDERS_CREATE -> /webhook/orders/create)"""
+    return f"{base_url.rstrip('/')}/webhook/{topic.lower().replace('_', '/')}"
+
+
+def desired_subscriptions(base_url, topics=DESIRED_TOPICS):
+    """Gibt die gewünschten Abonnements als Menge von (Topic, Callback-URL) zurück"""
+    return {(topic, callback_url(base_url, topic)) for topic in topics}
+
+
+def existing_subscriptions(shop, access_token):
+    """
+    Lädt alle vorhandenen Webhook-Abonnements des Shops.
+
+    Returns:
+        list: [(id, Topic, Callback-URL oder None)]
+    """
+    subscriptions = []
+    for edge in shopify_api.iter_webhook_subscriptions(shop, access_token):
+        node = edge.get('node', {})
+        endpoint = node.get('endpoint') or {}
+        subscriptions.append((node.get('id'), node.get('topic'), endpoint.get('callbackUrl')))
+    return subscriptions
+
+
+def diff_subscriptions(desired, existing, base_url, managed_topics=DESIRED_TOPICS):
+    """
+    Vergleicht gewünschte mit vorhandenen Abonnements.
+
+    Gelöscht werden Abonnements, die auf diese App zeigen (gleiche Basis-URL), aber
+    nicht mehr gewünscht sind, Duplikate aus früheren Installationen sowie
+    Abonnements verwalteter Topics, deren Callback nicht mehr unter der aktuellen
+    Basis-URL liegt (z.B. nach einem Domainwechsel der App).
+
+    Returns:
+        tuple: (zu erstellende (Topic, URL)-Paare, zu löschende IDs)
+    """
+    webhook_prefix = f"{base_url.rstrip('/')}/webhook/"
+    managed_topics = set(managed_topics)
+    seen = set()
+    to_delete = []
+
+    for subscription_id, topic, url in existing:
+        key = (topic, url)
+        if key in desired and key not in seen:
+            seen.add(key)
+        elif topic in managed_topics or (url and url.startswith(webhook_prefix)):
+            to_delete.append(subscription_id)
+
+    to_create = sorted(desired - seen)
+    return to_create, to_delete
+
+
+def _create_subscription(shop, access_token, topic, url):
+    shopify_api.execute_mutation(
+        shop, access_token, shopify_api.WEBHOOK_SUBSCRIPTION_CREATE_MUTATION,
+        {"topic": topic, "callbackUrl": url}, "webhookSubscriptionCreate"
+    )
+    return topic
+
+
+def _delete_subscription(shop, access_token, subscription_id):
+    shopify_api.execute_mutation(
+        shop, access_token, shopify_api.WEBHOOK_SUBSCRIPTION_DELETE_MUTATION,
+        {"id": subscription_id}, "webhookSubscriptionDelete"
+    )
+    return subscription_id
+
+
+def reconcile_webhooks(shop, access_token, base_url, topics=DESIRED_TOPICS):
+    """
+    Gleicht die Webhook-Abonnements eines Shops mit den gewünschten Topics ab.
+
+    Eine Abfrage lädt den Ist-Stand, danach laufen alle Create- und
+    Delete-Mutationen parallel über den gepoolten Client des Shops.
+
+    Returns:
+        dict: {"created": [...], "deleted": [...], "unchanged": n, "errors": [...]}
+    """
+    desired = desired_subscriptions(base_url, topics)
+    existing = existing_subscriptions(shop, access_token)
+    to_create, to_delete = diff_subscriptions(desired, existing, base_url, topics)
+
+    futures = [
+        ("create", topic, _executor.submit(_create_subscription, shop, access_token, topic, url))
+        for topic, url in to_create
+    ] + [
+        ("delete", subscription_id, _executor.submit(_delete_subscription, shop, access_token, subscription_id))
+        for subscription_id in to_delete
+    ]
+
+    summary = {"created": [], "deleted": [], "unchanged": len(desired) - len(to_create), "errors": []}
+    for action, target, future in futures:
+        try:
+            future.result()
+            summary["created" if action == "create" else "deleted"].append(target)
+        except Exception as e:
+            logger.error(f"Fehler beim Abgleich der Webhooks für {shop} ({action} {target}): {e}")
+            summary["errors"].append(f"{action} {target}: {e}")
+
+    logger.info(f"Webhooks für {shop} abgeglichen: {len(summary['created'])} erstellt, "
+                f"{len(summary['deleted'])} gelöscht, {summary['unchanged']} unverändert")
+    return summary
+
+
+def reconcile_in_background(shop, access_token, base_url, topics=DESIRED_TOPICS):
+    """Startet den Abgleich in einem Hintergrund-Thread, damit die Installation nicht wartet"""
+    def run():
+        try:
+            reconcile_webhooks(shop, access_token, base_url, topics)
+        except Exception as e:
+            logger.error(f"Fehler beim Registrieren der Webhooks für {shop}: {e}")
+
+    thread = threading.Thread(target=run, name=f'webhook-reconcile-{shop}', daemon=True)
+    thread.start()
+    return thread
+
+
+def reconcile_all_shops(base_url, topics=DESIRED_TOPICS, shops=None):
+    """
+    Gleicht die Webhooks aller installierten Shops ab (Offline-Job).
+
+    Returns:
+        dict: {shop: Zusammenfassung}
+    """
+    installed = data_models.get_installed_shops()
+    results = {}
+
+    for shop, entry in installed.items():
+        if shops and shop not in shops:
+            continue
+        access_token = entry.get('access_token')
+        if not access_token:
+            logger.warning(f"Kein Access Token für {shop}, Abgleich übersprungen")
+            continue
+        try:
+            results[shop] = reconcile_webhooks(shop, access_token, base_url, topics)
+        except Exception as e:
+            logger.error(f"Fehler beim Abgleich der Webhooks für {shop}: {e}")
+            results[shop] = {"errors": [str(e)]}
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Webhook-Abonnements aller installierten Shops abgleichen')
+    parser.add_argument('--base-url', default=os.environ.get('APP_URL'), help='Öffentliche Basis-URL der App')
+    parser.add_argument('--shop', action='append', help='Nur diesen Shop abgleichen (mehrfach möglich)')
+    args = parser.parse_args(argv)
+
+    if not args.base_url:
+        parser.error('--base-url oder APP_URL muss gesetzt sein')
+
+    logging.basicConfig(level=logging.INFO)
+    results = reconcile_all_shops(args.base_url, shops=args.shop)
+    failed = [shop for shop, summary in results.items() if summary.get('errors')]
+    print(f"{len(results)} Shops abgeglichen, {len(failed)} mit Fehlern")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())